@@ -0,0 +1,20 @@
+-- Background jobs started by /files/process-batch with execution "batch"
+CREATE TABLE IF NOT EXISTS public.batch_jobs (
+    id UUID PRIMARY KEY,
+    user_id UUID NOT NULL REFERENCES public.users(id) ON DELETE CASCADE,
+    status VARCHAR(20) NOT NULL, -- in_progress, completed, cancelled, failed
+    request JSONB NOT NULL, -- File ids, tag set and model the job was started with
+    result JSONB, -- process_batch_files response once the job finishes
+    error TEXT,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_batch_jobs_user_id ON public.batch_jobs(user_id);
+
+-- Enable RLS
+ALTER TABLE public.batch_jobs ENABLE ROW LEVEL SECURITY;
+
+-- Policy: Users can only access their own batch jobs
+CREATE POLICY "Users can manage own batch jobs" ON public.batch_jobs
+    FOR ALL USING (auth.uid() = user_id);
@@ -0,0 +1,26 @@
+-- Last annotation run per document, used for incremental re-annotation
+CREATE TABLE IF NOT EXISTS public.document_runs (
+    id UUID DEFAULT gen_random_uuid() PRIMARY KEY,
+    user_id UUID NOT NULL REFERENCES public.users(id) ON DELETE CASCADE,
+    document_id TEXT NOT NULL,
+    text_hash VARCHAR(64) NOT NULL,
+    tag_set_hash VARCHAR(64) NOT NULL,
+    run JSONB NOT NULL, -- Text, chunk spans and hashes, entities and chunking parameters
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- One stored run per user and document
+CREATE UNIQUE INDEX IF NOT EXISTS idx_document_runs_user_document ON public.document_runs(user_id, document_id);
+
+-- Enable RLS
+ALTER TABLE public.document_runs ENABLE ROW LEVEL SECURITY;
+
+-- Policy: Users can only access their own document runs
+CREATE POLICY "Users can manage own document runs" ON public.document_runs
+    FOR ALL USING (auth.uid() = user_id);
+
+CREATE TRIGGER update_document_runs_updated_at
+    BEFORE UPDATE ON public.document_runs
+    FOR EACH ROW
+    EXECUTE FUNCTION update_updated_at_column();
@@ -0,0 +1,28 @@
+-- Evaluation verdicts per distinct (text, label[, context]) group, reused across documents
+CREATE TABLE IF NOT EXISTS public.evaluation_verdicts (
+    id UUID DEFAULT gen_random_uuid() PRIMARY KEY,
+    user_id UUID NOT NULL REFERENCES public.users(id) ON DELETE CASCADE,
+    tag_set_hash VARCHAR(64) NOT NULL,
+    entity_key TEXT NOT NULL, -- Normalized surface text, label and optional context signature
+    verdict JSONB NOT NULL, -- is_correct, recommendation, reasoning, suggested_label, confidence
+    model VARCHAR(100) NOT NULL,
+    temperature DOUBLE PRECISION NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- One verdict per user, tag set, model, temperature and group
+CREATE UNIQUE INDEX IF NOT EXISTS idx_evaluation_verdicts_user_tag_set_model_key
+    ON public.evaluation_verdicts(user_id, tag_set_hash, model, temperature, entity_key);
+
+-- Enable RLS
+ALTER TABLE public.evaluation_verdicts ENABLE ROW LEVEL SECURITY;
+
+-- Policy: Users can only access their own verdicts
+CREATE POLICY "Users can manage own evaluation verdicts" ON public.evaluation_verdicts
+    FOR ALL USING (auth.uid() = user_id);
+
+CREATE TRIGGER update_evaluation_verdicts_updated_at
+    BEFORE UPDATE ON public.evaluation_verdicts
+    FOR EACH ROW
+    EXECUTE FUNCTION update_updated_at_column();
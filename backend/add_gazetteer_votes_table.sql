@@ -0,0 +1,20 @@
+-- Surface forms voted for outside annotation validations (manual annotations)
+CREATE TABLE IF NOT EXISTS public.gazetteer_votes (
+    id UUID DEFAULT gen_random_uuid() PRIMARY KEY,
+    user_id UUID NOT NULL REFERENCES public.users(id) ON DELETE CASCADE,
+    tag_set_hash VARCHAR(64) NOT NULL, -- Tag set the vote applies to
+    surface TEXT NOT NULL,
+    label VARCHAR(100) NOT NULL,
+    weight INTEGER NOT NULL, -- 1 accepted, -1 rejected
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_gazetteer_votes_user_tag_set
+    ON public.gazetteer_votes(user_id, tag_set_hash, created_at);
+
+-- Enable RLS
+ALTER TABLE public.gazetteer_votes ENABLE ROW LEVEL SECURITY;
+
+-- Policy: Users can only access their own gazetteer votes
+CREATE POLICY "Users can manage own gazetteer votes" ON public.gazetteer_votes
+    FOR ALL USING (auth.uid() = user_id);
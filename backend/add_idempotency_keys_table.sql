@@ -0,0 +1,22 @@
+-- Responses of requests sent with an Idempotency-Key header, replayed for retries
+CREATE TABLE IF NOT EXISTS public.idempotency_keys (
+    id UUID DEFAULT gen_random_uuid() PRIMARY KEY,
+    user_id UUID NOT NULL REFERENCES public.users(id) ON DELETE CASCADE,
+    scope VARCHAR(50) NOT NULL, -- annotate, process_file, process_batch
+    idempotency_key TEXT NOT NULL,
+    fingerprint VARCHAR(64) NOT NULL, -- Hash of the request content the key was first used for
+    response JSONB NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- One response per user, endpoint and key
+CREATE UNIQUE INDEX IF NOT EXISTS idx_idempotency_keys_user_scope_key
+    ON public.idempotency_keys(user_id, scope, idempotency_key);
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created_at ON public.idempotency_keys(created_at);
+
+-- Enable RLS
+ALTER TABLE public.idempotency_keys ENABLE ROW LEVEL SECURITY;
+
+-- Policy: Users can only access their own idempotency keys
+CREATE POLICY "Users can manage own idempotency keys" ON public.idempotency_keys
+    FOR ALL USING (auth.uid() = user_id);
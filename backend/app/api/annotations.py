@@ -1,10 +1,11 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Header, Request
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any, Union
 from datetime import datetime
 
 from app.api.auth import get_current_user
 from app.database import get_db
+from app.services.cancellation import CancellationToken, time_budget
 
 router = APIRouter()
 
@@ -17,6 +18,20 @@ class AnnotationRequest(BaseModel):
     max_tokens: int = 1000
     chunk_size: int = 1000
     overlap: int = 50
+    chunk_mode: str = "characters"  # "characters", "tokens" or "long_context"
+    chunk_tokens: Optional[int] = None  # Prompt token budget per chunk in "tokens" mode
+    boundary_mode: str = "overlap"  # "overlap" or "stitch"
+    document_id: Optional[str] = None  # Stable id of the document across edits
+    incremental: bool = False  # Re-annotate only chunks that changed since the last run of document_id
+    reuse_near_duplicates: Optional[bool] = None  # Defaults to settings.near_duplicate_reuse
+    cascade: bool = False  # Run chunks on a cheap model first and escalate doubtful ones to `model`
+    cascade_model: Optional[str] = None  # Cheap first-pass model; the provider's default when omitted
+    gazetteer_mode: Optional[str] = None  # "off", "merge" or "skip"; defaults to settings.gazetteer_mode
+    use_student: Optional[bool] = None  # Route confident chunks to the local student model; defaults to settings.student_routing
+    chunk_filter_mode: Optional[str] = None  # "off", "reduce" or "skip"; defaults to settings.chunk_filter_mode
+    tag_shard_size: Optional[int] = None  # Most tags per prompt shard; defaults to settings.tag_shard_size
+    auto_tune: bool = False  # Replace chunk_size, overlap and max_tokens with values learned from past runs (character chunking)
+    time_budget_seconds: Optional[float] = None  # Stop and return the entities found so far after this long; defaults to settings.request_time_budget_seconds
 
 
 class ManualAnnotationRequest(BaseModel):
@@ -25,11 +40,13 @@ class ManualAnnotationRequest(BaseModel):
     end_char: int
     label: str
     confidence: Optional[float] = 1.0
+    tag_definitions: Optional[List[Dict[str, Any]]] = None  # Tag set the gazetteer learns this entity for
 
 
 class ValidationRequest(BaseModel):
     text: str
     annotations: List[Dict[str, Any]]
+    mode: str = "standard"  # "standard" or "vectorized"
 
 
 class FixRequest(BaseModel):
@@ -44,6 +61,13 @@ class EvaluationRequest(BaseModel):
     model: str = "gpt-4o-mini"
     temperature: float = 0.1
     max_tokens: int = 2000
+    text: Optional[str] = None  # Source text, needed to group annotations by context
+    context_words: Optional[int] = None  # Context words either side that split a group; defaults to settings.evaluation_context_words
+    reuse_verdicts: bool = False  # Take verdicts of (text, label) groups judged earlier with this tag set, model and temperature
+
+
+class StudentTrainingRequest(BaseModel):
+    tag_definitions: List[Dict[str, Any]]
 
 
 class ExportRequest(BaseModel):
@@ -77,12 +101,62 @@ class AnnotationValidation(BaseModel):
 @router.post("/annotate", response_model=AnnotationResult)
 async def create_annotation(
     request: AnnotationRequest,
+    http_request: Request,
     current_user: dict = Depends(get_current_user),
-    db = Depends(get_db)
+    db = Depends(get_db),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
 ):
-    """Create a new annotation using LLM with chunking support"""
+    """Create a new annotation using LLM with chunking support.
+    
+    Identical requests (same user, text, tag set and parameters) that arrive while
+    one is running share its result instead of starting new LLM calls. With an
+    Idempotency-Key header, retries of a finished request replay its response.
+    
+    The run stops when the client disconnects or time_budget_seconds runs out;
+    the entities found so far are returned with statistics["cancelled"], and the
+    finished chunks are kept for the next incremental or near-duplicate run.
+    """
+    from app.services.caching import text_hash
+    from app.services.prompt_compiler import tag_set_hash
+    from app.services.request_coalescing import IdempotencyConflict, IdempotencyStore, coalesce
+    
+    payload = {
+        **request.dict(exclude={"text", "tag_definitions", "time_budget_seconds"}),
+        "text_hash": text_hash(request.text),
+        "tag_set_hash": tag_set_hash(request.tag_definitions)
+    }
+    cancellation = CancellationToken(time_budget(request.time_budget_seconds), http_request.is_disconnected)
+    
+    async def compute() -> Dict[str, Any]:
+        return (await _create_annotation(request, current_user, db, cancellation)).dict()
+    
+    try:
+        return await coalesce(
+            current_user["id"], "annotate", payload, compute,
+            idempotency_key=idempotency_key, store=IdempotencyStore(db),
+            cancellation=cancellation,
+            replayable=lambda response: "cancelled" not in response["statistics"]
+        )
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+
+
+async def _create_annotation(
+    request: AnnotationRequest,
+    current_user: dict,
+    db,
+    cancellation: Optional[CancellationToken] = None
+) -> AnnotationResult:
+    """Run the annotation pipeline for a request and record its usage"""
     from app.services.llm_service import LLMService
     from app.services.cost_calculator import CostCalculator
+    from app.services.incremental import DocumentRunStore
+    from app.services.near_duplicates import get_near_duplicate_index
+    from app.services.gazetteer import GazetteerStore
+    from app.services.student_tagger import StudentStore
+    from app.services.auto_tuner import TunerStore
+    from app.services.prompt_compiler import compile_prompt
+    from app.config import settings
     
     try:
         # Get user's API keys
@@ -153,6 +227,46 @@ async def create_annotation(
                 detail="No API keys configured. Please add your OpenAI or Anthropic API key in your profile settings to use annotation features."
             )
         
+        # Previous run of this document, if incremental re-annotation was requested
+        run_store = DocumentRunStore(db)
+        previous_run = None
+        if request.incremental and request.document_id:
+            previous_run = run_store.get(current_user["id"], request.document_id)
+        
+        # Chunks annotated earlier with this tag set, across all of the user's documents
+        near_duplicates = None
+        reuse_near_duplicates = request.reuse_near_duplicates
+        if reuse_near_duplicates is None:
+            reuse_near_duplicates = settings.near_duplicate_reuse
+        if reuse_near_duplicates:
+            near_duplicates = get_near_duplicate_index(
+                current_user["id"], compile_prompt(request.tag_definitions).tag_set_hash,
+                request.model, request.temperature
+            )
+        
+        # Surface forms this user accepted for the tag set
+        gazetteer_mode = request.gazetteer_mode or settings.gazetteer_mode
+        gazetteer = None
+        if gazetteer_mode != "off":
+            gazetteer = GazetteerStore(db).get(current_user["id"], request.tag_definitions)
+        
+        use_student = settings.student_routing if request.use_student is None else request.use_student
+        student = StudentStore(db).get(current_user["id"], request.tag_definitions) if use_student else None
+        
+        # Chunking learned from this user's earlier runs of the model and tag set
+        tuner_store = TunerStore(db)
+        set_hash = compile_prompt(request.tag_definitions).tag_set_hash
+        tuning = None
+        if request.auto_tune and request.chunk_mode == "characters":
+            tuning = tuner_store.get(current_user["id"], request.model, set_hash).recommend(request.model)
+            if tuning:
+                request.chunk_size = tuning["chunk_size"]
+                request.overlap = tuning["overlap"]
+                request.max_tokens = tuning["max_tokens"]
+                print(f"🎛️  Auto-tuned: chunk_size={request.chunk_size}, overlap={request.overlap}, max_tokens={request.max_tokens}")
+            else:
+                print(f"🎛️  Not enough history to auto-tune; using the requested chunking")
+        
         # Generate annotation using pipeline
         try:
             print(f"🚀 Starting annotation pipeline...")
@@ -168,10 +282,35 @@ async def create_annotation(
                 temperature=request.temperature,
                 max_tokens=request.max_tokens,
                 chunk_size=request.chunk_size,
-                overlap=request.overlap
+                overlap=request.overlap,
+                chunk_mode=request.chunk_mode,
+                chunk_tokens=request.chunk_tokens,
+                boundary_mode=request.boundary_mode,
+                previous_run=previous_run,
+                near_duplicates=near_duplicates,
+                cascade=request.cascade,
+                cascade_model=request.cascade_model,
+                gazetteer=gazetteer,
+                gazetteer_mode=gazetteer_mode,
+                student=student,
+                chunk_filter_mode=request.chunk_filter_mode,
+                tag_shard_size=request.tag_shard_size,
+                cancellation=cancellation
             )
             
-            print(f"✅ Annotation pipeline completed successfully")
+            document_run = result.pop("document_run", None)
+            if request.document_id and document_run:
+                run_store.save(current_user["id"], request.document_id, document_run)
+            tuner_store.learn(current_user["id"], request.model, set_hash, result["statistics"]["run_profile"])
+            if tuning:
+                result["statistics"]["auto_tune"] = tuning
+            
+            cancelled = result["statistics"].get("cancelled")
+            if cancelled:
+                print(f"🛑 Annotation pipeline cancelled ({cancelled['reason']}) after "
+                      f"{cancelled['chunks_completed']} chunks; {cancelled['chunks_cancelled']} not sent")
+            else:
+                print(f"✅ Annotation pipeline completed successfully")
             print(f"   Entities found: {len(result.get('entities', []))}")
             print(f"   Total tokens: {result.get('statistics', {}).get('total_tokens', 0)}")
             
@@ -189,6 +328,10 @@ async def create_annotation(
                 input_tokens=result["statistics"]["total_input_tokens"],
                 output_tokens=result["statistics"]["total_output_tokens"]
             )
+            # Cascaded runs mix two models' tokens, priced separately by the pipeline
+            cascade_stats = result["statistics"].get("cascade")
+            if cascade_stats:
+                cost["total_cost"] = cascade_stats["cost"]
             print(f"✅ Cost calculated: ${cost['total_cost']:.6f}")
         except Exception as cost_error:
             print(f"💥 Cost calculation failed: {cost_error}")
@@ -204,7 +347,8 @@ async def create_annotation(
             "input_tokens": result["statistics"]["total_input_tokens"],
             "output_tokens": result["statistics"]["total_output_tokens"],
             "cost": cost["total_cost"],
-            "operation_type": "annotation",
+            # Cancelled runs are billed for the chunks they finished, and told apart here
+            "operation_type": "annotation_cancelled" if cancelled else "annotation",
             "created_at": datetime.utcnow().isoformat()
         }
         
@@ -228,7 +372,20 @@ async def create_annotation(
                 "temperature": request.temperature,
                 "max_tokens": request.max_tokens,
                 "chunk_size": request.chunk_size,
-                "overlap": request.overlap
+                "overlap": request.overlap,
+                "chunk_mode": request.chunk_mode,
+                "chunk_tokens": request.chunk_tokens,
+                "boundary_mode": request.boundary_mode,
+                "document_id": request.document_id,
+                "incremental": request.incremental,
+                "reuse_near_duplicates": reuse_near_duplicates,
+                "cascade": request.cascade,
+                "cascade_model": request.cascade_model,
+                "gazetteer_mode": gazetteer_mode,
+                "use_student": student is not None,
+                "chunk_filter_mode": request.chunk_filter_mode or settings.chunk_filter_mode,
+                "tag_shard_size": settings.tag_shard_size if request.tag_shard_size is None else request.tag_shard_size,
+                "auto_tune": tuning is not None
             },
             "statistics": result["statistics"],
             "created_at": datetime.utcnow().isoformat()
@@ -328,6 +485,12 @@ async def validate_annotation(
     
     db.table("annotation_validations").insert(validation_data).execute()
     
+    # The tag set's gazetteer picks the new validation up right away
+    tag_definitions = annotation.data[0].get("tag_definitions")
+    if tag_definitions:
+        from app.services.gazetteer import GazetteerStore
+        GazetteerStore(db).get(current_user["id"], tag_definitions, refresh=True)
+    
     return {"message": "Validation saved successfully"}
 
 
@@ -368,7 +531,8 @@ async def validate_annotations(
         validation_service = ValidationService()
         validation_results = validation_service.validate_annotations(
             request.text,
-            request.annotations
+            request.annotations,
+            mode=request.mode
         )
         
         return validation_results
@@ -408,29 +572,65 @@ async def fix_annotations(
         )
 
 
+@router.post("/student/train")
+async def train_student_model(
+    request: StudentTrainingRequest,
+    current_user: dict = Depends(get_current_user),
+    db = Depends(get_db)
+):
+    """Train the local student tagger for a tag set from the user's stored annotations"""
+    import asyncio
+    from app.services.student_tagger import StudentStore
+    
+    try:
+        # Training is CPU-bound; the new model replaces the old one when it is written
+        metrics = await asyncio.to_thread(StudentStore(db).train, current_user["id"], request.tag_definitions)
+        return {"message": "Student model trained", "metrics": metrics}
+        
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Student training failed: {str(e)}"
+        )
+
+
 @router.post("/evaluate")
 async def evaluate_annotations(
     request: EvaluationRequest,
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(get_current_user),
+    db = Depends(get_db)
 ):
     """Evaluate annotations using LLM for quality assessment"""
     from app.services.llm_service import LLMService
+    from app.services.evaluation import VerdictStore
     
     try:
         llm_service = LLMService()
-        evaluation_results = await llm_service.evaluate_annotations_with_llm(
+        evaluation = await llm_service.run_evaluation(
             request.annotations,
             request.tag_definitions,
             request.model,
             request.temperature,
-            request.max_tokens
+            request.max_tokens,
+            text=request.text,
+            context_words=request.context_words,
+            verdict_store=VerdictStore(db),
+            user_id=current_user["id"],
+            reuse_verdicts=request.reuse_verdicts
         )
         
         return {
-            "evaluation_results": evaluation_results,
+            "evaluation_results": evaluation["evaluation_results"],
+            "batches": evaluation["batches"],
             "summary": {
                 "total_entities": len(request.annotations),
-                "evaluated_entities": len(evaluation_results)
+                "evaluated_entities": len(evaluation["evaluation_results"]),
+                **evaluation["summary"]
             }
         }
         
@@ -622,7 +822,8 @@ async def compare_model_costs(
 @router.post("/manual")
 async def add_manual_annotation(
     request: ManualAnnotationRequest,
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(get_current_user),
+    db = Depends(get_db)
 ):
     """Add a manual annotation"""
     try:
@@ -651,6 +852,10 @@ async def add_manual_annotation(
             "created_at": datetime.utcnow().isoformat()
         }
         
+        if request.tag_definitions:
+            from app.services.gazetteer import GazetteerStore
+            GazetteerStore(db).learn(current_user["id"], request.tag_definitions, [manual_annotation])
+        
         return {
             "annotation": manual_annotation,
             "message": "Manual annotation created successfully"
@@ -666,14 +871,19 @@ async def add_manual_annotation(
 @router.get("/token-recommendations")
 async def get_token_recommendations(
     chunk_size: int = Query(1000, description="Chunk size in characters"),
-    current_user: dict = Depends(get_current_user)
+    model: Optional[str] = Query(None, description="Model whose tokenizer sizes the estimate"),
+    tag_set_hash: Optional[str] = Query(None, description="Tag set whose run history tunes the recommendation"),
+    current_user: dict = Depends(get_current_user),
+    db = Depends(get_db)
 ):
     """Get token recommendations based on chunk size"""
     from app.services.llm_service import LLMService
+    from app.services.auto_tuner import TunerStore
     
     try:
         llm_service = LLMService()
-        recommendations = llm_service.get_token_recommendations(chunk_size)
+        tuner = TunerStore(db).get(current_user["id"], model, tag_set_hash or "") if model else None
+        recommendations = llm_service.get_token_recommendations(chunk_size, model, tuner)
         
         return recommendations
         
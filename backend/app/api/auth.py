@@ -14,6 +14,7 @@ import time
 
 from app.config import settings
 from app.database import get_db
+from app.services.user_cache import get_user_cache
 
 # Simple in-memory rate limiting for verification attempts (only for failed attempts)
 verification_failed_attempts = {}
@@ -212,12 +213,20 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     except JWTError:
         raise credentials_exception
     
-    # Get user from database
-    db = get_db()
-    user = db.table("users").select("*").eq("email", token_data.email).execute()
-    if not user.data:
+    # Get user from the cache, or the database on a miss
+    user = await get_user_cache().get_async(token_data.email, lambda: load_user(token_data.email))
+    if user is None:
         raise credentials_exception
-    return user.data[0]
+    if not user.get("is_active", True):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Account is deactivated")
+    return user
+
+
+def load_user(email: str) -> Optional[dict]:
+    """User row for an email (the JWT subject), or None"""
+    db = get_db()
+    user = db.table("users").select("*").eq("email", email).execute()
+    return user.data[0] if user.data else None
 
 
 @router.post("/register")
@@ -352,6 +361,7 @@ async def verify_email(verification: EmailVerification):
             "email_verification_expires": None,
             "updated_at": datetime.utcnow().isoformat()
         }).eq("id", user_data["id"]).execute()
+        await get_user_cache().invalidate_async(user_data["email"])
         
         # Clear any failed verification attempts since this was successful
         clear_failed_verification(verification.token)
@@ -423,6 +433,7 @@ async def resend_verification(email_request: dict):
             "email_verification_expires": verification_expires.isoformat(),
             "updated_at": datetime.utcnow().isoformat()
         }).eq("email", email).execute()
+        await get_user_cache().invalidate_async(email)
         
         # Send verification email
         send_verification_email(email, verification_token)
@@ -496,6 +507,15 @@ async def login(user_credentials: UserLogin):
         
         user_data = user.data[0]
         
+        if not user_data.get("is_active", True):
+            return JSONResponse(
+                status_code=403,
+                content={
+                    "error": True,
+                    "message": "Account is deactivated"
+                }
+            )
+        
         # Check if email is verified
         if not user_data.get("email_verified", False):
             return JSONResponse(
@@ -576,11 +596,9 @@ async def get_session(request: Request, credentials: Optional[HTTPAuthorizationC
         email: str = payload.get("sub")
         if not email:
             return {"user": None}
-        db = get_db()
-        user = db.table("users").select("*").eq("email", email).execute()
-        if not user.data:
+        user_data = await get_user_cache().get_async(email, lambda: load_user(email))
+        if user_data is None or not user_data.get("is_active", True):
             return {"user": None}
-        user_data = user.data[0]
         return {"user": {
             "id": user_data["id"],
             "email": user_data["email"],
@@ -612,6 +630,7 @@ async def update_profile(profile: UserProfileUpdate, current_user: dict = Depend
                 }
             )
         result = db.table("users").update(update_data).eq("id", current_user["id"]).execute()
+        await get_user_cache().invalidate_async(current_user["email"])
         updated_user = result.data[0] if result.data else current_user
         return {"user": {
             "id": updated_user["id"],
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Header, Request
 from fastapi.responses import FileResponse
 from pydantic import BaseModel
 from typing import List, Optional
@@ -9,10 +9,19 @@ from datetime import datetime
 from app.api.auth import get_current_user
 from app.database import get_db
 from app.config import settings
+from app.services.cancellation import CancellationToken, RequestCancelled, time_budget
 
 router = APIRouter()
 
 
+class BatchProcessRequest(BaseModel):
+    file_ids: List[str]
+    tagset_id: str
+    model: str = "gpt-4"
+    execution: str = "sync"  # "sync", or "batch" (provider batch API, run as a background job)
+    time_budget_seconds: Optional[float] = None  # Stop after this long; defaults to settings.request_time_budget_seconds
+
+
 class FileInfo(BaseModel):
     id: str
     filename: str
@@ -183,11 +192,24 @@ async def delete_file(
 async def process_file(
     file_id: str,
     tagset_id: str,
+    http_request: Request,
     model: str = "gpt-4",
+    execution: str = "sync",
+    time_budget_seconds: Optional[float] = None,
     current_user: dict = Depends(get_current_user),
-    db = Depends(get_db)
+    db = Depends(get_db),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
 ):
-    """Process entire file for annotation"""
+    """Process entire file for annotation.
+    
+    Processing stops when the client disconnects or time_budget_seconds runs out;
+    a synchronous run returns the chunks it finished with a "cancelled" entry.
+    execution "batch" runs the file as a background batch job and answers with a
+    job id at once, as POST /process-batch does.
+    """
+    if execution not in ("batch", "sync"):
+        raise HTTPException(status_code=400, detail="execution must be 'batch' or 'sync'")
+    
     # Get file content
     file_content = await get_file_content(file_id, current_user, db)
     
@@ -202,13 +224,191 @@ async def process_file(
     
     # Process file with LLM service
     from app.services.file_processor import FileProcessor
+    from app.services.caching import text_hash
+    from app.services.prompt_compiler import tag_set_hash
+    from app.services.request_coalescing import IdempotencyConflict, IdempotencyStore, coalesce
+    from app.services.batch_jobs import BatchJobStore, start_batch_job
     
     processor = FileProcessor()
-    result = await processor.process_file(
-        content=file_content["content"],
-        tagset=tagset.data[0],
-        model=model,
-        user_id=current_user["id"]
-    )
+    payload = {
+        "text_hash": text_hash(file_content["content"]),
+        "tag_set_hash": tag_set_hash(tagset.data[0].get("tags") or []),
+        "tagset_id": tagset_id,
+        "model": model,
+        "execution": execution
+    }
+    
+    if execution == "batch":
+        def process(cancellation: CancellationToken):
+            return processor.process_batch_files(
+                files=[{"id": file_id, "filename": file_content.get("filename"), "content": file_content["content"]}],
+                tagset=tagset.data[0],
+                model=model,
+                user_id=current_user["id"],
+                execution="batch",
+                cancellation=cancellation
+            )
+        
+        # The job outlives this request, so only its own time budget stops it
+        async def start_job():
+            job = start_batch_job(
+                current_user["id"],
+                {"file_ids": [file_id], "tagset_id": tagset_id, "model": model},
+                process, BatchJobStore(db), time_budget=time_budget_seconds
+            )
+            return {"job_id": job["id"], "status": job["status"], "execution": "batch"}
+        
+        try:
+            # A retry with the same Idempotency-Key gets the job already started
+            return await coalesce(
+                current_user["id"], "process_file", payload, start_job,
+                idempotency_key=idempotency_key, store=IdempotencyStore(db)
+            )
+        except IdempotencyConflict as e:
+            raise HTTPException(status_code=409, detail=str(e))
+    
+    cancellation = CancellationToken(time_budget(time_budget_seconds), http_request.is_disconnected)
+    try:
+        return await coalesce(
+            current_user["id"], "process_file", payload,
+            lambda: processor.process_file(
+                content=file_content["content"],
+                tagset=tagset.data[0],
+                model=model,
+                user_id=current_user["id"],
+                execution=execution,
+                cancellation=cancellation
+            ),
+            idempotency_key=idempotency_key, store=IdempotencyStore(db),
+            cancellation=cancellation,
+            replayable=lambda response: "cancelled" not in response["file_annotations"]
+        )
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except RequestCancelled as e:
+        raise HTTPException(status_code=504, detail=str(e))
+
+
+@router.post("/process-batch")
+async def process_files_batch(
+    request: BatchProcessRequest,
+    http_request: Request,
+    current_user: dict = Depends(get_current_user),
+    db = Depends(get_db),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
+    """Process several files as one job.
+    
+    execution "sync" answers with the results. "batch" submits the chunks to the
+    provider's batch API in the background and answers with a job id at once;
+    poll GET /batch-jobs/{job_id} for the results.
+    """
+    if request.execution not in ("batch", "sync"):
+        raise HTTPException(status_code=400, detail="execution must be 'batch' or 'sync'")
+    
+    files = []
+    for file_id in request.file_ids:
+        file_content = await get_file_content(file_id, current_user, db)
+        files.append({
+            "id": file_id,
+            "filename": file_content.get("filename"),
+            "content": file_content["content"]
+        })
+    
+    tagset = db.table("tag_sets")\
+        .select("*")\
+        .eq("id", request.tagset_id)\
+        .execute()
+    
+    if not tagset.data:
+        raise HTTPException(status_code=404, detail="Tag set not found")
+    
+    from app.services.file_processor import FileProcessor
+    from app.services.caching import text_hash
+    from app.services.prompt_compiler import tag_set_hash
+    from app.services.request_coalescing import IdempotencyConflict, IdempotencyStore, coalesce
+    from app.services.batch_jobs import BatchJobStore, start_batch_job
+    
+    processor = FileProcessor()
+    payload = {
+        "files": [[file["id"], text_hash(file["content"])] for file in files],
+        "tag_set_hash": tag_set_hash(tagset.data[0].get("tags") or []),
+        "tagset_id": request.tagset_id,
+        "model": request.model,
+        "execution": request.execution
+    }
+    
+    def process(cancellation: CancellationToken):
+        return processor.process_batch_files(
+            files=files,
+            tagset=tagset.data[0],
+            model=request.model,
+            user_id=current_user["id"],
+            execution=request.execution,
+            cancellation=cancellation
+        )
+    
+    if request.execution == "batch":
+        # The job outlives this request, so only its own time budget stops it
+        async def start_job():
+            job = start_batch_job(
+                current_user["id"],
+                {"file_ids": request.file_ids, "tagset_id": request.tagset_id, "model": request.model},
+                process, BatchJobStore(db), time_budget=request.time_budget_seconds
+            )
+            return {"job_id": job["id"], "status": job["status"], "execution": "batch"}
+        
+        try:
+            # A retry with the same Idempotency-Key gets the job already started
+            return await coalesce(
+                current_user["id"], "process_batch", payload, start_job,
+                idempotency_key=idempotency_key, store=IdempotencyStore(db)
+            )
+        except IdempotencyConflict as e:
+            raise HTTPException(status_code=409, detail=str(e))
+    
+    cancellation = CancellationToken(time_budget(request.time_budget_seconds), http_request.is_disconnected)
+    try:
+        return await coalesce(
+            current_user["id"], "process_batch", payload,
+            lambda: process(cancellation),
+            idempotency_key=idempotency_key, store=IdempotencyStore(db),
+            cancellation=cancellation,
+            replayable=lambda response: "cancelled" not in response
+        )
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+@router.get("/batch-jobs/{job_id}")
+async def get_batch_job(
+    job_id: str,
+    current_user: dict = Depends(get_current_user),
+    db = Depends(get_db)
+):
+    """Status of a background batch job, with its results once it has finished"""
+    from app.services.batch_jobs import BatchJobStore
+    
+    job = BatchJobStore(db).get(current_user["id"], job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Batch job not found")
+    return job
+
+
+@router.delete("/batch-jobs/{job_id}")
+async def cancel_batch_job(
+    job_id: str,
+    current_user: dict = Depends(get_current_user),
+    db = Depends(get_db)
+):
+    """Cancel a running batch job, including its batch at the provider"""
+    from app.services.batch_jobs import BatchJobStore, cancel_batch_job as cancel_job
     
-    return result
+    job = BatchJobStore(db).get(current_user["id"], job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Batch job not found")
+    if job["status"] != "in_progress":
+        raise HTTPException(status_code=409, detail=f"Batch job already {job['status']}")
+    if not cancel_job(job_id):
+        raise HTTPException(status_code=409, detail="Batch job is running on another worker")
+    return {"message": "Batch job cancellation requested"}
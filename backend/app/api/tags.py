@@ -1,6 +1,6 @@
 from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Union
 from datetime import datetime
 
 from app.api.auth import get_current_user
@@ -15,6 +15,8 @@ class TagDefinition(BaseModel):
     color: str
     examples: List[str]
     validation_rules: Optional[Dict[str, Any]] = None
+    extractors: Optional[List[Union[str, Dict[str, Any]]]] = None  # Built-in names or {"pattern", "flags"}
+    rule_only: bool = False  # Found by extractors alone and left out of the LLM prompt
 
 
 class TagSet(BaseModel):
@@ -9,6 +9,7 @@ import os
 from app.api.auth import get_current_user
 from app.database import get_db, get_admin_db
 from app.config import settings
+from app.services.user_cache import get_user_cache
 
 router = APIRouter()
 
@@ -115,6 +116,7 @@ async def update_profile(
     
     # Update user in database
     result = db.table("users").update(update_data).eq("id", current_user["id"]).execute()
+    await get_user_cache().invalidate_async(current_user["email"])
     
     if not result.data:
         raise HTTPException(status_code=404, detail="User not found")
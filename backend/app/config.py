@@ -16,6 +16,10 @@ class Settings(BaseSettings):
     secret_key: str = "development-secret-key-change-in-production"
     algorithm: str = "HS256"
     access_token_expire_minutes: int = 30
+    user_cache_backend: str = "memory"  # "memory" (per process), "redis" (shared by workers) or "off"
+    user_cache_ttl_seconds: float = 60.0  # Longest a cached user row is trusted without a database read
+    user_cache_size: int = 10000  # Users kept in the in-process cache
+    user_cache_redis_url: str = "redis://localhost:6379/0"  # Redis server of the "redis" user cache backend
     
     # LLM APIs
     openai_api_key: Optional[str] = None
@@ -29,6 +33,10 @@ class Settings(BaseSettings):
     # Rate limiting
     rate_limit_per_minute: int = 60
     
+    # Tag sharding and provider concurrency
+    tag_shard_size: int = 0  # Most tags per prompt before a tag set is split into concurrent shards; 0 never splits
+    llm_max_concurrent_requests: int = 8  # Provider requests in flight per provider across all requests
+    
     # Cost estimation (per 1K tokens)
     openai_gpt4_input_cost: float = 0.01
     openai_gpt4_output_cost: float = 0.03
@@ -46,6 +54,84 @@ class Settings(BaseSettings):
     max_annotations_per_request: int = 1000
     max_text_length: int = 500000  # 500K characters
     
+    # Annotation pipeline
+    alignment_margin: int = 100  # Characters searched around a chunk when repairing entity offsets
+    document_index_cache_size: int = 32  # Documents whose boundary index is kept in memory
+    default_chunk_tokens: int = 2000  # Prompt token budget per chunk in token chunking mode
+    prompt_message_overhead_tokens: int = 8  # Chat formatting tokens added around the messages
+    stitch_window: int = 200  # Characters re-annotated around a chunk boundary in stitch mode
+    document_run_cache_size: int = 256  # Previous runs kept in memory for incremental re-annotation
+    near_duplicate_reuse: bool = False  # Reuse entities of near-identical chunks annotated earlier (same tag set, model and temperature)
+    near_duplicate_threshold: float = 0.85  # Minimum estimated Jaccard similarity of word shingles
+    near_duplicate_permutations: int = 64  # MinHash signature length
+    near_duplicate_bands: int = 16  # LSH bands the signature is split into
+    near_duplicate_max_chunks: int = 5000  # Annotated chunks indexed per user and tag set
+    near_duplicate_index_cache_size: int = 64  # (user, tag set) indexes kept in memory
+    cascade_openai_model: str = "gpt-4o-mini"  # First-pass model when cascading OpenAI models
+    cascade_anthropic_model: str = "claude-3-5-haiku-20241022"  # First-pass model when cascading Claude models
+    cascade_max_repair_rate: float = 0.3  # Share of entities needing offset repair before escalating
+    cascade_min_confidence: float = 0.5  # Mean self-reported confidence below which a chunk escalates
+    cascade_density_factor: float = 3.0  # Entity density this many times off the median escalates
+    batch_adapter: str = "auto"  # "auto" uses the model provider's batch API, "fake" a local in-process endpoint
+    batch_poll_interval: float = 30.0  # Seconds between batch status checks
+    batch_timeout: float = 86400.0  # Seconds to wait for a batch before giving up
+    batch_price_factor: float = 0.5  # Batch API price relative to synchronous calls
+    batch_job_cache_size: int = 1000  # Background batch jobs kept in memory
+    gazetteer_mode: str = "off"  # "off", "merge" (add gazetteer matches) or "skip" (also skip/shrink covered chunks)
+    gazetteer_min_length: int = 3  # Shortest surface form learned
+    gazetteer_min_support: int = 1  # Net accepted occurrences before a form is matched
+    gazetteer_confidence: float = 0.9  # Confidence of a unanimous gazetteer match
+    gazetteer_cache_size: int = 64  # (user, tag set) gazetteers kept in memory
+    gazetteer_refresh_seconds: float = 60.0  # Minimum interval between loads of new validations
+    gazetteer_max_novel_terms: int = 3  # Novel terms up to which a chunk gets a reduced output budget
+    gazetteer_tokens_per_entity: int = 40  # Output tokens budgeted per expected entity
+    gazetteer_min_output_tokens: int = 256  # Floor of a reduced output budget
+    student_routing: bool = False  # Tag chunks with the local student model and send only doubtful ones to the LLM
+    student_min_confidence: float = 0.9  # Lowest per-token marginal for a chunk to be kept from the student
+    student_min_f1: float = 0.8  # Held-out entity F1 a student model needs before it is used
+    student_model_dir: str = "student_models"  # Where trained student models are stored
+    student_epochs: int = 5  # Perceptron passes over the training data
+    student_holdout: float = 0.1  # Share of documents held out to score a trained model
+    student_min_documents: int = 20  # Annotated documents needed before training
+    student_cache_size: int = 32  # Student models kept in memory
+    extractor_max_pattern_length: int = 200  # Longest user regex accepted as a tag extractor
+    chunk_filter_mode: str = "off"  # "off", "reduce" (smaller output budget only) or "skip" content-free chunks
+    chunk_filter_min_share: float = 0.6  # Share of a chunk in reference, affiliation, LaTeX or table lines to skip it (half of it reduces)
+    chunk_filter_max_content_chars: int = 120  # Characters of ordinary text a skipped chunk may still contain
+    chunk_filter_latex_ratio: float = 0.2  # Share of LaTeX commands and markup that makes a line LaTeX residue
+    long_context_max_window_tokens: int = 100000  # Largest prompt per window in long-context mode, below the model's context
+    long_context_margin_tokens: int = 2000  # Context left unused as a safety margin for tokenizer error
+    long_context_page_tokens: int = 4000  # Output tokens per page of entities (capped by the model's output limit)
+    long_context_tokens_per_entity: int = 40  # Output tokens one entity takes, to size pages
+    long_context_max_pages: int = 20  # Continuation calls per window before giving up
+    chunk_filter_reduced_max_tokens: int = 300  # Output budget of chunks that only lean content-free
+    evaluation_batch_tokens: int = 3000  # Prompt tokens of annotations listed in one evaluation request
+    evaluation_tokens_per_verdict: int = 80  # Output tokens one verdict takes, so a batch's verdicts fit max_tokens
+    evaluation_max_batch_size: int = 25  # Most annotations per evaluation request
+    evaluation_max_retries: int = 2  # Extra rounds for annotations whose verdicts were missing or failed
+    evaluation_context_words: int = 0  # Words either side that split a (text, label) group by context; 0 groups by text and label only
+    evaluation_verdict_cache_size: int = 10000  # Verdicts kept in memory in front of the evaluation_verdicts table
+    auto_tune_target_truncation: float = 0.02  # Share of chunks allowed to hit max_tokens under tuned settings
+    auto_tune_output_margin: float = 0.1  # Headroom added on top of the quantile output estimate
+    auto_tune_extrapolation_factor: float = 1.5  # Budget multiplier past the largest truncated chunk when truncation exceeds the target
+    auto_tune_min_samples: int = 30  # Chunks of history needed before recommending
+    auto_tune_max_samples: int = 2000  # Most recent chunks a tuner keeps
+    auto_tune_samples_per_run: int = 200  # Chunks recorded in one run's profile
+    auto_tune_history_runs: int = 50  # Past runs loaded per user and model
+    auto_tune_min_chunk_size: int = 500  # Smallest chunk size considered
+    auto_tune_max_chunk_size: int = 4000  # Largest chunk size considered
+    auto_tune_chunk_step: int = 250  # Spacing of the chunk sizes considered
+    auto_tune_size_range: float = 1.5  # Candidates stay within the observed chunk sizes widened by this factor
+    auto_tune_latency_weight: float = 0.5  # Extra relative cost of a chunk whose mean output fills the model's output limit
+    auto_tune_min_overlap: int = 50  # Overlap floor; otherwise twice the longest typical entity
+    auto_tune_min_max_tokens: int = 200  # Floor of a tuned max_tokens
+    auto_tune_cache_size: int = 128  # (user, model, tag set) tuners kept in memory
+    auto_tune_refresh_seconds: float = 300.0  # Age after which a tuner is rebuilt from history
+    idempotency_ttl_seconds: float = 86400.0  # How long a response is replayed for a repeated Idempotency-Key
+    idempotency_cache_size: int = 1024  # Idempotent responses kept in memory
+    request_time_budget_seconds: float = 0.0  # Default deadline of annotation and file processing requests; 0 for none
+    disconnect_poll_interval: float = 1.0  # Seconds between checks that the client is still connected during an LLM call
+    
     # Email Configuration
     smtp_host: Optional[str] = None
     smtp_port: int = 587
@@ -63,17 +149,19 @@ class Settings(BaseSettings):
 LLM_MODELS: Dict[str, Dict[str, Any]] = {
     "openai": {
         "models": [
-            {"id": "gpt-3.5-turbo", "name": "GPT-3.5 Turbo", "max_tokens": 16385},
-            {"id": "gpt-4", "name": "GPT-4", "max_tokens": 8192},
-            {"id": "gpt-4-turbo", "name": "GPT-4 Turbo", "max_tokens": 128000},
-            {"id": "gpt-4o", "name": "GPT-4o", "max_tokens": 128000},
+            {"id": "gpt-3.5-turbo", "name": "GPT-3.5 Turbo", "max_tokens": 16385, "max_output_tokens": 4096},
+            {"id": "gpt-4", "name": "GPT-4", "max_tokens": 8192, "max_output_tokens": 8192},
+            {"id": "gpt-4-turbo", "name": "GPT-4 Turbo", "max_tokens": 128000, "max_output_tokens": 4096},
+            {"id": "gpt-4o", "name": "GPT-4o", "max_tokens": 128000, "max_output_tokens": 16384},
+            {"id": "gpt-4o-mini", "name": "GPT-4o Mini", "max_tokens": 128000, "max_output_tokens": 16384},
         ]
     },
     "anthropic": {
         "models": [
-            {"id": "claude-3-haiku-20240307", "name": "Claude 3 Haiku", "max_tokens": 200000},
-            {"id": "claude-3-sonnet-20240229", "name": "Claude 3 Sonnet", "max_tokens": 200000},
-            {"id": "claude-3-opus-20240229", "name": "Claude 3 Opus", "max_tokens": 200000},
+            {"id": "claude-3-haiku-20240307", "name": "Claude 3 Haiku", "max_tokens": 200000, "max_output_tokens": 4096},
+            {"id": "claude-3-sonnet-20240229", "name": "Claude 3 Sonnet", "max_tokens": 200000, "max_output_tokens": 4096},
+            {"id": "claude-3-opus-20240229", "name": "Claude 3 Opus", "max_tokens": 200000, "max_output_tokens": 4096},
+            {"id": "claude-3-5-haiku-20241022", "name": "Claude 3.5 Haiku", "max_tokens": 200000, "max_output_tokens": 8192},
         ]
     }
 }
@@ -9,6 +9,7 @@ import traceback
 from app.config import settings
 from app.database import init_db
 from app.api import auth, annotations, tags, files, users, projects, dashboard
+from app.services.user_cache import get_user_cache
 
 
 @asynccontextmanager
@@ -78,6 +79,11 @@ async def health_check():
     return {"status": "healthy"}
 
 
+@app.get("/metrics")
+async def metrics(current_user: dict = Depends(auth.get_current_user)):
+    return {"user_cache": get_user_cache().stats()}
+
+
 if __name__ == "__main__":
     uvicorn.run(
         "main:app",
@@ -0,0 +1,211 @@
+from typing import Dict, List, Any, Iterable, Optional
+import math
+import numpy as np
+
+from app.config import settings
+from app.services.caching import LRUCache
+from app.services.cost_calculator import CostCalculator
+from app.services.long_context import model_limits
+from app.services.prompt_compiler import tag_set_hash
+
+
+def run_profile(
+    chunks: List[Dict[str, Any]],
+    chunk_results: List[Dict[str, Any]],
+    entities: List[Dict[str, Any]],
+    model: str,
+    run_params: Dict[str, Any]
+) -> Dict[str, Any]:
+    """What a run teaches the tuner: one [chars, input, output, max_tokens, truncated] row per LLM chunk.
+
+    Only chunks answered by `model` in one request count; reused, skipped, failed,
+    cascaded and paginated chunks say nothing about the output budget a chunk needs.
+    """
+    chars_by_id = {chunk["chunk_id"]: len(chunk["text"]) for chunk in chunks}
+    samples = [
+        [
+            chars_by_id[row["chunk_id"]],
+            row.get("input_tokens", 0),
+            row.get("output_tokens", 0),
+            row.get("max_tokens", run_params["max_tokens"]),
+            int(bool(row.get("truncated")))
+        ]
+        for row in chunk_results
+        if row.get("model") == model and "error" not in row and "pages" not in row
+        and row.get("chunk_id") in chars_by_id
+    ][:settings.auto_tune_samples_per_run]
+
+    lengths = sorted(len(entity.get("text", "")) for entity in entities)
+    return {
+        **run_params,
+        "samples": samples,
+        "entity_chars_p95": lengths[int(0.95 * (len(lengths) - 1))] if lengths else 0
+    }
+
+
+class ChunkTuner:
+    """Chunk size, overlap and max_tokens learned from the run profiles of one model (and tag set).
+
+    Output tokens per character are read off past chunks. The (1 - target) quantile
+    of that ratio sizes max_tokens so only the target share of chunks would hit it.
+    Truncated chunks are censored observations: their true ratio is only known to
+    lie above max_tokens / chars, so they are counted in the tail without a value.
+    """
+
+    def __init__(self, profiles: Iterable[Dict[str, Any]] = (), scope: str = "tag_set"):
+        self.scope = scope
+        self.samples: List[List[float]] = []
+        self.entity_lengths: List[int] = []
+        for profile in profiles:
+            self.add(profile)
+
+    def add(self, profile: Dict[str, Any]):
+        # Token chunking and shards size their requests differently; they are not comparable
+        if profile.get("chunk_mode", "characters") != "characters" or profile.get("sharded"):
+            return
+        self.samples.extend(sample for sample in profile.get("samples", []) if sample[0] > 0)
+        if profile.get("entity_chars_p95"):
+            self.entity_lengths.append(profile["entity_chars_p95"])
+        # Newest samples win once the window is full
+        self.samples = self.samples[-settings.auto_tune_max_samples:]
+        self.entity_lengths = self.entity_lengths[-settings.auto_tune_max_samples:]
+
+    @property
+    def ready(self) -> bool:
+        return len(self.samples) >= settings.auto_tune_min_samples
+
+    def _arrays(self):
+        data = np.asarray(self.samples, dtype=float)
+        return data[:, 0], data[:, 1], data[:, 2], data[:, 3], data[:, 4].astype(bool)
+
+    def output_ratio(self, target: float) -> Dict[str, Any]:
+        """Output tokens per character at the (1 - target) quantile, and whether it had to be extrapolated"""
+        chars, _, output, cap, truncated = self._arrays()
+        ratios = output / chars
+        # Censored ratios sort above every observed one
+        ranked = np.sort(np.where(truncated, np.inf, ratios))
+        position = min(len(ranked) - 1, math.ceil((1 - target) * len(ranked)) - 1)
+        if np.isfinite(ranked[position]):
+            return {"ratio": float(ranked[position]), "extrapolated": False}
+        # More chunks truncated than the target allows: go well past the largest known lower bound
+        bound = float((cap[truncated] / chars[truncated]).max()) * settings.auto_tune_extrapolation_factor
+        observed = float(ratios[~truncated].max()) if (~truncated).any() else 0.0
+        return {"ratio": max(bound, observed), "extrapolated": True}
+
+    def max_tokens_for(self, chunk_size: int, target: Optional[float] = None) -> int:
+        target = settings.auto_tune_target_truncation if target is None else target
+        ratio = self.output_ratio(target)["ratio"]
+        return max(settings.auto_tune_min_max_tokens,
+                   math.ceil(ratio * chunk_size * (1 + settings.auto_tune_output_margin)))
+
+    def recommend(self, model: str, target: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Cheapest chunking whose predicted truncation rate is target, or None without enough history.
+
+        Cost per 1K document characters is priced from the fitted prompt size
+        (fixed overhead plus tokens per character) and the mean output ratio.
+        Chunk sizes are only considered within settings.auto_tune_size_range of the
+        sizes observed, since the fits say little about sizes never run; as runs
+        at the edge come in, the range widens a step at a time. Longer outputs
+        per request are penalized by settings.auto_tune_latency_weight: such a
+        request takes longer and loses more work when it truncates or fails.
+        Reserved tokens (prompt plus max_tokens, what rate limits count) break ties.
+        """
+        if not self.ready:
+            return None
+        target = settings.auto_tune_target_truncation if target is None else target
+        chars, input_tokens, output, _, truncated = self._arrays()
+        quantile = self.output_ratio(target)
+
+        # Prompt tokens ~ overhead + slope * chars; a flat overhead when chunk sizes never varied
+        if np.ptp(chars) > 0:
+            slope, overhead = np.polyfit(chars, input_tokens, 1)
+        else:
+            slope, overhead = 0.25, float(np.median(input_tokens - chars * 0.25))
+        slope, overhead = max(float(slope), 0.0), max(float(overhead), 0.0)
+        mean_ratio = float((output / chars).mean())
+
+        overlap = max(settings.auto_tune_min_overlap, 2 * max(self.entity_lengths, default=0))
+        output_limit = (model_limits(model) or {}).get("max_output_tokens", 4096)
+        calculator = CostCalculator()
+        try:
+            pricing = calculator.pricing[calculator.get_model_key(model)]
+        except Exception:
+            pricing = {"input": 0.0, "output": 0.0}
+
+        sizes = range(settings.auto_tune_min_chunk_size, settings.auto_tune_max_chunk_size + 1,
+                      settings.auto_tune_chunk_step)
+        lowest, highest = chars.min() / settings.auto_tune_size_range, chars.max() * settings.auto_tune_size_range
+        # Without a grid size in reach, the one nearest the observed sizes
+        sizes = [size for size in sizes if lowest <= size <= highest] or \
+            [min(sizes, key=lambda size: abs(size - float(np.median(chars))))]
+
+        candidates = []
+        for chunk_size in sizes:
+            chunk_overlap = min(overlap, chunk_size // 5)
+            max_tokens = self.max_tokens_for(chunk_size, target)
+            if max_tokens > output_limit:
+                continue
+            chunks_per_kchar = 1000 / (chunk_size - chunk_overlap)
+            prompt_tokens = overhead + slope * chunk_size
+            output_tokens = mean_ratio * chunk_size
+            cost = chunks_per_kchar * (prompt_tokens * pricing["input"] + output_tokens * pricing["output"]) / 1_000_000
+            score = cost * (1 + settings.auto_tune_latency_weight * output_tokens / output_limit)
+            reserved = chunks_per_kchar * (prompt_tokens + max_tokens)
+            candidates.append((score, reserved, chunk_size, chunk_overlap, max_tokens, cost))
+        if not candidates:
+            return None
+
+        _, reserved, chunk_size, chunk_overlap, max_tokens, cost = min(candidates)
+        return {
+            "chunk_size": chunk_size,
+            "overlap": chunk_overlap,
+            "max_tokens": max_tokens,
+            "target_truncation": target,
+            "observed_truncation": float(truncated.mean()),
+            "output_tokens_per_char": round(quantile["ratio"], 4),
+            "extrapolated": quantile["extrapolated"],
+            "estimated_cost_per_1k_chars": float(f"{cost:.4g}"),
+            "reserved_tokens_per_1k_chars": round(reserved),
+            "samples": len(self.samples),
+            "scope": self.scope
+        }
+
+
+class TunerStore:
+    """ChunkTuner per (user, model, tag set), rebuilt from the annotations table every few minutes"""
+
+    _tuners = LRUCache(maxsize=settings.auto_tune_cache_size, ttl=settings.auto_tune_refresh_seconds)
+
+    def __init__(self, db: Any = None):
+        self.db = db
+
+    def get(self, user_id: str, model: str, set_hash: str) -> ChunkTuner:
+        """The tag set's tuner, or the model-wide one while the tag set has too little history"""
+        return self._tuners.get_or_create((user_id, model, set_hash), lambda: self._load(user_id, model, set_hash))
+
+    def learn(self, user_id: str, model: str, set_hash: str, profile: Dict[str, Any]):
+        """Add a finished run to the cached tuner, ahead of the next reload"""
+        tuner = self._tuners.get((user_id, model, set_hash), count=False)
+        if tuner is not None:
+            tuner.add(profile)
+
+    def _load(self, user_id: str, model: str, set_hash: str) -> ChunkTuner:
+        rows = []
+        if self.db is not None:
+            try:
+                rows = self.db.table("annotations").select("tag_definitions,statistics") \
+                    .eq("user_id", user_id).eq("model_used", model) \
+                    .order("created_at", desc=True).limit(settings.auto_tune_history_runs).execute().data or []
+            except Exception as e:
+                print(f"⚠️  Failed to load run history for tuning: {e}")
+
+        profiles = [
+            (row["statistics"]["run_profile"], tag_set_hash(row.get("tag_definitions") or []) == set_hash)
+            for row in reversed(rows)
+            if isinstance(row.get("statistics"), dict) and row["statistics"].get("run_profile")
+        ]
+        tuner = ChunkTuner((profile for profile, same_tags in profiles if same_tags), scope="tag_set")
+        if not tuner.ready:
+            tuner = ChunkTuner((profile for profile, _ in profiles), scope="model")
+        print(f"🎛️  Tuner for {model}: {len(tuner.samples)} chunk samples ({tuner.scope})")
+        return tuner
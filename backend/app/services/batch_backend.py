@@ -0,0 +1,306 @@
+from typing import Dict, List, Any, Callable, Optional
+from abc import ABC, abstractmethod
+import asyncio
+import io
+import json
+import time
+import uuid
+
+from app.config import settings
+from app.services.cancellation import CancellationToken, RequestCancelled
+from app.services.prompt_compiler import CompiledPrompt
+
+
+class BatchAdapter(ABC):
+    """Submits chat requests to a provider's asynchronous batch API and collects the results.
+
+    Results are normalized to {custom_id: {"content", "input_tokens", "output_tokens"}}
+    for successful requests and {custom_id: {"error"}} for failed ones.
+    """
+
+    name = "base"
+
+    @abstractmethod
+    def build_request(
+        self,
+        custom_id: str,
+        prompt: CompiledPrompt,
+        text: str,
+        model: str,
+        temperature: float,
+        max_tokens: int
+    ) -> Dict[str, Any]:
+        """One chunk's request in the provider's batch format"""
+
+    @abstractmethod
+    def submit(self, requests: List[Dict[str, Any]]) -> str:
+        """Submit serialized requests, returning the provider's batch id"""
+
+    @abstractmethod
+    def status(self, batch_id: str) -> str:
+        """"in_progress", "completed" or "failed\""""
+
+    @abstractmethod
+    def results(self, batch_id: str) -> Dict[str, Dict[str, Any]]:
+        """Results of a completed batch by custom_id"""
+
+    @abstractmethod
+    def cancel(self, batch_id: str):
+        """Ask the provider to stop a batch; requests it already ran are still billed"""
+
+
+class OpenAIBatchAdapter(BatchAdapter):
+    """OpenAI Batch API: a JSONL file of /v1/chat/completions requests"""
+
+    name = "openai"
+
+    def __init__(self, client):
+        self.client = client
+
+    def build_request(self, custom_id, prompt, text, model, temperature, max_tokens):
+        return {
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": model,
+                "messages": [
+                    {"role": "system", "content": prompt.system_prompt},
+                    {"role": "user", "content": prompt.user_prompt(text)}
+                ],
+                "temperature": temperature,
+                "max_tokens": max_tokens,
+                "response_format": {"type": "json_object"}
+            }
+        }
+
+    def submit(self, requests):
+        payload = "\n".join(json.dumps(request, ensure_ascii=False) for request in requests)
+        input_file = self.client.files.create(
+            file=("annotation_batch.jsonl", io.BytesIO(payload.encode("utf-8"))),
+            purpose="batch"
+        )
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h"
+        )
+        return batch.id
+
+    def status(self, batch_id):
+        status = self.client.batches.retrieve(batch_id).status
+        if status == "completed":
+            return "completed"
+        if status in ("failed", "expired", "cancelled", "cancelling"):
+            return "failed"
+        return "in_progress"
+
+    def results(self, batch_id):
+        batch = self.client.batches.retrieve(batch_id)
+        results: Dict[str, Dict[str, Any]] = {}
+
+        for file_id in (batch.output_file_id, getattr(batch, "error_file_id", None)):
+            if not file_id:
+                continue
+            for line in self.client.files.content(file_id).text.splitlines():
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                response = record.get("response") or {}
+                body = response.get("body") or {}
+                if record.get("error") or response.get("status_code") != 200:
+                    error = record.get("error") or body.get("error") or f"HTTP {response.get('status_code')}"
+                    results[record["custom_id"]] = {"error": str(error)}
+                    continue
+                usage = body.get("usage", {})
+                results[record["custom_id"]] = {
+                    "content": body["choices"][0]["message"]["content"],
+                    "input_tokens": usage.get("prompt_tokens", 0),
+                    "output_tokens": usage.get("completion_tokens", 0)
+                }
+        return results
+
+    def cancel(self, batch_id):
+        self.client.batches.cancel(batch_id)
+
+
+class AnthropicBatchAdapter(BatchAdapter):
+    """Anthropic Message Batches API"""
+
+    name = "anthropic"
+
+    def __init__(self, client):
+        self.client = client
+
+    def build_request(self, custom_id, prompt, text, model, temperature, max_tokens):
+        return {
+            "custom_id": custom_id,
+            "params": {
+                "model": model,
+                "max_tokens": max_tokens,
+                "temperature": temperature,
+                "system": prompt.system_prompt,
+                "messages": [{"role": "user", "content": prompt.user_prompt(text)}]
+            }
+        }
+
+    def submit(self, requests):
+        return self.client.messages.batches.create(requests=requests).id
+
+    def status(self, batch_id):
+        batch = self.client.messages.batches.retrieve(batch_id)
+        return "completed" if batch.processing_status == "ended" else "in_progress"
+
+    def results(self, batch_id):
+        results: Dict[str, Dict[str, Any]] = {}
+        for entry in self.client.messages.batches.results(batch_id):
+            result = entry.result
+            if result.type != "succeeded":
+                error = getattr(result, "error", None) or result.type
+                results[entry.custom_id] = {"error": str(error)}
+                continue
+            message = result.message
+            results[entry.custom_id] = {
+                "content": message.content[0].text,
+                "input_tokens": message.usage.input_tokens,
+                "output_tokens": message.usage.output_tokens
+            }
+        return results
+
+    def cancel(self, batch_id):
+        self.client.messages.batches.cancel(batch_id)
+
+
+class FakeBatchAdapter(BatchAdapter):
+    """In-process stand-in for a provider batch endpoint, for offline runs and tests.
+
+    Requests are answered by `responder(text, model)`, which returns the raw model
+    output; a batch reports completion after `polls_until_done` status checks.
+    """
+
+    name = "fake"
+
+    def __init__(
+        self,
+        responder: Optional[Callable[[str, str], str]] = None,
+        polls_until_done: int = 1
+    ):
+        self.responder = responder or (lambda text, model: json.dumps({"annotations": []}))
+        self.polls_until_done = polls_until_done
+        self.batches: Dict[str, Dict[str, Any]] = {}
+
+    def build_request(self, custom_id, prompt, text, model, temperature, max_tokens):
+        return {
+            "custom_id": custom_id,
+            "model": model,
+            "text": text,
+            "prompt_tokens": len(prompt.system_prompt + prompt.user_prompt(text)) // 4
+        }
+
+    def submit(self, requests):
+        batch_id = f"fake_batch_{uuid.uuid4().hex[:12]}"
+        self.batches[batch_id] = {"requests": list(requests), "polls": 0}
+        return batch_id
+
+    def status(self, batch_id):
+        batch = self.batches[batch_id]
+        if batch.get("cancelled"):
+            return "failed"
+        batch["polls"] += 1
+        return "completed" if batch["polls"] >= self.polls_until_done else "in_progress"
+
+    def results(self, batch_id):
+        results: Dict[str, Dict[str, Any]] = {}
+        for request in self.batches[batch_id]["requests"]:
+            try:
+                content = self.responder(request["text"], request["model"])
+            except Exception as e:
+                results[request["custom_id"]] = {"error": str(e)}
+                continue
+            results[request["custom_id"]] = {
+                "content": content,
+                "input_tokens": request["prompt_tokens"],
+                "output_tokens": len(content) // 4
+            }
+        return results
+
+    def cancel(self, batch_id):
+        self.batches[batch_id]["cancelled"] = True
+
+
+def get_batch_adapter(model: str, llm_service: Any) -> BatchAdapter:
+    """Batch adapter for a model's provider, or the local fake when settings.batch_adapter is "fake\""""
+    if settings.batch_adapter == "fake":
+        return FakeBatchAdapter()
+    if model.startswith("gpt"):
+        if not llm_service.openai_client:
+            raise Exception("OpenAI client not initialized. Please check your API key configuration.")
+        return OpenAIBatchAdapter(llm_service.openai_client)
+    if model.startswith("claude"):
+        if not llm_service.anthropic_client:
+            raise Exception("Anthropic client not initialized. Please check your API key configuration.")
+        return AnthropicBatchAdapter(llm_service.anthropic_client)
+    raise ValueError(f"Unsupported model: {model}")
+
+
+def parse_batch_result(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Batch result in the shape LLMService.annotate_text returns"""
+    if "error" in result:
+        raise Exception(f"Batch request failed: {result['error']}")
+    try:
+        annotations = json.loads(result["content"])
+    except json.JSONDecodeError as json_error:
+        raise Exception(f"Failed to parse JSON response: {json_error}")
+    return {
+        "annotations": annotations.get("annotations", []),
+        "confidence_scores": annotations.get("confidence_scores", {}),
+        "input_tokens": result.get("input_tokens", 0),
+        "output_tokens": result.get("output_tokens", 0),
+        "total_tokens": result.get("input_tokens", 0) + result.get("output_tokens", 0)
+    }
+
+
+async def run_batch(
+    adapter: BatchAdapter,
+    requests: List[Dict[str, Any]],
+    poll_interval: Optional[float] = None,
+    timeout: Optional[float] = None,
+    cancellation: Optional[CancellationToken] = None
+) -> Dict[str, Dict[str, Any]]:
+    """Submit one batch, wait for it to finish and return its results by custom_id.
+
+    Adapter calls are blocking provider requests and run in worker threads. When
+    cancellation trips while the batch runs, the batch is cancelled at the
+    provider and RequestCancelled is raised.
+    """
+    poll_interval = settings.batch_poll_interval if poll_interval is None else poll_interval
+    timeout = settings.batch_timeout if timeout is None else timeout
+
+    batch_id = await asyncio.to_thread(adapter.submit, requests)
+    print(f"📦 Submitted {adapter.name} batch {batch_id} with {len(requests)} requests")
+
+    started = time.monotonic()
+    while True:
+        status = await asyncio.to_thread(adapter.status, batch_id)
+        if status == "completed":
+            break
+        if status == "failed":
+            raise Exception(f"Batch {batch_id} failed")
+        if time.monotonic() - started > timeout:
+            raise Exception(f"Batch {batch_id} did not finish within {timeout:.0f}s")
+        if cancellation is None:
+            await asyncio.sleep(poll_interval)
+            continue
+        try:
+            await cancellation.guard(asyncio.sleep(poll_interval))
+        except RequestCancelled:
+            print(f"🛑 Cancelling batch {batch_id} ({cancellation.reason})")
+            try:
+                await asyncio.to_thread(adapter.cancel, batch_id)
+            except Exception as e:
+                print(f"⚠️  Failed to cancel batch {batch_id}: {e}")
+            raise
+
+    results = await asyncio.to_thread(adapter.results, batch_id)
+    print(f"✅ Batch {batch_id} completed: {len(results)}/{len(requests)} results")
+    return results
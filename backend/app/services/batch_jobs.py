@@ -0,0 +1,116 @@
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+import asyncio
+import uuid
+from datetime import datetime
+
+from app.config import settings
+from app.services.caching import LRUCache
+from app.services.cancellation import CancellationToken, RequestCancelled
+
+
+class BatchJobStore:
+    """Background batch jobs per user: in-process LRU in front of the batch_jobs table.
+
+    A job runs in the worker that accepted it; every worker reads its status from
+    the table, and only finished jobs are cached by workers that do not own them.
+    """
+
+    _memory = LRUCache(maxsize=settings.batch_job_cache_size)
+
+    def __init__(self, db: Any = None):
+        self.db = db
+
+    def get(self, user_id: str, job_id: str) -> Optional[Dict[str, Any]]:
+        job = self._memory.get(job_id)
+        if job is not None:
+            return job if job["user_id"] == user_id else None
+        if self.db is None:
+            return None
+
+        try:
+            result = self.db.table("batch_jobs").select("*") \
+                .eq("id", job_id).eq("user_id", user_id).limit(1).execute()
+            if result.data:
+                job = result.data[0]
+                if job["status"] != "in_progress":
+                    self._memory.set(job_id, job)
+        except Exception as e:
+            print(f"⚠️  Failed to look up batch job: {e}")
+        return job
+
+    def save(self, job: Dict[str, Any]):
+        self._memory.set(job["id"], job)
+        if self.db is None:
+            return
+
+        try:
+            self.db.table("batch_jobs").upsert(job).execute()
+        except Exception as e:
+            print(f"⚠️  Failed to save batch job: {e}")
+
+
+# Jobs running in this process, with the token that stops them
+_running: Dict[str, Tuple["asyncio.Task[None]", CancellationToken]] = {}
+
+
+def start_batch_job(
+    user_id: str,
+    request: Dict[str, Any],
+    run: Callable[[CancellationToken], Awaitable[Dict[str, Any]]],
+    store: BatchJobStore,
+    time_budget: Optional[float] = None
+) -> Dict[str, Any]:
+    """Record a job and run it in the background, returning the job as first saved.
+
+    run receives the job's cancellation token; its result becomes the job's result
+    once it finishes. The HTTP request that started the job is not waited on.
+    """
+    now = datetime.utcnow().isoformat()
+    job = {
+        "id": str(uuid.uuid4()),
+        "user_id": user_id,
+        "status": "in_progress",
+        "request": request,
+        "result": None,
+        "error": None,
+        "created_at": now,
+        "updated_at": now
+    }
+    store.save(job)
+
+    cancellation = CancellationToken(time_budget)
+    task = asyncio.create_task(_run_job(job, run, cancellation, store))
+    _running[job["id"]] = (task, cancellation)
+    print(f"📦 Started batch job {job['id']}")
+    return job
+
+
+async def _run_job(
+    job: Dict[str, Any],
+    run: Callable[[CancellationToken], Awaitable[Dict[str, Any]]],
+    cancellation: CancellationToken,
+    store: BatchJobStore
+):
+    update: Dict[str, Any]
+    try:
+        result = await run(cancellation)
+        update = {"status": "cancelled" if "cancelled" in result else "completed", "result": result}
+    except RequestCancelled as e:
+        update = {"status": "cancelled", "error": str(e)}
+    except Exception as e:
+        print(f"❌ Batch job {job['id']} failed: {e}")
+        update = {"status": "failed", "error": str(e)}
+    finally:
+        _running.pop(job["id"], None)
+
+    store.save({**job, **update, "updated_at": datetime.utcnow().isoformat()})
+    print(f"✅ Batch job {job['id']} {update['status']}")
+
+
+def cancel_batch_job(job_id: str) -> bool:
+    """Stop a job running in this process; False when it is not running here"""
+    running = _running.get(job_id)
+    if running is None:
+        return False
+    running[1].cancel("cancelled_by_user")
+    return True
@@ -0,0 +1,104 @@
+from typing import Any, Awaitable, Callable, List, Optional
+import asyncio
+import time
+
+from app.config import settings
+
+
+class RequestCancelled(Exception):
+    """The request a computation serves hit its deadline or lost its client"""
+
+    def __init__(self, reason: str):
+        super().__init__(f"Request cancelled: {reason}")
+        self.reason = reason
+
+
+class CancellationToken:
+    """Deadline and client-disconnect signal of one request, checked by the pipelines between and during LLM calls.
+
+    is_disconnected is an async probe such as Starlette's Request.is_disconnected.
+    Requests coalesced onto the same computation attach their own token, so the
+    work stops only once every waiting client is gone or every deadline has passed.
+    """
+
+    def __init__(
+        self,
+        time_budget: Optional[float] = None,
+        is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None
+    ):
+        self.started = time.monotonic()
+        self.deadline = self.started + time_budget if time_budget else None
+        self._probes: List[Callable[[], Awaitable[bool]]] = [is_disconnected] if is_disconnected else []
+        self._unbounded = not time_budget
+        self.reason: Optional[str] = None
+
+    def attach(self, other: "CancellationToken"):
+        """Keep running for another waiter: its client joins the probes and the later deadline wins"""
+        self._probes.extend(other._probes)
+        if self._unbounded or other._unbounded:
+            self._unbounded, self.deadline = True, None
+        else:
+            self.deadline = max(self.deadline, other.deadline)
+
+    def remaining(self) -> Optional[float]:
+        """Seconds until the deadline, or None without one"""
+        return None if self.deadline is None else max(0.0, self.deadline - time.monotonic())
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    @property
+    def cancelled(self) -> bool:
+        if self.reason is None and self.deadline is not None and time.monotonic() >= self.deadline:
+            self.reason = "deadline"
+        return self.reason is not None
+
+    def cancel(self, reason: str):
+        if self.reason is None:
+            self.reason = reason
+
+    async def poll(self) -> bool:
+        """Ask the probes whether the clients are still there; True once cancelled"""
+        if self.reason is None and self._probes:
+            try:
+                gone = all([await probe() for probe in self._probes])
+            except Exception as e:
+                print(f"⚠️  Failed to check client connection: {e}")
+                gone = False
+            if gone:
+                self.cancel("client_disconnected")
+        return self.cancelled
+
+    async def check(self):
+        """Raise RequestCancelled if the request should stop"""
+        if await self.poll():
+            raise RequestCancelled(self.reason)
+
+    async def guard(self, awaitable: Awaitable[Any]) -> Any:
+        """Await a call, cancelling it and raising RequestCancelled if the request stops first.
+
+        Provider SDK calls run in worker threads; cancelling frees the pipeline at
+        once, while the thread keeps its provider slot until it returns (see
+        RequestLimiter.run) and a request already sent may still be billed.
+        """
+        task = asyncio.ensure_future(awaitable)
+        try:
+            while True:
+                if await self.poll():
+                    raise RequestCancelled(self.reason)
+                timeout = settings.disconnect_poll_interval if self._probes else None
+                remaining = self.remaining()
+                if remaining is not None:
+                    timeout = remaining if timeout is None else min(timeout, remaining)
+                done, _ = await asyncio.wait({task}, timeout=timeout)
+                if done:
+                    return task.result()
+        finally:
+            if not task.done():
+                task.cancel()
+
+
+def time_budget(requested: Optional[float] = None) -> Optional[float]:
+    """A request's time budget in seconds, defaulting to settings.request_time_budget_seconds; None for no deadline"""
+    budget = settings.request_time_budget_seconds if requested is None else requested
+    return budget if budget and budget > 0 else None
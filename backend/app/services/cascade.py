@@ -0,0 +1,67 @@
+from typing import Dict, List, Any, Optional
+import statistics
+
+from app.config import settings
+
+
+def cheap_model_for(model: str) -> Optional[str]:
+    """Fast first-pass model from the same provider as model, or None if unknown"""
+    if model.startswith("gpt"):
+        return settings.cascade_openai_model
+    if model.startswith("claude"):
+        return settings.cascade_anthropic_model
+    return None
+
+
+def _mean_confidence(result: Dict[str, Any]) -> Optional[float]:
+    values = [
+        entity["confidence"] for entity in result.get("annotations", [])
+        if isinstance(entity, dict) and isinstance(entity.get("confidence"), (int, float))
+    ]
+    scores = result.get("confidence_scores")
+    if isinstance(scores, dict):
+        values.extend(value for value in scores.values() if isinstance(value, (int, float)))
+    return sum(values) / len(values) if values else None
+
+
+def chunk_quality_flags(
+    result: Dict[str, Any],
+    alignment_stats: Dict[str, int],
+    max_tokens: int
+) -> List[str]:
+    """Reasons a first-pass chunk result looks unreliable (empty when it looks fine)"""
+    reasons = []
+
+    if result.get("truncated", result.get("output_tokens", 0) >= max_tokens):
+        reasons.append("truncated")
+
+    # Offsets the model got wrong and alignment had to repair or drop
+    total = sum(alignment_stats.values())
+    repaired = total - alignment_stats.get("exact", 0)
+    if total and repaired / total > settings.cascade_max_repair_rate:
+        reasons.append("repair_rate")
+
+    confidence = _mean_confidence(result)
+    if confidence is not None and confidence < settings.cascade_min_confidence:
+        reasons.append("low_confidence")
+
+    return reasons
+
+
+def error_flag(error: Exception) -> str:
+    """Escalation reason for a first-pass call that raised"""
+    message = str(error).lower()
+    return "parse_failure" if "parse" in message or "json" in message else "error"
+
+
+def density_outliers(densities: Dict[int, float], factor: float) -> List[int]:
+    """Chunk ids whose entity density is more than factor times off the median"""
+    if len(densities) < 3:
+        return []
+    median = statistics.median(densities.values())
+    if median <= 0:
+        return []
+    return [
+        chunk_id for chunk_id, density in densities.items()
+        if density > median * factor or density < median / factor
+    ]
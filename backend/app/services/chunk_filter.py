@@ -0,0 +1,169 @@
+from typing import Dict, Any, Optional
+import re
+
+from app.config import settings
+
+
+_SEGMENT_SPLIT = re.compile(r"\n|(?=\[\d{1,3}\]\s)")
+_REFERENCE_MARKER = re.compile(r"^\s*(?:\[\d{1,3}\]|\d{1,3}\.\s+[A-Z][\w'-]+,)")
+_YEAR = re.compile(r"\(?\b(?:19|20)\d{2}[a-z]?\b\)?")
+# "Surname, I." or "Surname, I. J."; a reference entry without a list marker names several authors
+_AUTHOR = re.compile(r"\b[A-Z][\w'-]+,\s(?:[A-Z]\.\s?){1,3}")
+_MIN_AUTHORS = 2
+_AFFILIATION_CUE = re.compile(
+    r"\b(?:University|Universit[àäé]|Institute|Institut|Department|Dept\.|Laborator(?:y|ies)|College|"
+    r"Faculty|School of|Cent(?:er|re) for|Academy)\b"
+)
+_EMAIL = re.compile(r"[\w.+-]+@[\w-]+\.[\w.]+")
+# Lower-case words an address line may still contain
+_NAME_PARTICLES = {"of", "and", "for", "the", "de", "la", "du", "der", "und", "di", "in", "at"}
+_LATEX = re.compile(r"\\[A-Za-z]+|[{}$^_\\]")
+_WORD = re.compile(r"\b[^\W\d_]{2,}\b")
+
+# Tag names or definitions that make a category worth annotating after all
+_PROTECTING_TERMS = {
+    "references": re.compile(r"referen|citation|cite|bibliograph|journal|doi|author", re.IGNORECASE),
+    "affiliations": re.compile(r"affiliat|institut|universit|organi[sz]ation|author|email|address", re.IGNORECASE),
+    "latex": re.compile(r"equation|formula|math|latex|symbol", re.IGNORECASE),
+    "numeric": re.compile(r"table|number|value|measurement|coordinate", re.IGNORECASE)
+}
+
+
+def _visible(text: str) -> int:
+    return sum(1 for c in text if not c.isspace())
+
+
+def _is_reference(segment: str) -> bool:
+    """Short, carries a year and has list structure: a leading [n] / "n. Surname," marker or several authors.
+
+    Years, numeric ranges and "et al." alone are common in prose and do not count.
+    """
+    return len(segment) <= 500 and bool(_YEAR.search(segment)) and bool(
+        _REFERENCE_MARKER.match(segment) or len(_AUTHOR.findall(segment)) >= _MIN_AUTHORS
+    )
+
+
+def _is_affiliation(segment: str) -> bool:
+    """Short, and an e-mail address or an institution named in a line of mostly capitalized words.
+
+    Prose mentioning a university ("produced at the University of Sheffield") has
+    too many lower-case words to count.
+    """
+    if len(segment) > 300:
+        return False
+    if _EMAIL.search(segment):
+        return True
+    if not _AFFILIATION_CUE.search(segment):
+        return False
+    words = [word for word in _WORD.findall(segment) if word.lower() not in _NAME_PARTICLES]
+    lower = sum(1 for word in words if word[0].islower())
+    return bool(words) and lower / len(words) <= 0.2
+
+
+def _is_latex(segment: str) -> bool:
+    visible = _visible(segment)
+    markup = sum(len(match.group()) for match in _LATEX.finditer(segment))
+    return bool(visible) and markup / visible >= settings.chunk_filter_latex_ratio
+
+
+def _is_numeric(segment: str) -> bool:
+    """Table-like: mostly digits and separators, and few of its tokens are words"""
+    visible = _visible(segment)
+    if not visible:
+        return False
+    symbols = sum(1 for c in segment if not c.isalpha() and not c.isspace())
+    return symbols / visible >= 0.6 and len(_WORD.findall(segment)) / len(segment.split()) < 0.3
+
+
+_DETECTORS = {
+    "references": _is_reference,
+    "affiliations": _is_affiliation,
+    "latex": _is_latex,
+    "numeric": _is_numeric
+}
+
+
+def chunk_features(text: str) -> Dict[str, float]:
+    """Share of a chunk's characters in each content-free category, plus what is left over.
+
+    The chunk is split into lines (and at inline reference markers); each line is
+    assigned to the first category it looks like. Shares are by characters, so one
+    reference line cannot outweigh a paragraph of prose.
+    """
+    segments = [segment for segment in _SEGMENT_SPLIT.split(text) if segment.strip()]
+    total = sum(len(segment) for segment in segments) or 1
+    chars = dict.fromkeys(_DETECTORS, 0)
+    content_chars = 0
+    for segment in segments:
+        category = next((name for name, detect in _DETECTORS.items() if detect(segment)), None)
+        if category is None:
+            content_chars += _visible(segment)
+        else:
+            chars[category] += len(segment)
+
+    return {
+        **{f"{name}_share": count / total for name, count in chars.items()},
+        "content_chars": content_chars
+    }
+
+
+class ChunkFilter:
+    """CPU-side triage of chunks before they are sent to the LLM.
+
+    Chunks that look like reference lists, affiliation blocks, LaTeX residue or
+    bare numeric tables are skipped; chunks that only lean that way get a smaller
+    output budget. A category is never skipped when the tag set itself mentions
+    it (a tag for citations keeps reference lists), and known gazetteer terms in a
+    chunk soften the decision by one step.
+    """
+
+    def __init__(self, tag_definitions: Any, mode: Optional[str] = None):
+        self.mode = mode or settings.chunk_filter_mode
+        if self.mode not in ("off", "reduce", "skip"):
+            raise ValueError(f"Unsupported chunk filter mode: {self.mode}")
+
+        described = " ".join(
+            f"{tag.get('tag_name', tag.get('name', ''))} {tag.get('definition', '')}"
+            for tag in tag_definitions
+        ) if isinstance(tag_definitions, list) else ""
+        self.protected = {category for category, pattern in _PROTECTING_TERMS.items() if pattern.search(described)}
+
+    def classify(self, text: str, known_entities: int = 0) -> Dict[str, Any]:
+        """{"action": "keep" | "reduce" | "skip", "reasons": [...], "features": {...}}"""
+        if self.mode == "off":
+            return {"action": "keep", "reasons": [], "features": {}}
+
+        features = chunk_features(text)
+        shares = {
+            category: features[f"{category}_share"]
+            for category in _DETECTORS
+            if category not in self.protected
+        }
+        reasons = sorted(
+            (category for category, share in shares.items() if share >= settings.chunk_filter_min_share / 2),
+            key=lambda category: -shares[category]
+        )
+        dominant = sum(shares[category] for category in reasons) >= settings.chunk_filter_min_share
+
+        # Any real paragraph left over keeps the chunk, whatever surrounds it
+        if dominant and features["content_chars"] <= settings.chunk_filter_max_content_chars:
+            action = "skip"
+        elif reasons:
+            action = "reduce"
+        else:
+            action = "keep"
+
+        # A known entity means the chunk is not content-free after all
+        if known_entities:
+            action = {"skip": "reduce", "reduce": "keep"}.get(action, action)
+        if action == "skip" and self.mode == "reduce":
+            action = "reduce"
+
+        return {
+            "action": action,
+            "reasons": reasons,
+            "features": {name: round(value, 3) for name, value in features.items()}
+        }
+
+    def reduced_budget(self, max_tokens: int) -> int:
+        return min(max_tokens, settings.chunk_filter_reduced_max_tokens)
@@ -0,0 +1,169 @@
+from typing import Dict, List, Any, Optional
+import numpy as np
+
+from app.services.document_index import get_document_index
+
+
+class EntityColumns:
+    """Entity spans loaded into NumPy arrays for vectorized validation"""
+
+    def __init__(
+        self,
+        starts: np.ndarray,
+        ends: np.ndarray,
+        label_ids: np.ndarray,
+        labels: List[str],
+        texts: List[str],
+        loadable: np.ndarray
+    ):
+        self.starts = starts
+        self.ends = ends
+        self.label_ids = label_ids
+        self.labels = labels
+        self.texts = texts
+        # False for incomplete rows: offsets that could not be read as integers, or no text
+        self.loadable = loadable
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    @classmethod
+    def from_annotations(
+        cls,
+        annotations: List[Dict[str, Any]],
+        start_key: str = "start_char",
+        end_key: str = "end_char",
+        label_key: str = "label",
+        text_key: str = "text"
+    ) -> "EntityColumns":
+        """Build columns from a list of annotation dicts"""
+        count = len(annotations)
+        raw_starts = [annotation.get(start_key, 0) for annotation in annotations]
+        raw_ends = [annotation.get(end_key, 0) for annotation in annotations]
+        loadable = np.ones(count, dtype=bool)
+
+        try:
+            starts = np.array(raw_starts, dtype=np.int64).reshape(count)
+            ends = np.array(raw_ends, dtype=np.int64).reshape(count)
+        except (TypeError, ValueError, OverflowError):
+            # Fall back to row by row conversion so one bad row does not sink the batch
+            starts = np.zeros(count, dtype=np.int64)
+            ends = np.zeros(count, dtype=np.int64)
+            for i in range(count):
+                try:
+                    starts[i] = int(raw_starts[i])
+                    ends[i] = int(raw_ends[i])
+                except (TypeError, ValueError, OverflowError):
+                    loadable[i] = False
+
+        # Intern labels so each distinct label string is stored once
+        label_lookup: Dict[Any, int] = {}
+        raw_labels = [annotation.get(label_key, "") for annotation in annotations]
+        label_ids = np.fromiter(
+            (label_lookup.setdefault(label, len(label_lookup)) for label in raw_labels),
+            dtype=np.int32,
+            count=count
+        )
+        labels = list(label_lookup)
+
+        # Missing or non-string text (None from a model, a number) is compared as ""
+        # and the row flagged incomplete, as the Streamlit vectorized check does
+        texts = [annotation.get(text_key, "") for annotation in annotations]
+        for i, t in enumerate(texts):
+            if not isinstance(t, str):
+                texts[i] = ""
+                loadable[i] = False
+
+        return cls(starts, ends, label_ids, labels, texts, loadable)
+
+
+def find_invalid_bounds(columns: EntityColumns, text_length: int) -> np.ndarray:
+    """Mask of spans that fall outside the text or are empty/reversed"""
+    return (
+        ~columns.loadable |
+        (columns.starts < 0) |
+        (columns.ends > text_length) |
+        (columns.starts >= columns.ends)
+    )
+
+
+def find_zero_length(columns: EntityColumns) -> np.ndarray:
+    """Indices of zero-length spans"""
+    return np.flatnonzero(columns.loadable & (columns.starts == columns.ends))
+
+
+def find_text_mismatches(columns: EntityColumns, text: str, in_bounds: np.ndarray) -> np.ndarray:
+    """Mask of in-bounds spans whose slice of text differs from the entity text.
+
+    Lengths are compared first; spans of the right length are compared character by
+    character in one gather over the UTF-32 code points of the document.
+    """
+    mismatched = np.zeros(len(columns), dtype=bool)
+    if not len(columns):
+        return mismatched
+
+    expected_lengths = np.fromiter((len(t) for t in columns.texts), dtype=np.int64, count=len(columns))
+    span_lengths = columns.ends - columns.starts
+    candidates = in_bounds & (span_lengths == expected_lengths)
+    mismatched[in_bounds & ~candidates] = True
+
+    candidate_idx = np.flatnonzero(candidates & (expected_lengths > 0))
+    if not len(candidate_idx):
+        return mismatched
+
+    document = get_document_index(text).codepoints
+    expected = np.frombuffer(
+        "".join(columns.texts[i] for i in candidate_idx).encode("utf-32-le"),
+        dtype=np.uint32
+    )
+
+    lengths = expected_lengths[candidate_idx]
+    offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    gather = np.repeat(columns.starts[candidate_idx] - offsets, lengths) + np.arange(len(expected))
+    char_differs = document[gather] != expected
+    mismatched[candidate_idx] = np.add.reduceat(char_differs, offsets) > 0
+
+    return mismatched
+
+
+def find_adjacent_overlaps(columns: EntityColumns, order: Optional[np.ndarray] = None) -> np.ndarray:
+    """Pairs (i, j) of spans where span i, sorted by start, runs past the start of the next one"""
+    if order is None:
+        order = np.argsort(columns.starts, kind="stable")
+    if len(order) < 2:
+        return np.empty((0, 2), dtype=np.int64)
+
+    current = order[:-1]
+    following = order[1:]
+    overlapping = columns.ends[current] > columns.starts[following]
+    return np.stack([current[overlapping], following[overlapping]], axis=1)
+
+
+def find_same_label_nesting(columns: EntityColumns, mask: Optional[np.ndarray] = None) -> np.ndarray:
+    """Pairs (outer, inner) where inner lies inside an earlier span with the same label"""
+    idx = np.flatnonzero(columns.loadable if mask is None else mask & columns.loadable)
+    if len(idx) < 2:
+        return np.empty((0, 2), dtype=np.int64)
+
+    starts = columns.starts[idx]
+    ends = columns.ends[idx]
+    label_ids = columns.label_ids[idx].astype(np.int64)
+
+    # Sort by label, then start, longest first so containers precede their contents
+    order = np.lexsort((-ends, starts, label_ids))
+    starts, ends, label_ids, idx = starts[order], ends[order], label_ids[order], idx[order]
+
+    # Lift each label group into its own value range so one running max covers all groups
+    stride = max(int(ends.max()), int(starts.max())) - min(int(starts.min()), 0) + 1
+    shifted_ends = ends - min(int(starts.min()), 0) + label_ids * stride
+
+    running_max = np.maximum.accumulate(shifted_ends)
+    previous_max = np.concatenate(([np.iinfo(np.int64).min], running_max[:-1]))
+    nested = shifted_ends <= previous_max
+
+    # Position of the span that set the running max, i.e. the containing span
+    setter = np.where(shifted_ends == running_max, np.arange(len(idx)), 0)
+    previous_setter = np.concatenate(([0], np.maximum.accumulate(setter)[:-1]))
+
+    inner = np.flatnonzero(nested)
+    return np.stack([idx[previous_setter[inner]], idx[inner]], axis=1)
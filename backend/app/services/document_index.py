@@ -0,0 +1,144 @@
+from typing import List, Optional, Tuple
+from array import array
+from bisect import bisect_left, bisect_right
+import re
+import numpy as np
+
+from app.config import settings
+from app.services.caching import LRUCache, text_hash
+
+
+_TERMINATOR_PATTERN = re.compile(r"[.!?]")
+_TOKEN_PATTERN = re.compile(r"\S+")
+_WORD_PATTERN = re.compile(r"\w+")
+_PARAGRAPH_BREAK_PATTERN = re.compile(r"\n[ \t\r\f\v]*\n\s*")
+
+
+class DocumentIndex:
+    """Boundary offsets of one document, computed once and looked up by bisection.
+
+    Holds the positions of sentence terminators, whitespace token and word spans,
+    line starts and paragraph starts. Everything is derived in a single regex pass
+    per structure when the index is built; callers only ever bisect afterwards.
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        self.length = len(text)
+
+        # Position of every '.', '!' and '?', and the subset followed by whitespace or end of text
+        self.terminators = array("q", (m.start() for m in _TERMINATOR_PATTERN.finditer(text)))
+        self.sentence_ends = array("q", (
+            pos for pos in self.terminators
+            if pos + 1 == self.length or text[pos + 1].isspace()
+        ))
+
+        # Whitespace tokens, identical to text.split()
+        self.token_starts = array("q")
+        self.token_ends = array("q")
+        for match in _TOKEN_PATTERN.finditer(text):
+            self.token_starts.append(match.start())
+            self.token_ends.append(match.end())
+
+        # Alphanumeric runs, used to tell whole-word matches from partial ones
+        self.word_starts = array("q")
+        self.word_ends = array("q")
+        for match in _WORD_PATTERN.finditer(text):
+            self.word_starts.append(match.start())
+            self.word_ends.append(match.end())
+
+        self.line_starts = array("q", [0])
+        self.line_starts.extend(m.end() for m in re.finditer("\n", text))
+
+        self.paragraph_starts = array("q", [0])
+        self.paragraph_starts.extend(m.end() for m in _PARAGRAPH_BREAK_PATTERN.finditer(text))
+
+        self._codepoints: Optional[np.ndarray] = None
+
+    @property
+    def codepoints(self) -> np.ndarray:
+        """UTF-32 code points of the text, built on first use for vectorized comparisons"""
+        if self._codepoints is None:
+            self._codepoints = np.frombuffer(self.text.encode("utf-32-le"), dtype=np.uint32)
+        return self._codepoints
+
+    def last_terminator(self, lo: int, hi: int) -> int:
+        """Position of the last '.', '!' or '?' in [lo, hi), or -1"""
+        return self._last_in(self.terminators, lo, hi)
+
+    def last_sentence_end(self, lo: int, hi: int) -> int:
+        """Position of the last terminator in [lo, hi) that is followed by whitespace, or -1"""
+        return self._last_in(self.sentence_ends, lo, hi)
+
+    def last_line_break(self, lo: int, hi: int) -> int:
+        """Position of the last newline in [lo, hi), or -1"""
+        # A line starting at p means a newline sits at p - 1
+        line_start = self._last_in(self.line_starts, lo + 1, hi + 1)
+        return line_start - 1 if line_start > 0 else -1
+
+    def last_token_end(self, lo: int, hi: int) -> int:
+        """End offset of the last whitespace token ending in (lo, hi), or -1"""
+        index = bisect_left(self.token_ends, hi) - 1
+        if index >= 0 and self.token_ends[index] > lo:
+            return self.token_ends[index]
+        return -1
+
+    def tokens(self) -> List[Tuple[str, int, int]]:
+        """Whitespace tokens as (token, start, end) triples"""
+        text = self.text
+        return [(text[start:end], start, end) for start, end in zip(self.token_starts, self.token_ends)]
+
+    def token_range(self, start: int, end: int) -> Tuple[int, int]:
+        """Indices [first, last) of the tokens overlapping the span [start, end)"""
+        first = bisect_right(self.token_ends, start)
+        last = bisect_left(self.token_starts, end)
+        return first, max(first, last)
+
+    def token_floor(self, pos: int) -> int:
+        """Start of the whitespace token containing pos, or pos itself between tokens"""
+        index = bisect_right(self.token_starts, pos) - 1
+        if index >= 0 and self.token_ends[index] > pos:
+            return self.token_starts[index]
+        return pos
+
+    def token_ceil(self, pos: int) -> int:
+        """End of the whitespace token containing pos, or pos itself between tokens"""
+        index = bisect_right(self.token_ends, pos)
+        if index < len(self.token_starts) and self.token_starts[index] < pos:
+            return self.token_ends[index]
+        return pos
+
+    def splits_word(self, start: int, end: int) -> bool:
+        """True when either end of the span falls strictly inside an alphanumeric run"""
+        return self._inside_word(start) or self._inside_word(end)
+
+    def line_of(self, pos: int) -> int:
+        """Zero-based line number of a character offset"""
+        return bisect_right(self.line_starts, pos) - 1
+
+    def paragraph_of(self, pos: int) -> int:
+        """Zero-based paragraph number of a character offset"""
+        return bisect_right(self.paragraph_starts, pos) - 1
+
+    def sentence_of(self, pos: int) -> int:
+        """Zero-based sentence number of a character offset"""
+        return bisect_left(self.sentence_ends, pos)
+
+    def _inside_word(self, pos: int) -> bool:
+        index = bisect_right(self.word_starts, pos) - 1
+        return index >= 0 and self.word_starts[index] < pos < self.word_ends[index]
+
+    @staticmethod
+    def _last_in(positions: array, lo: int, hi: int) -> int:
+        index = bisect_left(positions, hi) - 1
+        if index >= 0 and positions[index] >= lo:
+            return positions[index]
+        return -1
+
+
+_index_cache = LRUCache(maxsize=settings.document_index_cache_size)
+
+
+def get_document_index(text: str) -> DocumentIndex:
+    """Shared DocumentIndex for text, cached by content hash"""
+    return _index_cache.get_or_create(text_hash(text), lambda: DocumentIndex(text))
@@ -0,0 +1,83 @@
+from typing import Dict, List, Any, Hashable, Sequence
+
+
+def merge_overlapping_spans(
+    starts: Sequence[int],
+    ends: Sequence[int],
+    labels: Sequence[Hashable],
+    scores: Sequence[float],
+    min_overlap: float = 0.8
+) -> List[int]:
+    """Sweep-line merge of same-label spans that overlap by more than min_overlap.
+
+    Returns the indices of the spans that survive, in sweep order. When two spans
+    are duplicates the one with the higher score is kept (ties keep the earlier one).
+    """
+    order = sorted(range(len(starts)), key=lambda i: (starts[i], ends[i]))
+
+    kept: List[int] = []  # slot -> index of the span currently held in that slot
+    active: Dict[Hashable, List[int]] = {}  # label -> slots that may still overlap
+
+    for current in order:
+        current_start = starts[current]
+        current_end = ends[current]
+        current_length = current_end - current_start
+
+        # Spans are visited by start, so a kept span ending at or before this start
+        # cannot overlap anything that comes later and is dropped from the sweep.
+        bucket = active.get(labels[current], [])
+        still_active = []
+        duplicate_slot = -1
+
+        for slot in bucket:
+            existing = kept[slot]
+            existing_end = ends[existing]
+            if existing_end <= current_start:
+                continue
+            still_active.append(slot)
+
+            if duplicate_slot != -1:
+                continue
+
+            overlap_length = min(current_end, existing_end) - current_start
+            existing_length = existing_end - starts[existing]
+            if overlap_length <= 0 or current_length <= 0 or existing_length <= 0:
+                continue
+
+            if (overlap_length / current_length > min_overlap or
+                    overlap_length / existing_length > min_overlap):
+                duplicate_slot = slot
+
+        if duplicate_slot == -1:
+            still_active.append(len(kept))
+            kept.append(current)
+        elif scores[current] > scores[kept[duplicate_slot]]:
+            kept[duplicate_slot] = current
+
+        active[labels[current]] = still_active
+
+    return kept
+
+
+def merge_overlapping_annotations(
+    annotations: List[Dict[str, Any]],
+    start_key: str = "start",
+    end_key: str = "end",
+    label_key: str = "tag",
+    score_key: str = "confidence",
+    min_overlap: float = 0.8
+) -> List[Dict[str, Any]]:
+    """Merge duplicate annotations (same label, >80% overlap) keeping the higher confidence one"""
+
+    if not annotations:
+        return []
+
+    starts = [ann.get(start_key, 0) for ann in annotations]
+    ends = [ann.get(end_key, 0) for ann in annotations]
+    labels = [ann.get(label_key, "") for ann in annotations]
+    scores = [ann.get(score_key, 0) or 0 for ann in annotations]
+
+    kept = merge_overlapping_spans(starts, ends, labels, scores, min_overlap)
+    kept.sort(key=lambda i: starts[i])
+
+    return [annotations[i] for i in kept]
@@ -0,0 +1,196 @@
+from typing import Dict, List, Any, Iterable, Iterator, Optional, Sequence
+from array import array
+import numpy as np
+
+from app.services.columnar_validation import EntityColumns
+from app.services.entity_merger import merge_overlapping_spans
+
+
+class EntityTable:
+    """Struct-of-arrays store for entities moving through the annotation pipeline.
+
+    Offsets live in parallel integer arrays and labels are interned to ids. The entity
+    text is not stored at all while it matches the source document slice; only rows
+    whose text disagrees with their offsets keep their own string. Optional fields
+    (confidence, chunk_id, alignment, source, ...) are kept as sparse columns.
+    Iterating the table yields plain dict views for API compatibility.
+    """
+
+    CORE_FIELDS = ("start_char", "end_char", "text", "label")
+
+    def __init__(self, source_text: str, labels: Optional[Sequence[str]] = None):
+        self.source_text = source_text
+        self.starts = array("q")
+        self.ends = array("q")
+        self.label_ids = array("i")
+        self.labels: List[str] = list(labels) if labels else []
+        self._label_lookup: Dict[str, int] = {label: i for i, label in enumerate(self.labels)}
+        self._text_overrides: Dict[int, str] = {}
+        self._extras: Dict[str, List[Any]] = {}
+
+    @classmethod
+    def from_dicts(cls, source_text: str, entities: Iterable[Dict[str, Any]]) -> "EntityTable":
+        """Build a table from entity dicts with start_char, end_char, text and label keys"""
+        table = cls(source_text)
+        table.extend(entities)
+        return table
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for row in range(len(self.starts)):
+            yield self.row(row)
+
+    def intern_label(self, label: str) -> int:
+        """Return the id for a label, registering it on first use"""
+        label_id = self._label_lookup.get(label)
+        if label_id is None:
+            label_id = self._label_lookup[label] = len(self.labels)
+            self.labels.append(label)
+        return label_id
+
+    def append(self, entity: Dict[str, Any], **extras: Any):
+        """Add one entity; keys beyond the core fields become sparse columns"""
+        row = len(self.starts)
+        start = int(entity.get("start_char", 0))
+        end = int(entity.get("end_char", 0))
+        entity_text = entity.get("text", "")
+
+        self.starts.append(start)
+        self.ends.append(end)
+        self.label_ids.append(self.intern_label(entity.get("label", "")))
+
+        if not (0 <= start <= end <= len(self.source_text) and
+                self.source_text[start:end] == entity_text):
+            self._text_overrides[row] = entity_text
+
+        for key, value in entity.items():
+            if key not in self.CORE_FIELDS:
+                self.set_extra(row, key, value)
+        for key, value in extras.items():
+            self.set_extra(row, key, value)
+
+    def extend(self, entities: Iterable[Dict[str, Any]], **extras: Any):
+        for entity in entities:
+            self.append(entity, **extras)
+
+    def set_extra(self, row: int, key: str, value: Any):
+        column = self._extras.setdefault(key, [])
+        if len(column) <= row:
+            column.extend([None] * (row + 1 - len(column)))
+        column[row] = value
+
+    def get_extra(self, row: int, key: str, default: Any = None) -> Any:
+        column = self._extras.get(key)
+        if column is None or row >= len(column) or column[row] is None:
+            return default
+        return column[row]
+
+    def extra_column(self, key: str, default: Any = None) -> List[Any]:
+        """Dense copy of an optional column, filling missing rows with default"""
+        column = self._extras.get(key, [])
+        values = [default if value is None else value for value in column]
+        values.extend([default] * (len(self.starts) - len(values)))
+        return values
+
+    def drop_extra(self, key: str):
+        self._extras.pop(key, None)
+
+    def text_at(self, row: int) -> str:
+        override = self._text_overrides.get(row)
+        if override is not None:
+            return override
+        return self.source_text[self.starts[row]:self.ends[row]]
+
+    def label_at(self, row: int) -> str:
+        return self.labels[self.label_ids[row]]
+
+    def set_span(self, row: int, start: int, end: int):
+        """Move a row to new offsets, keeping its text"""
+        entity_text = self.text_at(row)
+        self.starts[row] = start
+        self.ends[row] = end
+        if self.source_text[start:end] == entity_text:
+            self._text_overrides.pop(row, None)
+        else:
+            self._text_overrides[row] = entity_text
+
+    def shift(self, offset: int, first_row: int = 0):
+        """Add offset to every span from first_row on (e.g. chunk to document coordinates)"""
+        for row in range(first_row, len(self.starts)):
+            entity_text = self.text_at(row)
+            self.starts[row] += offset
+            self.ends[row] += offset
+            if self.source_text[self.starts[row]:self.ends[row]] == entity_text:
+                self._text_overrides.pop(row, None)
+            else:
+                self._text_overrides[row] = entity_text
+
+    def mismatched_rows(self) -> List[int]:
+        """Rows whose text does not match the source at their offsets"""
+        return sorted(self._text_overrides)
+
+    def row(self, row: int) -> Dict[str, Any]:
+        """Dict view of one row in the same shape the pipeline has always returned"""
+        entity = {
+            "start_char": self.starts[row],
+            "end_char": self.ends[row],
+            "text": self.text_at(row),
+            "label": self.labels[self.label_ids[row]]
+        }
+        for key, column in self._extras.items():
+            if row < len(column) and column[row] is not None:
+                entity[key] = column[row]
+        return entity
+
+    def to_dicts(self) -> List[Dict[str, Any]]:
+        return [self.row(row) for row in range(len(self.starts))]
+
+    def take(self, rows: Sequence[int]) -> "EntityTable":
+        """New table holding the given rows in the given order"""
+        table = EntityTable(self.source_text, self.labels)
+        table.starts = array("q", (self.starts[row] for row in rows))
+        table.ends = array("q", (self.ends[row] for row in rows))
+        table.label_ids = array("i", (self.label_ids[row] for row in rows))
+
+        if self._text_overrides:
+            for new_row, row in enumerate(rows):
+                override = self._text_overrides.get(row)
+                if override is not None:
+                    table._text_overrides[new_row] = override
+
+        for key, column in self._extras.items():
+            table._extras[key] = [column[row] if row < len(column) else None for row in rows]
+
+        return table
+
+    def start_array(self) -> np.ndarray:
+        return np.frombuffer(self.starts, dtype=np.int64) if len(self.starts) else np.zeros(0, dtype=np.int64)
+
+    def end_array(self) -> np.ndarray:
+        return np.frombuffer(self.ends, dtype=np.int64) if len(self.ends) else np.zeros(0, dtype=np.int64)
+
+    def columns(self) -> EntityColumns:
+        """Zero-copy NumPy view for the columnar validators"""
+        label_ids = np.frombuffer(self.label_ids, dtype=np.int32) if len(self.label_ids) else np.zeros(0, dtype=np.int32)
+        return EntityColumns(
+            self.start_array(),
+            self.end_array(),
+            label_ids,
+            self.labels,
+            [self.text_at(row) for row in range(len(self.starts))],
+            np.ones(len(self.starts), dtype=bool)
+        )
+
+    def remove_duplicates(self, min_overlap: float = 0.8) -> "EntityTable":
+        """Merge same-label spans that overlap by more than min_overlap, keeping higher confidence"""
+        kept = merge_overlapping_spans(
+            self.starts,
+            self.ends,
+            self.label_ids,
+            self.extra_column("confidence", 0),
+            min_overlap
+        )
+        kept.sort(key=lambda row: self.starts[row])
+        return self.take(kept)
@@ -0,0 +1,259 @@
+from typing import Dict, List, Any, Optional, Sequence, Tuple
+from datetime import datetime
+import hashlib
+import json
+import re
+import string
+
+from app.config import settings
+from app.services.caching import LRUCache
+from app.services.prompt_compiler import CompiledPrompt
+from app.services.tokenizers import Tokenizer
+
+
+_VERDICTS = {
+    "CORRECT": "keep",
+    "KEEP": "keep",
+    "CHANGE_LABEL": "change_label",
+    "CHANGE": "change_label",
+    "DELETE": "delete",
+    "REMOVE": "delete"
+}
+_OBJECT_PATTERN = re.compile(r"\{[^{}]*\}")
+_CONTEXT_WORD = re.compile(r"\w+")
+_EDGE_PUNCTUATION = string.punctuation + "“”‘’«»"
+
+
+def _normalize_surface(surface: str) -> str:
+    return " ".join(str(surface or "").split()).strip(_EDGE_PUNCTUATION).casefold()
+
+
+def _context_signature(text: str, start: Any, end: Any, words: int) -> str:
+    """Short hash of the lower-cased words on either side of a span"""
+    try:
+        start, end = int(start), int(end)
+    except (TypeError, ValueError):
+        return ""
+    left = _CONTEXT_WORD.findall(text[max(0, start - 20 * words):start])[-words:]
+    right = _CONTEXT_WORD.findall(text[end:end + 20 * words])[:words]
+    payload = " ".join(left).lower() + "|" + " ".join(right).lower()
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:12]
+
+
+def evaluation_key(annotation: Dict[str, Any], text: Optional[str] = None, context_words: int = 0) -> str:
+    """Grouping key of an annotation: normalized surface text and label, plus a context signature.
+
+    The signature (context_words words either side, hashed) is only added when the
+    source text is given, so homographs in different settings can be judged apart.
+    """
+    key = f"{_normalize_surface(annotation.get('text', ''))}\x1f{annotation.get('label', '')}"
+    if text and context_words > 0:
+        key += "\x1f" + _context_signature(
+            text, annotation.get("start_char"), annotation.get("end_char"), context_words
+        )
+    return key
+
+
+def group_annotations(
+    annotations: List[Dict[str, Any]],
+    text: Optional[str] = None,
+    context_words: int = 0
+) -> Tuple[List[str], Dict[str, List[int]]]:
+    """Key of every annotation, and the indices of each group in first-seen order"""
+    keys = [evaluation_key(annotation, text, context_words) for annotation in annotations]
+    groups: Dict[str, List[int]] = {}
+    for index, key in enumerate(keys):
+        groups.setdefault(key, []).append(index)
+    return keys, groups
+
+
+def plan_batches(
+    prompt: CompiledPrompt,
+    annotations: List[Dict[str, Any]],
+    indices: Sequence[int],
+    tokenizer: Tokenizer,
+    max_tokens: int
+) -> List[List[int]]:
+    """Split annotation indices into batches that fit the prompt and output budgets.
+
+    A batch closes when its annotation lines reach settings.evaluation_batch_tokens,
+    when its verdicts would no longer fit max_tokens at
+    settings.evaluation_tokens_per_verdict each, or at settings.evaluation_max_batch_size.
+    """
+    verdict_limit = max(1, max_tokens // settings.evaluation_tokens_per_verdict)
+    size_limit = max(1, min(verdict_limit, settings.evaluation_max_batch_size))
+
+    batches: List[List[int]] = []
+    current: List[int] = []
+    current_tokens = 0
+    for index in indices:
+        tokens = tokenizer.count(prompt.evaluation_prompt([annotations[index]]))
+        if current and (len(current) >= size_limit or current_tokens + tokens > settings.evaluation_batch_tokens):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(index)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _candidate_objects(response_text: str) -> List[Any]:
+    """Verdict objects from a JSON reply, or from whatever survives of a truncated one"""
+    try:
+        payload = json.loads(response_text)
+    except (json.JSONDecodeError, TypeError):
+        payload = None
+    if isinstance(payload, dict):
+        payload = payload.get("evaluations", payload.get("results"))
+    if isinstance(payload, list):
+        return payload
+
+    objects = []
+    for match in _OBJECT_PATTERN.finditer(response_text or ""):
+        try:
+            objects.append(json.loads(match.group()))
+        except json.JSONDecodeError:
+            continue
+    return objects
+
+
+def parse_verdicts(
+    response_text: str,
+    batch: List[Dict[str, Any]],
+    tag_names: Sequence[str]
+) -> Dict[int, Dict[str, Any]]:
+    """Verdicts keyed by position in the batch; annotations without a usable verdict are absent.
+
+    A verdict needs a known index and verdict word. A label change to a tag outside
+    the tag set is kept as a "review" verdict rather than applied.
+    """
+    verdicts: Dict[int, Dict[str, Any]] = {}
+    for item in _candidate_objects(response_text):
+        if not isinstance(item, dict):
+            continue
+        try:
+            position = int(item.get("index")) - 1
+        except (TypeError, ValueError):
+            continue
+        recommendation = _VERDICTS.get(str(item.get("verdict", "")).strip().upper())
+        if recommendation is None or not 0 <= position < len(batch) or position in verdicts:
+            continue
+
+        annotation = batch[position]
+        suggested_label = item.get("suggested_label") or annotation.get("label", "")
+        if recommendation == "change_label" and suggested_label not in tag_names:
+            recommendation = "review"
+        try:
+            confidence = min(1.0, max(0.0, float(item.get("confidence", 0.5))))
+        except (TypeError, ValueError):
+            confidence = 0.5
+
+        verdicts[position] = {
+            "is_correct": recommendation == "keep",
+            "recommendation": recommendation,
+            "reasoning": str(item.get("reasoning", "")),
+            "suggested_label": suggested_label if recommendation == "change_label" else annotation.get("label", ""),
+            "confidence": confidence
+        }
+    return verdicts
+
+
+def summarize_batches(batches: List[Dict[str, Any]], results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Totals over per-batch stats and the verdicts they produced"""
+    latencies = sorted(batch["latency_ms"] for batch in batches)
+    recommendations: Dict[str, int] = {}
+    for result in results:
+        recommendations[result["recommendation"]] = recommendations.get(result["recommendation"], 0) + 1
+    return {
+        "batches": len(batches),
+        "rounds": max((batch["round"] for batch in batches), default=0),
+        "retried_entities": sum(batch["size"] for batch in batches if batch["round"] > 1),
+        "unresolved_entities": sum(1 for result in results if result.get("unresolved")),
+        "input_tokens": sum(batch["input_tokens"] for batch in batches),
+        "output_tokens": sum(batch["output_tokens"] for batch in batches),
+        "max_latency_ms": latencies[-1] if latencies else 0,
+        "median_latency_ms": latencies[len(latencies) // 2] if latencies else 0,
+        "recommendations": recommendations
+    }
+
+
+def unresolved_result(index: int, annotation: Dict[str, Any], error: Optional[str]) -> Dict[str, Any]:
+    """Placeholder for an annotation that got no verdict after every retry"""
+    return {
+        "entity_index": index,
+        "original_annotation": annotation,
+        "is_correct": False,
+        "recommendation": "review",
+        "reasoning": f"Evaluation failed: {error}" if error else "No verdict returned by the model",
+        "suggested_label": annotation.get("label", ""),
+        "confidence": 0.5,
+        "unresolved": True
+    }
+
+
+class VerdictStore:
+    """Verdicts per (user, tag set, model, temperature, grouping key): in-process LRU
+    in front of the evaluation_verdicts table.
+
+    Another model or temperature may judge a group differently, so its verdicts are
+    never handed to a request for this one.
+    """
+
+    _memory = LRUCache(maxsize=settings.evaluation_verdict_cache_size)
+
+    def __init__(self, db: Any = None):
+        self.db = db
+
+    def get_many(
+        self, user_id: str, set_hash: str, model: str, temperature: float, keys: Sequence[str]
+    ) -> Dict[str, Dict[str, Any]]:
+        temperature = float(temperature)
+        found = {}
+        for key in keys:
+            verdict = self._memory.get((user_id, set_hash, model, temperature, key))
+            if verdict is not None:
+                found[key] = verdict
+        missing = [key for key in keys if key not in found]
+        if not missing or self.db is None:
+            return found
+
+        try:
+            # Keys go out in slices to keep the query URL short
+            for i in range(0, len(missing), 200):
+                rows = self.db.table("evaluation_verdicts").select("entity_key,verdict") \
+                    .eq("user_id", user_id).eq("tag_set_hash", set_hash) \
+                    .eq("model", model).eq("temperature", temperature) \
+                    .in_("entity_key", missing[i:i + 200]).execute().data or []
+                for row in rows:
+                    found[row["entity_key"]] = row["verdict"]
+                    self._memory.set((user_id, set_hash, model, temperature, row["entity_key"]), row["verdict"])
+        except Exception as e:
+            print(f"⚠️  Failed to load cached verdicts: {e}")
+        return found
+
+    def save_many(
+        self, user_id: str, set_hash: str, model: str, temperature: float, verdicts: Dict[str, Dict[str, Any]]
+    ):
+        temperature = float(temperature)
+        for key, verdict in verdicts.items():
+            self._memory.set((user_id, set_hash, model, temperature, key), verdict)
+        if not verdicts or self.db is None:
+            return
+
+        try:
+            now = datetime.utcnow().isoformat()
+            self.db.table("evaluation_verdicts").upsert([
+                {
+                    "user_id": user_id,
+                    "tag_set_hash": set_hash,
+                    "entity_key": key,
+                    "verdict": verdict,
+                    "model": model,
+                    "temperature": temperature,
+                    "updated_at": now
+                }
+                for key, verdict in verdicts.items()
+            ], on_conflict="user_id,tag_set_hash,model,temperature,entity_key").execute()
+        except Exception as e:
+            print(f"⚠️  Failed to save verdicts: {e}")
@@ -1,10 +1,13 @@
 import json
 import csv
 import io
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Union
 from datetime import datetime
 import pandas as pd
 
+from app.services.document_index import get_document_index
+from app.services.entity_table import EntityTable
+
 
 class ExportService:
     """Service for exporting annotations in various formats"""
@@ -14,7 +17,7 @@ class ExportService:
     
     def export_annotations(
         self,
-        annotations: List[Dict[str, Any]],
+        annotations: Union[List[Dict[str, Any]], EntityTable],
         text: str,
         format_type: str = "json",
         include_metadata: bool = True,
@@ -133,36 +136,19 @@ class ExportService:
     ) -> Dict[str, Any]:
         """Export in CoNLL format (BIO tagging)"""
         
-        # Tokenize text (simple whitespace tokenization)
-        tokens = []
-        token_positions = []
-        current_pos = 0
-        
-        for word in text.split():
-            start_pos = text.find(word, current_pos)
-            end_pos = start_pos + len(word)
-            tokens.append(word)
-            token_positions.append((start_pos, end_pos))
-            current_pos = end_pos
+        # Whitespace tokens come from the shared document index
+        index = get_document_index(text)
+        tokens = [text[start:end] for start, end in zip(index.token_starts, index.token_ends)]
         
         # Create BIO tags
         bio_tags = ["O"] * len(tokens)
         
-        for ann in annotations:
-            start_char = ann.get("start_char", 0)
-            end_char = ann.get("end_char", 0)
-            label = ann.get("label", "")
-            
-            # Find tokens that overlap with this annotation
-            first_token = True
-            for i, (token_start, token_end) in enumerate(token_positions):
-                # Check if token overlaps with annotation
-                if not (token_end <= start_char or token_start >= end_char):
-                    if first_token:
-                        bio_tags[i] = f"B-{label}"
-                        first_token = False
-                    else:
-                        bio_tags[i] = f"I-{label}"
+        table = annotations if isinstance(annotations, EntityTable) else EntityTable.from_dicts(text, annotations)
+        for row in range(len(table)):
+            label = table.label_at(row)
+            first, last = index.token_range(table.starts[row], table.ends[row])
+            for i in range(first, last):
+                bio_tags[i] = f"B-{label}" if i == first else f"I-{label}"
         
         # Create CoNLL format output
         conll_lines = []
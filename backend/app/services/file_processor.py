@@ -1,9 +1,20 @@
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Awaitable, Callable, Optional, Tuple
+import asyncio
 import re
 from datetime import datetime
 
 from app.services.llm_service import LLMService
+from app.services.batch_backend import BatchAdapter, get_batch_adapter, parse_batch_result, run_batch
+from app.services.caching import text_hash
+from app.services.cancellation import CancellationToken, RequestCancelled
 from app.services.cost_calculator import CostCalculator
+from app.services.document_index import get_document_index
+from app.services.entity_table import EntityTable
+from app.services.near_duplicates import chunk_relative_entities, get_near_duplicate_index
+from app.services.prompt_compiler import CompiledPrompt, compile_prompt
+from app.services.rule_extractors import RuleSet, compile_rules
+from app.services.span_resolver import align_chunk_entities
+from app.config import settings
 
 
 class FileProcessor:
@@ -20,30 +31,136 @@ class FileProcessor:
         model: str = "gpt-4",
         user_id: str = "",
         chunk_size: int = 2000,
-        overlap: int = 200
+        overlap: int = 200,
+        execution: str = "sync",
+        batch_adapter: Optional[BatchAdapter] = None,
+        cancellation: Optional[CancellationToken] = None
     ) -> Dict[str, Any]:
-        """Process entire file by chunking and annotating each chunk"""
+        """Process entire file by chunking and annotating each chunk.
+        
+        execution "batch" submits all chunks as one provider batch job instead of
+        calling the model chunk by chunk (see process_batch_files).
+        
+        cancellation stops the work at the request's deadline or when its client
+        disconnects: synchronous runs return the chunks finished so far with a
+        "cancelled" entry, a batch job is cancelled and RequestCancelled raised.
+        """
+        
+        if execution == "batch":
+            batch = await self.process_batch_files(
+                [{"content": content}], tagset, model, user_id,
+                chunk_size=chunk_size, overlap=overlap, execution="batch", batch_adapter=batch_adapter,
+                cancellation=cancellation
+            )
+            file_result = batch["results"][0]
+            if file_result["status"] == "cancelled":
+                raise RequestCancelled(batch["cancelled"])
+            if file_result["status"] != "success":
+                raise Exception(file_result["error"])
+            return {"file_annotations": file_result["result"]}
+        if execution != "sync":
+            raise ValueError(f"Unsupported execution mode: {execution}")
         
         # Split content into manageable chunks
         chunks = self._split_into_chunks(content, chunk_size, overlap)
+        rules, prompt = self._compile_tagset(tagset)
+        
+        async def annotate(i: int, chunk_text: str) -> Dict[str, Any]:
+            return await self.llm_service.annotate_text(
+                text=chunk_text,
+                tag_definitions=prompt,
+                model=model,
+                temperature=0.1
+            )
+        
+        file_annotations = await self._annotate_chunks(
+            content, chunks, prompt, model, user_id, tagset.get("id"), annotate, rules=rules,
+            cancellation=cancellation
+        )
+        return {"file_annotations": file_annotations}
+    
+    async def _annotate_chunks(
+        self,
+        content: str,
+        chunks: List[Dict[str, Any]],
+        prompt: CompiledPrompt,
+        model: str,
+        user_id: str,
+        tagset_id: Optional[str],
+        annotate: Callable[[int, str], Awaitable[Dict[str, Any]]],
+        matches: Optional[List[Optional[Dict[str, Any]]]] = None,
+        price_factor: float = 1.0,
+        rules: Optional[RuleSet] = None,
+        cancellation: Optional[CancellationToken] = None,
+        temperature: float = 0.1
+    ) -> Dict[str, Any]:
+        """Annotate a file's chunks through `annotate` and merge them into file annotations.
         
-        all_annotations = []
+        matches holds near-duplicate lookups already made for each chunk (batch mode);
+        without it chunks are looked up one by one as they are reached. Once
+        cancellation trips, the call in flight is abandoned and the remaining chunks
+        are logged as "cancelled"; finished chunks are already in the near-duplicate
+        index, so a retry does not pay for them again.
+        """
+        
+        # Boilerplate repeated across a user's files is annotated once per tag set
+        near_duplicates = None
+        if user_id and settings.near_duplicate_reuse:
+            near_duplicates = get_near_duplicate_index(user_id, prompt.tag_set_hash, model, temperature)
+        near_duplicate_hits = 0
+        tokens_saved = 0
+        
+        all_annotations = EntityTable(content)
+        # Looked up once: every chunk aligns its entities against it
+        index = get_document_index(content)
         total_cost = 0.0
         total_tokens = 0
         processing_log = []
         
-        # Process each chunk
-        for i, chunk_info in enumerate(chunks):
+        cancelled_at = None
+        abandoned_calls = 0
+        
+        # Process each chunk (none when every tag is rule-only)
+        for i, chunk_info in enumerate(chunks if prompt.tags else []):
             try:
                 chunk_text = chunk_info["text"]
                 chunk_offset = chunk_info["offset"]
                 
+                if matches is not None:
+                    match = matches[i]
+                elif near_duplicates is not None:
+                    match = near_duplicates.reuse(chunk_text)
+                else:
+                    match = None
+                if match is not None:
+                    all_annotations.extend(
+                        {
+                            **entity,
+                            "start_char": entity["start_char"] + chunk_offset,
+                            "end_char": entity["end_char"] + chunk_offset
+                        }
+                        for entity in match["entities"]
+                    )
+                    near_duplicate_hits += 1
+                    tokens_saved += match["tokens_saved"]
+                    processing_log.append({
+                        "chunk": i + 1,
+                        "status": "reused",
+                        "annotations_found": len(match["entities"]),
+                        "similarity": match["similarity"],
+                        "tokens_saved": match["tokens_saved"],
+                        "cost": 0.0
+                    })
+                    continue
+                
                 # Annotate chunk
-                result = await self.llm_service.annotate_text(
-                    text=chunk_text,
-                    tag_definitions=tagset["tags"],
-                    model=model
-                )
+                if cancellation is None:
+                    result = await annotate(i, chunk_text)
+                elif await cancellation.poll():
+                    cancelled_at = i
+                    break
+                else:
+                    result = await cancellation.guard(annotate(i, chunk_text))
                 
                 # Calculate cost for this chunk
                 chunk_cost = self.cost_calculator.calculate_cost(
@@ -51,17 +168,30 @@ class FileProcessor:
                     input_tokens=result["input_tokens"],
                     output_tokens=result["output_tokens"]
                 )
+                chunk_cost["total_cost"] = round(chunk_cost["total_cost"] * price_factor, 6)
                 
                 # Adjust annotation positions to file coordinates
-                adjusted_annotations = []
-                for annotation in result["annotations"]:
-                    adjusted_annotation = annotation.copy()
-                    adjusted_annotation["start"] += chunk_offset
-                    adjusted_annotation["end"] += chunk_offset
-                    adjusted_annotations.append(adjusted_annotation)
+                adjusted_annotations, _ = align_chunk_entities(
+                    content,
+                    result["annotations"],
+                    chunk_offset,
+                    chunk_offset + chunk_info["length"],
+                    margin=settings.alignment_margin,
+                    index=index
+                )
                 
                 all_annotations.extend(adjusted_annotations)
-                total_cost += chunk_cost
+                
+                if near_duplicates is not None:
+                    near_duplicates.add(
+                        chunk_text,
+                        chunk_relative_entities(
+                            adjusted_annotations, chunk_offset, chunk_offset + chunk_info["length"]
+                        ),
+                        input_tokens=result["input_tokens"],
+                        output_tokens=result["output_tokens"]
+                    )
+                total_cost += chunk_cost["total_cost"]
                 total_tokens += result["total_tokens"]
                 
                 processing_log.append({
@@ -69,9 +199,13 @@ class FileProcessor:
                     "status": "success",
                     "annotations_found": len(adjusted_annotations),
                     "tokens_used": result["total_tokens"],
-                    "cost": chunk_cost
+                    "cost": chunk_cost["total_cost"]
                 })
                 
+            except RequestCancelled:
+                cancelled_at = i
+                abandoned_calls += 1
+                break
             except Exception as e:
                 processing_log.append({
                     "chunk": i + 1,
@@ -79,25 +213,53 @@ class FileProcessor:
                     "error": str(e)
                 })
         
+        cancellation_stats = None
+        if cancelled_at is not None:
+            processing_log.extend(
+                {"chunk": i + 1, "status": "cancelled", "cost": 0.0}
+                for i in range(cancelled_at, len(chunks))
+            )
+            cancellation_stats = {
+                "reason": cancellation.reason,
+                "elapsed_seconds": round(cancellation.elapsed(), 3),
+                "chunks_completed": cancelled_at,
+                "chunks_cancelled": len(chunks) - cancelled_at,
+                "calls_abandoned": abandoned_calls
+            }
+            print(f"🛑 File processing cancelled ({cancellation.reason}) with {len(chunks) - cancelled_at}/{len(chunks)} chunks left")
+        
+        if rules:
+            all_annotations.extend(await asyncio.to_thread(rules.extract, content))
+        
         # Remove duplicate annotations from overlapping regions
         merged_annotations = self._merge_overlapping_annotations(all_annotations)
         
         return {
-            "file_annotations": {
-                "content": content,
-                "annotations": merged_annotations,
-                "tagset_id": tagset.get("id"),
-                "model_used": model,
-                "total_annotations": len(merged_annotations),
-                "total_tokens": total_tokens,
-                "total_cost": total_cost,
-                "chunks_processed": len(chunks),
-                "processing_log": processing_log,
-                "created_at": datetime.utcnow().isoformat(),
-                "user_id": user_id
-            }
+            "content": content,
+            "annotations": merged_annotations.to_dicts(),
+            "tagset_id": tagset_id,
+            "model_used": model,
+            "total_annotations": len(merged_annotations),
+            "total_tokens": total_tokens,
+            "total_cost": total_cost,
+            "chunks_processed": len(chunks),
+            "processing_log": processing_log,
+            "near_duplicates": {
+                "hits": near_duplicate_hits,
+                "hit_rate": near_duplicate_hits / len(chunks) if chunks else 0.0,
+                "tokens_saved": tokens_saved
+            },
+            **({"cancelled": cancellation_stats} if cancellation_stats else {}),
+            "created_at": datetime.utcnow().isoformat(),
+            "user_id": user_id
         }
     
+    def _compile_tagset(self, tagset: Dict[str, Any]) -> Tuple[Optional[RuleSet], CompiledPrompt]:
+        """Rule extractors of a tag set and the prompt for the tags left to the LLM"""
+        rules = compile_rules(tagset["tags"])
+        prompt = compile_prompt(rules.llm_tag_definitions(tagset["tags"]) if rules else tagset["tags"])
+        return rules, prompt
+    
     def _split_into_chunks(
         self,
         content: str,
@@ -106,6 +268,7 @@ class FileProcessor:
     ) -> List[Dict[str, Any]]:
         """Split content into overlapping chunks"""
         
+        index = get_document_index(content)
         chunks = []
         start = 0
         
@@ -116,16 +279,7 @@ class FileProcessor:
             if end < len(content):
                 # Look for sentence endings within the last 100 characters
                 search_start = max(end - 100, start)
-                sentence_endings = [
-                    content.rfind('. ', search_start, end),
-                    content.rfind('! ', search_start, end),
-                    content.rfind('? ', search_start, end),
-                    content.rfind('.\\n', search_start, end),
-                    content.rfind('!\\n', search_start, end),
-                    content.rfind('?\\n', search_start, end)
-                ]
-                
-                best_break = max([pos for pos in sentence_endings if pos > search_start], default=-1)
+                best_break = index.last_sentence_end(search_start + 1, end - 1)
                 if best_break > -1:
                     end = best_break + 2  # Include the punctuation and space
             
@@ -143,84 +297,162 @@ class FileProcessor:
         
         return chunks
     
-    def _merge_overlapping_annotations(
-        self,
-        annotations: List[Dict[str, Any]]
-    ) -> List[Dict[str, Any]]:
+    def _merge_overlapping_annotations(self, annotations: EntityTable) -> EntityTable:
         """Merge duplicate annotations from overlapping chunks"""
         
-        if not annotations:
-            return []
-        
-        # Sort annotations by start position
-        sorted_annotations = sorted(annotations, key=lambda x: (x["start"], x["end"]))
-        merged = []
-        
-        for current in sorted_annotations:
-            # Check if this annotation overlaps significantly with any existing merged annotation
-            is_duplicate = False
-            
-            for existing in merged:
-                # Calculate overlap
-                overlap_start = max(current["start"], existing["start"])
-                overlap_end = min(current["end"], existing["end"])
-                
-                if overlap_start < overlap_end:
-                    overlap_length = overlap_end - overlap_start
-                    current_length = current["end"] - current["start"]
-                    existing_length = existing["end"] - existing["start"]
-                    
-                    # If overlap is significant (>80% of either annotation), consider it duplicate
-                    overlap_ratio_current = overlap_length / current_length
-                    overlap_ratio_existing = overlap_length / existing_length
-                    
-                    if (overlap_ratio_current > 0.8 or overlap_ratio_existing > 0.8) and \
-                       current["tag"] == existing["tag"]:
-                        is_duplicate = True
-                        
-                        # Keep the annotation with higher confidence
-                        if current.get("confidence", 0) > existing.get("confidence", 0):
-                            merged.remove(existing)
-                            merged.append(current)
-                        break
-            
-            if not is_duplicate:
-                merged.append(current)
-        
-        return sorted(merged, key=lambda x: x["start"])
+        # Same label and >80% overlap of either annotation counts as a duplicate;
+        # the annotation with the higher confidence is kept
+        return annotations.remove_duplicates(min_overlap=0.8)
     
     async def process_batch_files(
         self,
         files: List[Dict[str, Any]],
         tagset: Dict[str, Any],
         model: str = "gpt-4",
-        user_id: str = ""
+        user_id: str = "",
+        chunk_size: int = 2000,
+        overlap: int = 200,
+        execution: str = "sync",
+        batch_adapter: Optional[BatchAdapter] = None,
+        cancellation: Optional[CancellationToken] = None
     ) -> Dict[str, Any]:
-        """Process multiple files in batch"""
+        """Process multiple files in batch.
         
-        batch_results = []
-        total_cost = 0.0
-        total_annotations = 0
+        execution "sync" annotates the files one after another. "batch" serializes
+        every chunk of every file into one provider batch job (identical chunks are
+        sent once), waits for it, and merges the results file by file exactly as the
+        synchronous path does; batch pricing is applied to the reported cost.
         
+        Files not reached when cancellation trips get the status "cancelled".
+        """
+        
+        if execution == "batch":
+            batch_results = await self._process_files_as_batch(
+                files, tagset, model, user_id, chunk_size, overlap, batch_adapter, cancellation
+            )
+        elif execution == "sync":
+            batch_results = []
+            for file_info in files:
+                if cancellation is not None and await cancellation.poll():
+                    batch_results.append({
+                        "file_id": file_info.get("id"),
+                        "filename": file_info.get("filename"),
+                        "status": "cancelled"
+                    })
+                    continue
+                try:
+                    result = await self.process_file(
+                        content=file_info["content"],
+                        tagset=tagset,
+                        model=model,
+                        user_id=user_id,
+                        chunk_size=chunk_size,
+                        overlap=overlap,
+                        cancellation=cancellation
+                    )
+                    batch_results.append({
+                        "file_id": file_info.get("id"),
+                        "filename": file_info.get("filename"),
+                        # A file cut short keeps the chunks it finished
+                        "status": "cancelled" if "cancelled" in result["file_annotations"] else "success",
+                        "result": result["file_annotations"]
+                    })
+                except Exception as e:
+                    batch_results.append({
+                        "file_id": file_info.get("id"),
+                        "filename": file_info.get("filename"),
+                        "status": "error",
+                        "error": str(e)
+                    })
+        else:
+            raise ValueError(f"Unsupported execution mode: {execution}")
+        
+        finished = [r["result"] for r in batch_results if "result" in r]
+        total_cost = sum(result["total_cost"] for result in finished)
+        total_annotations = sum(result["total_annotations"] for result in finished)
+        
+        return {
+            "batch_id": f"batch_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}",
+            "files_processed": len(files),
+            "total_cost": total_cost,
+            "total_annotations": total_annotations,
+            "execution": execution,
+            "results": batch_results,
+            **({"cancelled": cancellation.reason} if cancellation is not None and cancellation.cancelled else {}),
+            "created_at": datetime.utcnow().isoformat()
+        }
+    
+    async def _process_files_as_batch(
+        self,
+        files: List[Dict[str, Any]],
+        tagset: Dict[str, Any],
+        model: str,
+        user_id: str,
+        chunk_size: int,
+        overlap: int,
+        batch_adapter: Optional[BatchAdapter],
+        cancellation: Optional[CancellationToken] = None
+    ) -> List[Dict[str, Any]]:
+        """Annotate all chunks of all files through one provider batch job"""
+        
+        rules, prompt = self._compile_tagset(tagset)
+        adapter = batch_adapter or get_batch_adapter(model, self.llm_service)
+        near_duplicates = None
+        if user_id and settings.near_duplicate_reuse:
+            near_duplicates = get_near_duplicate_index(user_id, prompt.tag_set_hash, model, 0.1)
+        
+        # Near-duplicates of earlier work are resolved before anything is submitted
+        file_chunks = []
+        file_matches = []
+        requests = []
+        custom_ids: Dict[str, str] = {}
         for file_info in files:
+            chunks = self._split_into_chunks(file_info["content"], chunk_size, overlap)
+            matches = []
+            for chunk_info in chunks:
+                match = near_duplicates.reuse(chunk_info["text"]) if near_duplicates is not None else None
+                matches.append(match)
+                key = text_hash(chunk_info["text"])
+                if match is None and prompt.tags and key not in custom_ids:
+                    custom_ids[key] = f"chunk-{len(custom_ids)}"
+                    requests.append(adapter.build_request(
+                        custom_ids[key], prompt, chunk_info["text"], model,
+                        temperature=0.1, max_tokens=4000
+                    ))
+            file_chunks.append(chunks)
+            file_matches.append(matches)
+        
+        try:
+            results = await run_batch(adapter, requests, cancellation=cancellation) if requests else {}
+        except RequestCancelled:
+            return [
+                {"file_id": file_info.get("id"), "filename": file_info.get("filename"), "status": "cancelled"}
+                for file_info in files
+            ]
+        
+        def annotate_from(chunks: List[Dict[str, Any]]):
+            async def annotate(i: int, chunk_text: str) -> Dict[str, Any]:
+                custom_id = custom_ids[text_hash(chunks[i]["text"])]
+                if custom_id not in results:
+                    raise Exception(f"Batch returned no result for {custom_id}")
+                return parse_batch_result(results[custom_id])
+            return annotate
+        
+        batch_results = []
+        for file_info, chunks, matches in zip(files, file_chunks, file_matches):
             try:
-                result = await self.process_file(
-                    content=file_info["content"],
-                    tagset=tagset,
-                    model=model,
-                    user_id=user_id
+                file_annotations = await self._annotate_chunks(
+                    file_info["content"], chunks, prompt, model, user_id, tagset.get("id"),
+                    annotate_from(chunks), matches=matches,
+                    price_factor=settings.batch_price_factor, rules=rules
                 )
-                
+                file_annotations["execution"] = "batch"
                 batch_results.append({
                     "file_id": file_info.get("id"),
                     "filename": file_info.get("filename"),
                     "status": "success",
-                    "result": result["file_annotations"]
+                    "result": file_annotations
                 })
-                
-                total_cost += result["file_annotations"]["total_cost"]
-                total_annotations += result["file_annotations"]["total_annotations"]
-                
             except Exception as e:
                 batch_results.append({
                     "file_id": file_info.get("id"),
@@ -228,12 +460,4 @@ class FileProcessor:
                     "status": "error",
                     "error": str(e)
                 })
-        
-        return {
-            "batch_id": f"batch_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}",
-            "files_processed": len(files),
-            "total_cost": total_cost,
-            "total_annotations": total_annotations,
-            "results": batch_results,
-            "created_at": datetime.utcnow().isoformat()
-        }
+        return batch_results
@@ -0,0 +1,224 @@
+from typing import Dict, List, Any, Iterable, Optional, Tuple
+import re
+import threading
+import time
+
+from app.config import settings
+from app.services.caching import LRUCache
+from app.services.document_index import get_document_index
+from app.services.prompt_compiler import tag_set_hash
+from app.services.span_resolver import SpanResolver
+
+
+# Tokens that look like they could be entities: anything with a digit, or an
+# upper-case letter past the first character (acronyms, formulas, CamelCase)
+_CANDIDATE_PATTERN = re.compile(r"\b(?:\w*\d\w*|\w+[A-Z]\w*)\b")
+_CAPITALIZED_PATTERN = re.compile(r"\b[A-Z][a-z]+\b")
+
+
+class Gazetteer:
+    """Surface forms of accepted entities for one tag set, matched with one Aho-Corasick scan.
+
+    Each form keeps a vote count per label; accepted annotations add votes and
+    rejected ones remove them. New forms are added to the live automaton in place,
+    so learning from a validation does not rebuild the matcher from scratch.
+    """
+
+    def __init__(self):
+        self.votes: Dict[str, Dict[str, int]] = {}
+        self._matcher = SpanResolver([])
+        self._pending: set = set()
+        self._lock = threading.Lock()
+        self.loaded_until: Optional[str] = None
+        self.votes_loaded_until: Optional[str] = None
+        self.refreshed_at = 0.0
+
+    def __len__(self) -> int:
+        return len(self.votes)
+
+    def add(self, surface: str, label: str, weight: int = 1):
+        """Record an accepted (weight > 0) or rejected (weight < 0) surface form for a label"""
+        surface = (surface or "").strip()
+        if len(surface) < settings.gazetteer_min_length or not label:
+            return
+        with self._lock:
+            labels = self.votes.setdefault(surface, {})
+            labels[label] = labels.get(label, 0) + weight
+            if surface not in self._matcher.patterns:
+                self._pending.add(surface)
+
+    def add_entities(self, entities: Iterable[Dict[str, Any]], weight: int = 1):
+        for entity in entities:
+            self.add(entity.get("text", ""), entity.get("label", ""), weight)
+
+    def label_for(self, surface: str) -> Optional[Tuple[str, float]]:
+        """Majority label of a form and its share of the votes, if it has enough support"""
+        labels = self.votes.get(surface)
+        if not labels:
+            return None
+        label, count = max(labels.items(), key=lambda item: item[1])
+        if count < settings.gazetteer_min_support:
+            return None
+        total = sum(value for value in labels.values() if value > 0)
+        return label, count / total
+
+    def _compiled(self) -> SpanResolver:
+        with self._lock:
+            if self._pending:
+                self._matcher.add_patterns(self._pending)
+                self._pending.clear()
+            return self._matcher
+
+    def annotate(self, text: str) -> List[Dict[str, Any]]:
+        """Non-overlapping whole-word gazetteer matches, longest first at each position"""
+        if not self.votes:
+            return []
+        occurrences = self._compiled().find_all(text)
+        index = get_document_index(text)
+
+        candidates = []
+        for surface, positions in occurrences.items():
+            if not positions:
+                continue
+            labelled = self.label_for(surface)
+            if labelled is None:
+                continue
+            for position in positions:
+                if not index.splits_word(position, position + len(surface)):
+                    candidates.append((position, -len(surface), surface, labelled))
+
+        entities = []
+        covered_until = -1
+        for position, negative_length, surface, (label, share) in sorted(candidates):
+            if position < covered_until:
+                continue
+            entities.append({
+                "start_char": position,
+                "end_char": position - negative_length,
+                "text": surface,
+                "label": label,
+                "confidence": round(share * settings.gazetteer_confidence, 3),
+                "source": "gazetteer"
+            })
+            covered_until = position - negative_length
+        return entities
+
+
+def novel_terms(text: str, start: int, end: int, covered: List[Tuple[int, int]]) -> List[str]:
+    """Entity-looking tokens in text[start:end] that no covered span accounts for.
+
+    Covers digits, acronyms and mixed case, and capitalized words that do not start
+    a sentence. Lower-case terms are invisible to this check, which is why skipping
+    chunks is opt-in.
+    """
+    index = get_document_index(text)
+    spans = sorted(covered)
+
+    def is_covered(token_start: int, token_end: int) -> bool:
+        return any(s <= token_start and token_end <= e for s, e in spans)
+
+    terms = []
+    segment = text[start:end]
+    for match in _CANDIDATE_PATTERN.finditer(segment):
+        token_start, token_end = start + match.start(), start + match.end()
+        if not is_covered(token_start, token_end):
+            terms.append(match.group())
+    for match in _CAPITALIZED_PATTERN.finditer(segment):
+        token_start, token_end = start + match.start(), start + match.end()
+        sentence_start = index.last_sentence_end(start, token_start)
+        preceding = text[max(start, sentence_start + 1):token_start].strip()
+        if token_start == start or not preceding:
+            continue
+        if not is_covered(token_start, token_end):
+            terms.append(match.group())
+    return terms
+
+
+def _learnable(entities: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Entities a verdict can vote for; gazetteer matches would only vote for themselves"""
+    return [entity for entity in entities if entity.get("source") != "gazetteer"]
+
+
+class GazetteerStore:
+    """Per (user, tag set) gazetteers, loaded from validated annotations and manual votes and kept in memory"""
+
+    _gazetteers = LRUCache(maxsize=settings.gazetteer_cache_size)
+
+    def __init__(self, db: Any = None):
+        self.db = db
+
+    def get(self, user_id: str, tag_definitions: Any, refresh: bool = False) -> Gazetteer:
+        """Gazetteer for a user's tag set, first pulling validations newer than its last load"""
+        set_hash = tag_set_hash(tag_definitions)
+        gazetteer = self._gazetteers.get_or_create((user_id, set_hash), Gazetteer)
+        stale = time.monotonic() - gazetteer.refreshed_at > settings.gazetteer_refresh_seconds
+        if self.db is not None and (refresh or stale):
+            self._refresh(gazetteer, user_id, set_hash)
+        return gazetteer
+
+    def learn(self, user_id: str, tag_definitions: Any, entities: Iterable[Dict[str, Any]], accepted: bool = True):
+        """Record entities that are not stored as validations (manual annotations).
+
+        The votes are saved to the gazetteer_votes table, which every worker loads
+        on its next refresh; without a database they only live in this process.
+        """
+        set_hash = tag_set_hash(tag_definitions)
+        gazetteer = self._gazetteers.get_or_create((user_id, set_hash), Gazetteer)
+        entities = _learnable(entities)
+        weight = 1 if accepted else -1
+        if not entities:
+            return
+        if self.db is not None:
+            try:
+                self.db.table("gazetteer_votes").insert([{
+                    "user_id": user_id,
+                    "tag_set_hash": set_hash,
+                    "surface": entity.get("text", ""),
+                    "label": entity.get("label", ""),
+                    "weight": weight
+                } for entity in entities]).execute()
+                # Picked up with any other new votes on the next get
+                gazetteer.refreshed_at = 0.0
+                return
+            except Exception as e:
+                print(f"⚠️  Failed to save gazetteer votes: {e}")
+        gazetteer.add_entities(entities, weight)
+
+    def _refresh(self, gazetteer: Gazetteer, user_id: str, set_hash: str):
+        """Pull validations made since the last load and add their annotations' entities"""
+        try:
+            query = self.db.table("annotation_validations").select("annotation_id,is_valid,created_at") \
+                .eq("user_id", user_id)
+            if gazetteer.loaded_until:
+                query = query.gt("created_at", gazetteer.loaded_until)
+            validations = query.order("created_at").execute().data or []
+
+            if validations:
+                verdicts = {row["annotation_id"]: row["is_valid"] for row in validations}
+                annotations = self.db.table("annotations").select("id,entities,tag_definitions") \
+                    .in_("id", list(verdicts)).execute().data or []
+                for annotation in annotations:
+                    if tag_set_hash(annotation.get("tag_definitions") or []) != set_hash:
+                        continue
+                    gazetteer.add_entities(
+                        _learnable(annotation.get("entities") or []), 1 if verdicts[annotation["id"]] else -1
+                    )
+                gazetteer.loaded_until = validations[-1]["created_at"]
+                print(f"📚 Gazetteer updated from {len(validations)} validations: {len(gazetteer)} terms")
+        except Exception as e:
+            print(f"⚠️  Failed to refresh gazetteer: {e}")
+
+        try:
+            query = self.db.table("gazetteer_votes").select("surface,label,weight,created_at") \
+                .eq("user_id", user_id).eq("tag_set_hash", set_hash)
+            if gazetteer.votes_loaded_until:
+                query = query.gt("created_at", gazetteer.votes_loaded_until)
+            votes = query.order("created_at").execute().data or []
+            for vote in votes:
+                gazetteer.add(vote["surface"], vote["label"], vote["weight"])
+            if votes:
+                gazetteer.votes_loaded_until = votes[-1]["created_at"]
+                print(f"📚 Gazetteer updated from {len(votes)} manual votes: {len(gazetteer)} terms")
+        except Exception as e:
+            print(f"⚠️  Failed to load gazetteer votes: {e}")
+        gazetteer.refreshed_at = time.monotonic()
@@ -0,0 +1,234 @@
+from typing import Dict, List, Any, Callable, Optional, Tuple
+from bisect import bisect_right
+from difflib import SequenceMatcher
+from datetime import datetime
+
+from app.config import settings
+from app.services.caching import LRUCache, text_hash
+from app.services.document_index import get_document_index
+
+
+def _sentence_segments(text: str) -> List[str]:
+    """Text split after each sentence end, so that the pieces join back to the text"""
+    index = get_document_index(text)
+    segments = []
+    start = 0
+    for sentence_end in index.sentence_ends:
+        segments.append(text[start:sentence_end + 1])
+        start = sentence_end + 1
+    if start < len(text):
+        segments.append(text[start:])
+    return segments
+
+
+def _common_affixes(old_text: str, new_text: str) -> Tuple[int, int]:
+    """Lengths of the common prefix and (non-overlapping) common suffix"""
+    limit = min(len(old_text), len(new_text))
+    prefix = 0
+    while prefix < limit and old_text[prefix] == new_text[prefix]:
+        prefix += 1
+    suffix = 0
+    limit -= prefix
+    while suffix < limit and old_text[-1 - suffix] == new_text[-1 - suffix]:
+        suffix += 1
+    return prefix, suffix
+
+
+def diff_equal_regions(old_text: str, new_text: str) -> List[Tuple[int, int, int]]:
+    """Regions (old_start, new_start, length) where the two texts are identical.
+
+    The common head and tail are split off first; the rest is matched sentence by
+    sentence and each replaced stretch is trimmed by its common character prefix
+    and suffix, so that a typo only invalidates the characters around it.
+    """
+    head, tail = _common_affixes(old_text, new_text)
+    regions = [(0, 0, head)] if head else []
+    for old_start, new_start, length in _diff_middle(
+        old_text[head:len(old_text) - tail], new_text[head:len(new_text) - tail]
+    ):
+        regions.append((old_start + head, new_start + head, length))
+    if tail:
+        regions.append((len(old_text) - tail, len(new_text) - tail, tail))
+
+    # Adjacent regions with the same shift are merged so chunks spanning them stay intact
+    merged: List[Tuple[int, int, int]] = []
+    for old_start, new_start, length in regions:
+        if merged:
+            last_old, last_new, last_length = merged[-1]
+            if last_old + last_length == old_start and last_new + last_length == new_start:
+                merged[-1] = (last_old, last_new, last_length + length)
+                continue
+        merged.append((old_start, new_start, length))
+    return merged
+
+
+def _diff_middle(old_text: str, new_text: str) -> List[Tuple[int, int, int]]:
+    if not old_text or not new_text:
+        return []
+    old_segments = _sentence_segments(old_text)
+    new_segments = _sentence_segments(new_text)
+    old_offsets = [0]
+    for segment in old_segments:
+        old_offsets.append(old_offsets[-1] + len(segment))
+    new_offsets = [0]
+    for segment in new_segments:
+        new_offsets.append(new_offsets[-1] + len(segment))
+
+    matcher = SequenceMatcher(None, old_segments, new_segments, autojunk=False)
+    regions: List[Tuple[int, int, int]] = []
+    old_pos = new_pos = 0
+
+    for old_index, new_index, size in matcher.get_matching_blocks():
+        old_start = old_offsets[old_index]
+        new_start = new_offsets[new_index]
+
+        # Trim the changed stretch before this block by its common prefix and suffix
+        prefix, suffix = _common_affixes(old_text[old_pos:old_start], new_text[new_pos:new_start])
+
+        if prefix:
+            regions.append((old_pos, new_pos, prefix))
+        length = old_offsets[old_index + size] - old_start + suffix
+        if length:
+            regions.append((old_start - suffix, new_start - suffix, length))
+
+        old_pos = old_offsets[old_index + size]
+        new_pos = new_offsets[new_index + size]
+
+    return regions
+
+
+class IncrementalPlan:
+    """Which chunks of an edited document can be reused and which must be annotated again"""
+
+    def __init__(
+        self,
+        chunks: List[Dict[str, Any]],
+        carried_entities: List[Dict[str, Any]]
+    ):
+        self.chunks = chunks
+        self.carried_entities = carried_entities
+
+    @property
+    def reused_chunks(self) -> int:
+        return sum(1 for chunk in self.chunks if chunk.get("reused"))
+
+    @property
+    def fresh_chunks(self) -> int:
+        return len(self.chunks) - self.reused_chunks
+
+
+def plan_incremental_run(
+    previous_run: Dict[str, Any],
+    text: str,
+    chunker: Callable[[str], List[Dict[str, Any]]],
+    overlap: int = 0
+) -> IncrementalPlan:
+    """Reuse the previous run's chunks that survive the edit and re-chunk only what changed.
+
+    A previous chunk is reused when its whole span lies in a region the diff found
+    unchanged; its entities are moved to the new offsets. Every stretch of the new
+    text not covered by a reused chunk is chunked again, widened by `overlap`
+    characters on both sides so entities at the seams are still seen whole.
+    """
+    regions = diff_equal_regions(previous_run["text"], text)
+    region_starts = [old_start for old_start, _, _ in regions]
+
+    reused = []
+    for chunk in previous_run.get("chunks", []):
+        start, end = chunk["start_char"], chunk["end_char"]
+        i = bisect_right(region_starts, start) - 1
+        if i < 0:
+            continue
+        old_start, new_start, length = regions[i]
+        if end > old_start + length:
+            continue
+
+        shift = new_start - old_start
+        if text_hash(text[start + shift:end + shift]) != chunk["hash"]:
+            continue
+        reused.append({
+            "text": text[start + shift:end + shift],
+            "start_char": start + shift,
+            "end_char": end + shift,
+            "old_start_char": start,
+            "old_end_char": end,
+            "reused": True
+        })
+
+    # Entities are carried over when they sit wholly inside a reused chunk
+    carried = []
+    old_starts = [chunk["old_start_char"] for chunk in reused]
+    for entity in previous_run.get("entities", []):
+        start, end = entity.get("start_char", 0), entity.get("end_char", 0)
+        i = bisect_right(old_starts, start) - 1
+        for chunk in reused[max(0, i - 1):i + 1]:
+            if chunk["old_start_char"] <= start and end <= chunk["old_end_char"]:
+                shift = chunk["start_char"] - chunk["old_start_char"]
+                carried.append({**entity, "start_char": start + shift, "end_char": end + shift})
+                break
+
+    # Re-chunk the uncovered stretches
+    fresh = []
+    covered_until = 0
+    for chunk in reused + [{"start_char": len(text), "end_char": len(text)}]:
+        if chunk["start_char"] > covered_until:
+            gap_start = max(0, covered_until - overlap)
+            gap_end = min(len(text), chunk["start_char"] + overlap)
+            for sub_chunk in chunker(text[gap_start:gap_end]):
+                fresh.append({
+                    "text": sub_chunk["text"],
+                    "start_char": sub_chunk["start_char"] + gap_start,
+                    "end_char": sub_chunk["end_char"] + gap_start,
+                    **({"token_count": sub_chunk["token_count"]} if "token_count" in sub_chunk else {})
+                })
+        covered_until = max(covered_until, chunk["end_char"])
+
+    chunks = sorted(reused + fresh, key=lambda chunk: (chunk["start_char"], chunk["end_char"]))
+    for chunk_id, chunk in enumerate(chunks):
+        chunk["chunk_id"] = chunk_id
+        chunk.pop("old_start_char", None)
+        chunk.pop("old_end_char", None)
+
+    return IncrementalPlan(chunks, carried)
+
+
+class DocumentRunStore:
+    """Last annotation run per (user, document): in-process LRU in front of the document_runs table"""
+
+    _memory = LRUCache(maxsize=settings.document_run_cache_size)
+
+    def __init__(self, db: Any = None):
+        self.db = db
+
+    def get(self, user_id: str, document_id: str) -> Optional[Dict[str, Any]]:
+        key = (user_id, document_id)
+        run = self._memory.get(key)
+        if run is not None or self.db is None:
+            return run
+
+        try:
+            result = self.db.table("document_runs").select("*") \
+                .eq("user_id", user_id).eq("document_id", document_id).limit(1).execute()
+            if result.data:
+                run = result.data[0]["run"]
+                self._memory.set(key, run)
+        except Exception as e:
+            print(f"⚠️  Failed to load previous run for document {document_id}: {e}")
+        return run
+
+    def save(self, user_id: str, document_id: str, run: Dict[str, Any]):
+        self._memory.set((user_id, document_id), run)
+        if self.db is None:
+            return
+
+        try:
+            self.db.table("document_runs").upsert({
+                "user_id": user_id,
+                "document_id": document_id,
+                "text_hash": run["text_hash"],
+                "tag_set_hash": run["tag_set_hash"],
+                "run": run,
+                "updated_at": datetime.utcnow().isoformat()
+            }, on_conflict="user_id,document_id").execute()
+        except Exception as e:
+            print(f"⚠️  Failed to save run for document {document_id}: {e}")
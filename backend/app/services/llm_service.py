@@ -5,9 +5,44 @@ import json
 import re
 from datetime import datetime
 import asyncio
-import pandas as pd
+import time
+import numpy as np
+from bisect import bisect_left
 
-from app.config import settings
+from app.config import LLM_MODELS, settings
+from app.services.caching import text_hash
+from app.services.auto_tuner import ChunkTuner, run_profile
+from app.services.cascade import chunk_quality_flags, cheap_model_for, density_outliers, error_flag
+from app.services.cancellation import CancellationToken, RequestCancelled
+from app.services.cost_calculator import CostCalculator
+from app.services.columnar_validation import (
+    EntityColumns,
+    find_invalid_bounds,
+    find_text_mismatches,
+    find_adjacent_overlaps
+)
+from app.services.document_index import DocumentIndex, get_document_index
+from app.services.entity_table import EntityTable
+from app.services.evaluation import (
+    VerdictStore,
+    group_annotations,
+    parse_verdicts,
+    plan_batches,
+    summarize_batches,
+    unresolved_result
+)
+from app.services.gazetteer import Gazetteer, novel_terms
+from app.services.chunk_filter import ChunkFilter
+from app.services.student_tagger import StudentTagger
+from app.services.incremental import plan_incremental_run
+from app.services.long_context import PaginatedPrompt, context_window, page_tokens, paginate, window_token_budget
+from app.services.near_duplicates import NearDuplicateIndex, chunk_relative_entities
+from app.services.prompt_compiler import CompiledPrompt, compile_prompt, user_prompt
+from app.services.request_limiter import get_request_limiter
+from app.services.rule_extractors import compile_rules
+from app.services.span_resolver import SpanResolver, align_chunk_entities
+from app.services.tag_sharding import ShardedPrompt, compile_sharded_prompt, resolve_shard_conflicts
+from app.services.tokenizers import Tokenizer, get_tokenizer
 
 
 class LLMService:
@@ -79,7 +114,7 @@ class LLMService:
         available_models = []
         
         if self.has_openai_client():
-            for model in settings.LLM_MODELS["openai"]["models"]:
+            for model in LLM_MODELS["openai"]["models"]:
                 available_models.append({
                     **model,
                     "provider": "openai",
@@ -87,7 +122,7 @@ class LLMService:
                 })
         
         if self.has_anthropic_client():
-            for model in settings.LLM_MODELS["anthropic"]["models"]:
+            for model in LLM_MODELS["anthropic"]["models"]:
                 available_models.append({
                     **model,
                     "provider": "anthropic", 
@@ -96,21 +131,42 @@ class LLMService:
         
         return available_models
     
-    def get_token_recommendations(self, chunk_size: int) -> Dict[str, int]:
-        """Get token recommendations based on chunk size"""
-        input_tokens = chunk_size // 4  # Rough estimation: 1 token ≈ 4 characters
+    def get_token_recommendations(
+        self,
+        chunk_size: int,
+        model: Optional[str] = None,
+        tuner: Optional[ChunkTuner] = None
+    ) -> Dict[str, Any]:
+        """Get token recommendations based on chunk size.
+        
+        With a tuner that has enough history for the model, default_tokens is the
+        learned budget for this chunk size and "tuned" carries the recommended
+        chunk size, overlap and max_tokens; otherwise fixed ratios are used.
+        """
+        # Characters per token as observed (or calibrated) for the model, 4 when unknown
+        chars_per_token = get_tokenizer(model).chars_per_token if model else 4.0
+        input_tokens = int(chunk_size / chars_per_token)
         
         # Calculate recommended output tokens (1.5-2x input tokens for annotation tasks)
         min_tokens = max(100, input_tokens // 2)
         max_tokens_limit = min(4000, input_tokens * 3)
         default_tokens = min(2000, input_tokens * 2)
         
-        return {
+        recommendations = {
             "min_tokens": min_tokens,
             "max_tokens_limit": max_tokens_limit,
             "default_tokens": default_tokens,
             "input_tokens_estimate": input_tokens
         }
+        if model and tuner is not None and tuner.ready:
+            learned = tuner.max_tokens_for(chunk_size)
+            recommendations.update(
+                min_tokens=min(min_tokens, learned),
+                max_tokens_limit=max(max_tokens_limit, learned),
+                default_tokens=learned,
+                tuned=tuner.recommend(model)
+            )
+        return recommendations
     
     def chunk_text(self, text: str, chunk_size: int = 1000, overlap: int = 50) -> List[Dict[str, Any]]:
         """Split text into overlapping chunks for processing"""
@@ -125,10 +181,13 @@ class LLMService:
             print(f"⚠️  Overlap ({overlap}) >= chunk_size ({chunk_size}), reducing overlap to {chunk_size // 2}")
             overlap = chunk_size // 2
         
+        index = get_document_index(text)
         chunks = []
         start = 0
         chunk_id = 0
-        max_chunks = (len(text) // (chunk_size - overlap)) + 2  # Safety limit
+        # Safety limit: sentence breaks shrink chunks, so bound by text length rather than
+        # by len(text) / (chunk_size - overlap), which silently dropped the tail of the text
+        max_chunks = len(text) + 1
         
         print(f"📊 Expected max chunks: {max_chunks}")
         
@@ -139,11 +198,7 @@ class LLMService:
             if end < len(text):
                 # Look for sentence endings within the last 200 characters
                 search_start = max(start, end - 200)
-                last_period = text.rfind('.', search_start, end)
-                last_exclamation = text.rfind('!', search_start, end)
-                last_question = text.rfind('?', search_start, end)
-                
-                best_break = max(last_period, last_exclamation, last_question)
+                best_break = index.last_terminator(search_start + 1, end)
                 
                 if best_break > search_start:
                     end = best_break + 1
@@ -174,6 +229,152 @@ class LLMService:
         print(f"✅ Created {len(chunks)} chunks")
         return chunks
     
+    def chunk_text_by_tokens(
+        self,
+        text: str,
+        token_budget: int,
+        tokenizer: Tokenizer,
+        prompt_tokens: int = 0,
+        overlap: int = 0
+    ) -> List[Dict[str, Any]]:
+        """Split text into sentence-aligned chunks whose prompt fits within token_budget tokens"""
+        text_budget = token_budget - prompt_tokens
+        if text_budget <= 0:
+            raise ValueError(
+                f"Token budget ({token_budget}) does not cover the prompt itself ({prompt_tokens} tokens)"
+            )
+        
+        print(f"🔍 Chunking text by tokens: {len(text)} chars, budget={token_budget} ({prompt_tokens} prompt), tokenizer={tokenizer.name}")
+        
+        total_tokens = tokenizer.count(text)
+        if total_tokens <= text_budget:
+            print(f"✅ Text fits in single chunk")
+            return [{"text": text, "start_char": 0, "end_char": len(text), "chunk_id": 0, "token_count": total_tokens}]
+        
+        # Sentence segments, with sentences that alone exceed the budget split at word ends
+        index = get_document_index(text)
+        boundaries = [0]
+        for sentence_end in list(index.sentence_ends) + [len(text) - 1]:
+            segment_end = sentence_end + 1
+            if segment_end <= boundaries[-1]:
+                continue
+            segment_start = boundaries[-1]
+            if tokenizer.count(text[segment_start:segment_end]) > text_budget:
+                boundaries.extend(self._split_long_segment(text, index, segment_start, segment_end, text_budget, tokenizer))
+            boundaries.append(segment_end)
+        segment_tokens = [tokenizer.count(text[a:b]) for a, b in zip(boundaries, boundaries[1:])]
+        
+        chunks = []
+        first = 0
+        while first < len(segment_tokens):
+            last = first
+            used = 0
+            while last < len(segment_tokens) and used + segment_tokens[last] <= text_budget:
+                used += segment_tokens[last]
+                last += 1
+            last = max(last, first + 1)
+            
+            # Segment counts are additive only approximately, so confirm on the joined text
+            token_count = tokenizer.count(text[boundaries[first]:boundaries[last]])
+            while token_count > text_budget and last > first + 1:
+                last -= 1
+                token_count = tokenizer.count(text[boundaries[first]:boundaries[last]])
+            
+            if token_count > text_budget:
+                # A single segment still overflows: cut it at the longest prefix that fits
+                cut = self._longest_fitting_prefix(text, index, boundaries[first], boundaries[last], text_budget, tokenizer)
+                if cut > boundaries[first]:
+                    boundaries.insert(last, cut)
+                    segment_tokens[first:last] = [
+                        tokenizer.count(text[boundaries[first]:cut]),
+                        tokenizer.count(text[cut:boundaries[last + 1]])
+                    ]
+                    continue
+            
+            start, end = boundaries[first], boundaries[last]
+            chunks.append({
+                "text": text[start:end],
+                "start_char": start,
+                "end_char": end,
+                "chunk_id": len(chunks),
+                "token_count": token_count
+            })
+            print(f"📄 Chunk {len(chunks) - 1}: chars {start}-{end} ({token_count} tokens)")
+            
+            if last >= len(segment_tokens):
+                break
+            
+            # Step back over whole segments to cover roughly `overlap` characters
+            next_first = last
+            while next_first - 1 > first and end - boundaries[next_first - 1] <= overlap:
+                next_first -= 1
+            first = next_first
+        
+        print(f"✅ Created {len(chunks)} token-budgeted chunks")
+        return chunks
+    
+    def _longest_fitting_prefix(
+        self,
+        text: str,
+        index: Any,
+        start: int,
+        end: int,
+        text_budget: int,
+        tokenizer: Tokenizer
+    ) -> int:
+        """Largest cut in (start, end) with text[start:cut] within budget, preferring word ends"""
+        first_token, last_token = index.token_range(start, end)
+        candidates = [
+            index.token_ends[token] for token in range(first_token, last_token)
+            if start < index.token_ends[token] < end
+        ]
+        if not candidates or tokenizer.count(text[start:candidates[0]]) > text_budget:
+            # No word end fits, fall back to character positions
+            candidates = range(start + 1, end)
+        
+        lo, hi, best = 0, len(candidates) - 1, start
+        while lo <= hi:
+            mid = (lo + hi) // 2
+            if tokenizer.count(text[start:candidates[mid]]) <= text_budget:
+                best = candidates[mid]
+                lo = mid + 1
+            else:
+                hi = mid - 1
+        return best
+    
+    def _split_long_segment(
+        self,
+        text: str,
+        index: Any,
+        start: int,
+        end: int,
+        text_budget: int,
+        tokenizer: Tokenizer
+    ) -> List[int]:
+        """Cut points inside [start, end) so that each piece stays within text_budget tokens"""
+        cuts = []
+        piece_start = start
+        used = 0
+        first_token, last_token = index.token_range(start, end)
+        for token in range(first_token, last_token):
+            token_end = min(index.token_ends[token], end)
+            token_tokens = tokenizer.count(text[max(piece_start, index.token_starts[token] - 1):token_end])
+            if used and used + token_tokens > text_budget:
+                cuts.append(index.token_starts[token])
+                piece_start = index.token_starts[token]
+                used = 0
+            used += token_tokens
+            
+            # A single run of text longer than the budget is cut by characters
+            while used > text_budget:
+                cut = piece_start + max(1, int(text_budget * tokenizer.chars_per_token))
+                if cut >= token_end:
+                    break
+                cuts.append(cut)
+                piece_start = cut
+                used = tokenizer.count(text[piece_start:token_end])
+        return cuts
+    
     async def run_annotation_pipeline(
         self,
         text: str,
@@ -182,96 +383,891 @@ class LLMService:
         temperature: float = 0.1,
         max_tokens: int = 1000,
         chunk_size: int = 1000,
-        overlap: int = 50
+        overlap: int = 50,
+        chunk_mode: str = "characters",
+        chunk_tokens: Optional[int] = None,
+        boundary_mode: str = "overlap",
+        previous_run: Optional[Dict[str, Any]] = None,
+        near_duplicates: Optional[NearDuplicateIndex] = None,
+        cascade: bool = False,
+        cascade_model: Optional[str] = None,
+        gazetteer: Optional[Gazetteer] = None,
+        gazetteer_mode: Optional[str] = None,
+        student: Optional[StudentTagger] = None,
+        student_min_confidence: Optional[float] = None,
+        chunk_filter_mode: Optional[str] = None,
+        tag_shard_size: Optional[int] = None,
+        cancellation: Optional[CancellationToken] = None
     ) -> Dict[str, Any]:
-        """Run the complete annotation pipeline with chunking"""
+        """Run the complete annotation pipeline with chunking.
+        
+        chunk_mode "characters" cuts chunks of chunk_size characters; "tokens" cuts
+        sentence-aligned chunks whose whole prompt (system prompt included) fits in
+        chunk_tokens tokens as counted by the model's tokenizer. "long_context" sends
+        the whole document, or as few windows as the model's context allows, and
+        collects each window's entities page by page through continuation calls.
+        
+        boundary_mode "overlap" repeats `overlap` characters between chunks; "stitch"
+        cuts chunks without overlap and re-queries a small window around only those
+        boundaries that an entity touches or that split a word.
+        
+        previous_run is the "document_run" returned by an earlier call for the same
+        document. When it was made with the same settings (tag set, model, temperature,
+        chunking, cascade, tag sharding, gazetteer, student and chunk filter), only
+        chunks whose content changed are sent to the LLM and the other entities are
+        carried over at their new offsets.
+        
+        near_duplicates is the index of chunks already annotated for this user and
+        tag set. A chunk that nearly duplicates one of them reuses its entities,
+        re-aligned to the new text, instead of being sent to the LLM.
+        
+        cascade runs every chunk on a cheap model (cascade_model, or the provider's
+        default cheap model) first and re-annotates with `model` only the chunks
+        whose result looks unreliable: failed or unparsable responses, truncated
+        output, a high offset repair rate, low self-reported confidence or an entity
+        density far from the document's median.
+        
+        gazetteer holds surface forms users accepted for this tag set. In "merge"
+        mode its matches are added to the LLM output; in "skip" mode chunks with no
+        entity-looking term outside those matches are not sent to the LLM, and chunks
+        with only a few such terms get a proportionally smaller output budget.
+        
+        student is a local tagger trained on earlier annotations of the tag set. It
+        tags every chunk first; chunks where its lowest token confidence reaches
+        student_min_confidence keep its entities and skip the LLM.
         
-        # Convert tag definitions to DataFrame format for prompt building
-        tag_df = pd.DataFrame(tag_definitions)
+        chunk_filter_mode (default settings.chunk_filter_mode) triages chunks on the
+        CPU before they are dispatched: "skip" leaves out reference lists, affiliation
+        blocks, LaTeX residue and numeric tables and gives borderline chunks a smaller
+        output budget; "reduce" only shrinks budgets; "off" sends every chunk.
+        
+        tag_shard_size (default settings.tag_shard_size, 0 for never) splits a tag
+        set with more tags than that into groups of related tags; every chunk is then
+        annotated with each group's smaller prompt concurrently and overlaps between
+        groups are settled by confidence and span length.
+        
+        cancellation carries the request's deadline and client-disconnect probe. Once
+        it trips, the chunk call in flight is abandoned, no further chunk, escalation
+        or stitching call is made, and the entities found so far are returned with
+        statistics["cancelled"]. Only finished chunks go into the near-duplicate index
+        and the document_run, so a retry picks up where this run stopped.
+        """
+        
+        if boundary_mode not in ("overlap", "stitch"):
+            raise ValueError(f"Unsupported boundary mode: {boundary_mode}")
+        if boundary_mode == "stitch":
+            overlap = 0
+        
+        gazetteer_mode = gazetteer_mode or settings.gazetteer_mode
+        if gazetteer_mode not in ("off", "merge", "skip"):
+            raise ValueError(f"Unsupported gazetteer mode: {gazetteer_mode}")
+        if gazetteer is None:
+            gazetteer_mode = "off"
+        
+        if student_min_confidence is None:
+            student_min_confidence = settings.student_min_confidence
+        
+        chunk_filter = ChunkFilter(tag_definitions, chunk_filter_mode)
+        
+        if cascade:
+            cascade_model = cascade_model or cheap_model_for(model)
+            if cascade_model == model:
+                cascade_model = None
+        else:
+            cascade_model = None
+        first_model = cascade_model or model
+        
+        # Tags with regex extractors are found in one pass over the whole text;
+        # rule-only tags are left out of the prompt entirely
+        rules = compile_rules(tag_definitions)
+        
+        # The tag set is compiled once; every chunk reuses the same prompt object
+        llm_tag_definitions = rules.llm_tag_definitions(tag_definitions) if rules else tag_definitions
+        if tag_shard_size is None:
+            tag_shard_size = settings.tag_shard_size
+        prompt = compile_sharded_prompt(llm_tag_definitions, tag_shard_size)
+        sharded = isinstance(prompt, ShardedPrompt)
+        if chunk_mode == "long_context":
+            # Every call returns one page of entities; max_tokens becomes the page budget
+            prompt = paginate(prompt)
+            max_tokens = page_tokens(model, max_tokens)
+        
+        # Prompt tokens are counted for every chunk so cost and max_tokens choices are accurate
+        tokenizer = get_tokenizer(model)
+        count_prompt = lambda compiled: (
+            tokenizer.count(compiled.system_prompt) +
+            tokenizer.count(compiled.user_prompt("")) +
+            settings.prompt_message_overhead_tokens
+        )
+        # A sharded chunk must fit next to its largest shard prompt
+        shard_prompt_tokens = [count_prompt(shard) for shard in prompt.shards] if sharded else []
+        prompt_tokens = max(shard_prompt_tokens) if sharded else count_prompt(prompt)
+        # Calibration needs the uncalibrated count, which stays the same while the scale moves
+        raw_prompt_tokens = None
+        if not sharded and not tokenizer.is_exact:
+            raw_prompt_tokens = tokenizer.raw_count(prompt.system_prompt) + tokenizer.raw_count(prompt.user_prompt(""))
         
         # Chunk the text
-        chunks = self.chunk_text(text, chunk_size, overlap)
+        if chunk_mode == "tokens":
+            chunker = lambda part: self.chunk_text_by_tokens(
+                part,
+                chunk_tokens or settings.default_chunk_tokens,
+                tokenizer,
+                prompt_tokens=prompt_tokens,
+                overlap=overlap
+            )
+        elif chunk_mode == "characters":
+            chunker = lambda part: self.chunk_text(part, chunk_size, overlap)
+        elif chunk_mode == "long_context":
+            # Windows as large as the model's context allows, leaving room for a page of output
+            window_tokens = window_token_budget(model, max_tokens)
+            chunker = lambda part: self.chunk_text_by_tokens(
+                part,
+                window_tokens,
+                tokenizer,
+                prompt_tokens=prompt_tokens,
+                overlap=overlap
+            )
+        else:
+            raise ValueError(f"Unsupported chunk mode: {chunk_mode}")
+        
+        all_entities = EntityTable(text)
+        # Everything that changes which entities a chunk gets; a previous run is only
+        # reused when all of it matches
+        run_params = {
+            "tag_set_hash": prompt.tag_set_hash,
+            "model": model,
+            "temperature": temperature,
+            "chunk_mode": chunk_mode,
+            "chunk_size": chunk_size,
+            "chunk_tokens": chunk_tokens,
+            "overlap": overlap,
+            "boundary_mode": boundary_mode,
+            "cascade_model": cascade_model,
+            "tag_shard_size": tag_shard_size,
+            "gazetteer_mode": gazetteer_mode,
+            "student_min_confidence": student_min_confidence if student is not None else None,
+            "chunk_filter_mode": chunk_filter.mode
+        }
+        incremental_stats = None
+        if previous_run and all(previous_run.get(key) == value for key, value in run_params.items()):
+            plan = plan_incremental_run(previous_run, text, chunker, overlap)
+            chunks = plan.chunks
+            # Rule and gazetteer matches are recomputed below, so only LLM entities are carried
+            all_entities.extend(
+                (entity for entity in plan.carried_entities if entity.get("source") not in ("rule", "gazetteer")),
+                chunk_id=-1
+            )
+            incremental_stats = {
+                "chunks_reused": plan.reused_chunks,
+                "chunks_annotated": plan.fresh_chunks,
+                "entities_carried": len(plan.carried_entities)
+            }
+            print(f"♻️  Incremental run: reusing {plan.reused_chunks} chunks, annotating {plan.fresh_chunks}")
+        else:
+            if previous_run:
+                print(f"🔄 Previous run used different settings, annotating from scratch")
+            chunks = chunker(text)
+        
+        if not prompt.tags:
+            # Every tag is rule-only: nothing is left for the LLM
+            chunks = []
         
-        all_entities = []
         total_input_tokens = 0
         total_output_tokens = 0
         chunk_results = []
         failed_chunks = 0
+        dispatched_chunks = 0
+        near_duplicate_hits = 0
+        near_duplicate_tokens_saved = 0
+        annotated: Dict[int, Tuple[Dict[str, Any], List[Dict[str, Any]], Dict[str, Any]]] = {}
+        result_rows: Dict[int, int] = {}
+        escalations: Dict[int, List[str]] = {}
+        densities: Dict[int, float] = {}
+        
+        # Looked up once: every chunk aligns its entities against it
+        document_index = get_document_index(text)
+        
+        # One scan of the whole document finds every known surface form
+        gazetteer_entities = gazetteer.annotate(text) if gazetteer_mode != "off" else []
+        gazetteer_starts = [entity["start_char"] for entity in gazetteer_entities]
+        gazetteer_stats = {"terms": len(gazetteer), "entities": len(gazetteer_entities),
+                           "chunks_skipped": 0, "chunks_reduced_budget": 0} if gazetteer_mode != "off" else None
+        filter_stats = {"mode": chunk_filter.mode, "chunks_skipped": 0, "chunks_reduced": 0,
+                        "reasons": {}} if chunk_filter.mode != "off" else None
+        student_stats = {"chunks_checked": 0, "chunks_local": 0, "entities": 0,
+                         "min_confidence": student_min_confidence, "model": student.metrics} if student else None
+        # Chunks never sent because the request was cancelled, and whether a call was cut off mid-flight
+        unfinished: List[Dict[str, Any]] = []
+        abandoned_calls = 0
         
-        for chunk in chunks:
+        for position, chunk in enumerate(chunks):
+            if chunk.get("reused"):
+                chunk_results.append({
+                    "chunk_id": chunk["chunk_id"],
+                    "reused": True,
+                    "entities_found": 0,
+                    "input_tokens": 0,
+                    "output_tokens": 0
+                })
+                continue
+            
+            if near_duplicates is not None:
+                match = near_duplicates.reuse(chunk["text"])
+                if match is not None:
+                    all_entities.extend((
+                        {
+                            **entity,
+                            "start_char": entity["start_char"] + chunk["start_char"],
+                            "end_char": entity["end_char"] + chunk["start_char"]
+                        }
+                        for entity in match["entities"]
+                    ), chunk_id=chunk["chunk_id"])
+                    near_duplicate_hits += 1
+                    near_duplicate_tokens_saved += match["tokens_saved"]
+                    chunk_results.append({
+                        "chunk_id": chunk["chunk_id"],
+                        "near_duplicate": True,
+                        "similarity": match["similarity"],
+                        "entities_found": len(match["entities"]),
+                        "input_tokens": 0,
+                        "output_tokens": 0,
+                        "tokens_saved": match["tokens_saved"]
+                    })
+                    continue
+            
+            first = bisect_left(gazetteer_starts, chunk["start_char"])
+            known = [
+                (entity["start_char"], entity["end_char"])
+                for entity in gazetteer_entities[first:bisect_left(gazetteer_starts, chunk["end_char"])]
+                if entity["end_char"] <= chunk["end_char"]
+            ]
+            
+            chunk_max_tokens = max_tokens
+            verdict = chunk_filter.classify(chunk["text"], known_entities=len(known))
+            if verdict["action"] != "keep":
+                for reason in verdict["reasons"]:
+                    filter_stats["reasons"][reason] = filter_stats["reasons"].get(reason, 0) + 1
+            if verdict["action"] == "skip":
+                filter_stats["chunks_skipped"] += 1
+                chunk_results.append({
+                    "chunk_id": chunk["chunk_id"],
+                    "skipped": True,
+                    "skip_reasons": verdict["reasons"],
+                    "features": verdict["features"],
+                    "entities_found": 0,
+                    "input_tokens": 0,
+                    "output_tokens": 0
+                })
+                continue
+            if verdict["action"] == "reduce":
+                filter_stats["chunks_reduced"] += 1
+                chunk_max_tokens = chunk_filter.reduced_budget(max_tokens)
+            
+            if gazetteer_mode == "skip":
+                novel = novel_terms(text, chunk["start_char"], chunk["end_char"], known)
+                if not novel:
+                    gazetteer_stats["chunks_skipped"] += 1
+                    chunk_results.append({
+                        "chunk_id": chunk["chunk_id"],
+                        "gazetteer_covered": True,
+                        "entities_found": len(known),
+                        "input_tokens": 0,
+                        "output_tokens": 0
+                    })
+                    continue
+                if len(novel) <= settings.gazetteer_max_novel_terms:
+                    chunk_max_tokens = min(chunk_max_tokens, max(
+                        settings.gazetteer_min_output_tokens,
+                        settings.gazetteer_tokens_per_entity * (len(known) + len(novel))
+                    ))
+                    gazetteer_stats["chunks_reduced_budget"] += 1
+            
+            if student is not None:
+                student_entities, confidence = student.predict(text, chunk["start_char"], chunk["end_char"])
+                student_stats["chunks_checked"] += 1
+                if confidence >= student_min_confidence:
+                    all_entities.extend(student_entities, chunk_id=chunk["chunk_id"])
+                    student_stats["chunks_local"] += 1
+                    student_stats["entities"] += len(student_entities)
+                    chunk_results.append({
+                        "chunk_id": chunk["chunk_id"],
+                        "student": True,
+                        "confidence": round(confidence, 3),
+                        "entities_found": len(student_entities),
+                        "input_tokens": 0,
+                        "output_tokens": 0
+                    })
+                    continue
+            
+            chunk_token_count = chunk.get("token_count")
+            if chunk_token_count is None:
+                chunk_token_count = tokenizer.count(chunk["text"])
+            
+            if cancellation is not None and await cancellation.poll():
+                unfinished = chunks[position:]
+                break
+            
+            dispatched_chunks += 1
             try:
-                # Annotate chunk
-                result = await self.annotate_text(
-                    chunk["text"],
-                    tag_df,
-                    model=model,
-                    temperature=temperature,
-                    max_tokens=max_tokens
+                call = self._annotate_chunk(
+                    text, chunk, prompt, first_model, temperature, chunk_max_tokens, document_index
                 )
-                
-                # Adjust entity positions to global text positions
-                chunk_entities = result.get("annotations", [])
-                for entity in chunk_entities:
-                    if "start_char" in entity and "end_char" in entity:
-                        entity["start_char"] += chunk["start_char"]
-                        entity["end_char"] += chunk["start_char"]
-                        entity["chunk_id"] = chunk["chunk_id"]
-                        all_entities.append(entity)
+                result, aligned_entities, alignment_stats = \
+                    await (cancellation.guard(call) if cancellation is not None else call)
+                all_entities.extend(aligned_entities, chunk_id=chunk["chunk_id"])
+                annotated[chunk["chunk_id"]] = (chunk, aligned_entities, result)
                 
                 total_input_tokens += result.get("input_tokens", 0)
                 total_output_tokens += result.get("output_tokens", 0)
                 
-                chunk_results.append({
+                # Reported usage calibrates the estimator for the next chunks and requests
+                chunk_prompt_tokens = prompt_tokens + chunk_token_count
+                if first_model == model and raw_prompt_tokens is not None:
+                    raw_tokens = raw_prompt_tokens + tokenizer.raw_count(chunk["text"])
+                    chunk_prompt_tokens = tokenizer.count_raw(raw_tokens) + settings.prompt_message_overhead_tokens
+                    # A paginated result sums the input of every page, not one prompt
+                    if "pages" not in result:
+                        tokenizer.observe(
+                            raw_tokens, result.get("input_tokens", 0) - settings.prompt_message_overhead_tokens
+                        )
+                
+                chunk_result = {
                     "chunk_id": chunk["chunk_id"],
-                    "entities_found": len(chunk_entities),
+                    "model": first_model,
+                    "entities_found": len(result.get("annotations", [])),
                     "input_tokens": result.get("input_tokens", 0),
-                    "output_tokens": result.get("output_tokens", 0)
-                })
+                    "output_tokens": result.get("output_tokens", 0),
+                    "chunk_tokens": chunk_token_count,
+                    "prompt_tokens": chunk_prompt_tokens,
+                    "tokenizer": tokenizer.name,
+                    "alignment": alignment_stats,
+                    "truncated": result.get("truncated", result.get("output_tokens", 0) >= chunk_max_tokens)
+                }
+                if sharded:
+                    chunk_result["conflicts_resolved"] = result.get("conflicts_resolved", 0)
+                if "pages" in result:
+                    chunk_result["pages"] = result["pages"]
+                    chunk_result["complete"] = result["complete"]
+                if chunk_max_tokens != max_tokens:
+                    chunk_result["max_tokens"] = chunk_max_tokens
+                    if verdict["action"] == "reduce":
+                        chunk_result["budget_reasons"] = verdict["reasons"]
+                if cascade_model:
+                    reasons = chunk_quality_flags(result, alignment_stats, chunk_max_tokens)
+                    if reasons:
+                        escalations[chunk["chunk_id"]] = reasons
+                    densities[chunk["chunk_id"]] = 1000 * len(aligned_entities) / max(1, len(chunk["text"]))
+                result_rows[chunk["chunk_id"]] = len(chunk_results)
+                chunk_results.append(chunk_result)
+                
+            except RequestCancelled:
+                dispatched_chunks -= 1
+                abandoned_calls += 1
+                unfinished = chunks[position:]
+                break
                 
             except Exception as e:
-                failed_chunks += 1
                 error_msg = str(e)
                 
                 # Check for critical errors that should fail the entire pipeline
-                if any(critical in error_msg.lower() for critical in [
-                    "api key", "authentication", "unauthorized", "invalid_api_key",
-                    "permission denied", "billing", "quota exceeded"
-                ]):
+                if self._is_critical_error(error_msg):
                     print(f"💥 Critical error in chunk {chunk['chunk_id']}: {error_msg}")
                     raise Exception(f"Annotation failed due to API authentication/authorization issue: {error_msg}")
                 
+                result_rows[chunk["chunk_id"]] = len(chunk_results)
                 chunk_results.append({
                     "chunk_id": chunk["chunk_id"],
+                    "model": first_model,
                     "error": error_msg,
                     "entities_found": 0,
                     "input_tokens": 0,
-                    "output_tokens": 0
+                    "output_tokens": 0,
+                    "chunk_tokens": chunk_token_count
                 })
                 
+                # A failed cheap pass is retried on the strong model rather than counted as failed
+                if cascade_model:
+                    escalations[chunk["chunk_id"]] = [error_flag(e)]
+                    continue
+                
+                failed_chunks += 1
                 print(f"⚠️  Chunk {chunk['chunk_id']} failed: {error_msg}")
         
+        for chunk in unfinished:
+            chunk_results.append({
+                "chunk_id": chunk["chunk_id"],
+                "cancelled": True,
+                "entities_found": 0,
+                "input_tokens": 0,
+                "output_tokens": 0
+            })
+        if unfinished:
+            print(f"🛑 Request cancelled ({cancellation.reason}) with {len(unfinished)}/{len(chunks)} chunks left")
+        
+        cascade_stats = None
+        if cascade_model:
+            for chunk_id in density_outliers(densities, settings.cascade_density_factor):
+                escalations.setdefault(chunk_id, []).append("density")
+            
+            cascade_stats = await self._escalate_chunks(
+                text, chunks, escalations, annotated, all_entities, chunk_results, result_rows,
+                prompt, first_model, model, temperature, max_tokens, cancellation
+            )
+            all_entities = cascade_stats.pop("entities")
+            failed_chunks += cascade_stats["chunks_failed"]
+            total_input_tokens += cascade_stats["tokens_by_model"][model]["input_tokens"]
+            total_output_tokens += cascade_stats["tokens_by_model"][model]["output_tokens"]
+        
         # If all chunks failed, this is a critical error
-        if failed_chunks == len(chunks):
-            raise Exception(f"All {len(chunks)} chunks failed during annotation. Last error: {chunk_results[-1].get('error', 'Unknown error') if chunk_results else 'No chunks processed'}")
+        if dispatched_chunks and failed_chunks == dispatched_chunks:
+            last_error = next((r["error"] for r in reversed(chunk_results) if "error" in r), "Unknown error")
+            raise Exception(f"All {dispatched_chunks} chunks failed during annotation. Last error: {last_error}")
+        
+        # Chunks without a final result: never sent, or left on the cheap pass by a cancelled escalation
+        unfinished_ids = {chunk["chunk_id"] for chunk in unfinished}
+        unfinished_ids.update(row["chunk_id"] for row in chunk_results if row.get("escalation_cancelled"))
+        
+        # The index is keyed by model, so only chunks whose result came from it are
+        # indexed: under cascade that is the escalated chunks, not the cheap-pass ones
+        if near_duplicates is not None:
+            for chunk, aligned_entities, result in annotated.values():
+                if chunk["chunk_id"] in unfinished_ids:
+                    continue
+                if chunk_results[result_rows[chunk["chunk_id"]]].get("model") != model:
+                    continue
+                near_duplicates.add(
+                    chunk["text"],
+                    chunk_relative_entities(aligned_entities, chunk["start_char"], chunk["end_char"]),
+                    input_tokens=result.get("input_tokens", 0),
+                    output_tokens=result.get("output_tokens", 0)
+                )
+        
+        stitching_stats = None
+        if boundary_mode == "stitch":
+            all_entities, stitch_results, stitching_stats = await self._stitch_chunk_boundaries(
+                text, chunks, all_entities, prompt, model, temperature, max_tokens, cancellation
+            )
+            chunk_results.extend(stitch_results)
+            total_input_tokens += stitching_stats["input_tokens"]
+            total_output_tokens += stitching_stats["output_tokens"]
+            if cascade_stats:
+                cascade_stats["tokens_by_model"][model]["input_tokens"] += stitching_stats["input_tokens"]
+                cascade_stats["tokens_by_model"][model]["output_tokens"] += stitching_stats["output_tokens"]
+        
+        if cascade_stats:
+            cascade_stats.update(self._cascade_costs(
+                cascade_stats["tokens_by_model"], model, cascade_stats["kept_tokens"]
+            ))
+            print(f"🪜 Cascade escalated {cascade_stats['chunks_escalated']}/{dispatched_chunks} chunks, "
+                  f"saved ${cascade_stats['cost_saved']:.6f}")
+        
+        if gazetteer_entities:
+            all_entities.extend(gazetteer_entities, chunk_id=-1)
+        
+        rule_stats = None
+        if rules:
+            rule_entities = await asyncio.to_thread(rules.extract, text)
+            all_entities.extend(rule_entities, chunk_id=-1)
+            rule_stats = {
+                "entities": len(rule_entities),
+                "rule_only_tags": list(rules.rule_only),
+                "prompt_tags": len(prompt.tags)
+            }
         
         # Remove duplicate entities from overlapping chunks
         all_entities = self._remove_duplicate_entities(all_entities)
         
         # Validate and fix entity positions
         validated_entities = self._validate_entity_positions(text, all_entities)
+        entities = validated_entities.to_dicts()
+        
+        sharding_stats = None
+        if sharded:
+            single_prompt_tokens = count_prompt(compile_prompt(llm_tag_definitions))
+            sent_chunk_tokens = sum(row.get("chunk_tokens", 0) for row in chunk_results if "model" in row)
+            sent_chunks = sum(1 for row in chunk_results if "model" in row)
+            sharding_stats = {
+                "shards": len(prompt.shards),
+                "tags_per_shard": [len(shard.tags) for shard in prompt.shards],
+                "shard_prompt_tokens": shard_prompt_tokens,
+                "single_prompt_tokens": single_prompt_tokens,
+                "conflicts_resolved": sum(row.get("conflicts_resolved", 0) for row in chunk_results),
+                # Input tokens the same chunks cost under each strategy, to choose between them
+                "estimated_input_tokens": {
+                    "single": sent_chunks * single_prompt_tokens + sent_chunk_tokens,
+                    "sharded": sent_chunks * sum(shard_prompt_tokens) + len(prompt.shards) * sent_chunk_tokens
+                }
+            }
+        
+        long_context_stats = None
+        if chunk_mode == "long_context":
+            long_context_stats = {
+                "context_window": context_window(model),
+                "window_tokens": window_tokens,
+                "page_tokens": max_tokens,
+                "windows": len(chunks),
+                "pages": sum(row.get("pages", 0) for row in chunk_results),
+                "incomplete_windows": sum(1 for row in chunk_results if row.get("complete") is False)
+            }
+        
+        if filter_stats and filter_stats["chunks_skipped"]:
+            print(f"🧹 Skipped {filter_stats['chunks_skipped']}/{len(chunks)} content-free chunks: {filter_stats['reasons']}")
+        
+        near_duplicate_stats = None
+        if near_duplicates is not None:
+            checked = near_duplicate_hits + dispatched_chunks
+            near_duplicate_stats = {
+                "chunks_checked": checked,
+                "hits": near_duplicate_hits,
+                "hit_rate": near_duplicate_hits / checked if checked else 0.0,
+                "tokens_saved": near_duplicate_tokens_saved,
+                "index": near_duplicates.stats()
+            }
+            if near_duplicate_hits:
+                print(f"♻️  Reused {near_duplicate_hits}/{checked} near-duplicate chunks, ~{near_duplicate_tokens_saved} tokens saved")
+        
+        # Per-chunk output needs and truncation, which the auto-tuner learns from
+        profile = run_profile(chunks, chunk_results, entities, model, {
+            **run_params, "max_tokens": max_tokens, "sharded": sharded
+        })
+        
+        # Everything a later incremental run needs to diff against this one; a cancelled
+        # run lists only its finished chunks, so the rest are annotated next time
+        document_run = {
+            **run_params,
+            "text": text,
+            "text_hash": text_hash(text),
+            "chunks": [
+                {"start_char": chunk["start_char"], "end_char": chunk["end_char"], "hash": text_hash(chunk["text"])}
+                for chunk in chunks
+                if chunk["chunk_id"] not in unfinished_ids
+            ],
+            "entities": entities
+        }
+        
+        cancellation_stats = None
+        if cancellation is not None and cancellation.cancelled:
+            cancellation_stats = {
+                "reason": cancellation.reason,
+                "elapsed_seconds": round(cancellation.elapsed(), 3),
+                "chunks_completed": len(chunks) - len(unfinished_ids),
+                "chunks_cancelled": len(unfinished),
+                "calls_abandoned": abandoned_calls,
+                **({"escalations_cancelled": cascade_stats["escalations_cancelled"]}
+                   if cascade_stats and cascade_stats.get("escalations_cancelled") else {}),
+                **({"boundaries_skipped": stitching_stats["boundaries_skipped"]}
+                   if stitching_stats and stitching_stats.get("boundaries_skipped") else {})
+            }
         
         return {
-            "entities": validated_entities,
+            "entities": entities,
             "statistics": {
                 "total_entities": len(validated_entities),
                 "chunks_processed": len(chunks),
                 "total_input_tokens": total_input_tokens,
                 "total_output_tokens": total_output_tokens,
-                "total_tokens": total_input_tokens + total_output_tokens
+                "total_tokens": total_input_tokens + total_output_tokens,
+                "chunk_mode": chunk_mode,
+                "boundary_mode": boundary_mode,
+                "tokenizer": tokenizer.name,
+                "truncated_chunks": sum(1 for row in chunk_results if row.get("truncated")),
+                "run_profile": profile,
+                **({"stitching": stitching_stats} if stitching_stats else {}),
+                **({"incremental": incremental_stats} if incremental_stats else {}),
+                **({"near_duplicates": near_duplicate_stats} if near_duplicate_stats else {}),
+                **({"cascade": cascade_stats} if cascade_stats else {}),
+                **({"rules": rule_stats} if rule_stats else {}),
+                **({"gazetteer": gazetteer_stats} if gazetteer_stats else {}),
+                **({"student": student_stats} if student_stats else {}),
+                **({"chunk_filter": filter_stats} if filter_stats else {}),
+                **({"tag_sharding": sharding_stats} if sharding_stats else {}),
+                **({"long_context": long_context_stats} if long_context_stats else {}),
+                **({"cancelled": cancellation_stats} if cancellation_stats else {})
             },
-            "chunk_results": chunk_results
+            "chunk_results": chunk_results,
+            "document_run": document_run
+        }
+    
+    @staticmethod
+    def _is_critical_error(error_msg: str) -> bool:
+        """Errors that would fail every other call too, so the pipeline stops"""
+        return any(critical in error_msg.lower() for critical in [
+            "api key", "authentication", "unauthorized", "invalid_api_key",
+            "permission denied", "billing", "quota exceeded"
+        ])
+    
+    async def _annotate_chunk(
+        self,
+        text: str,
+        chunk: Dict[str, Any],
+        prompt: CompiledPrompt,
+        model: str,
+        temperature: float,
+        max_tokens: int,
+        index: Optional[DocumentIndex] = None
+    ) -> Tuple[Dict[str, Any], List[Dict[str, Any]], Dict[str, int]]:
+        """Annotate one chunk and align its entities to document offsets"""
+        result = await self.annotate_text(
+            chunk["text"],
+            prompt,
+            model=model,
+            temperature=temperature,
+            max_tokens=max_tokens
+        )
+        
+        # Align entities against this chunk's own span and convert to global positions
+        aligned_entities, alignment_stats = align_chunk_entities(
+            text,
+            result.get("annotations", []),
+            chunk["start_char"],
+            chunk["end_char"],
+            margin=settings.alignment_margin,
+            index=index
+        )
+        return result, aligned_entities, alignment_stats
+    
+    async def _escalate_chunks(
+        self,
+        text: str,
+        chunks: List[Dict[str, Any]],
+        escalations: Dict[int, List[str]],
+        annotated: Dict[int, Tuple[Dict[str, Any], List[Dict[str, Any]], Dict[str, Any]]],
+        entities: EntityTable,
+        chunk_results: List[Dict[str, Any]],
+        result_rows: Dict[int, int],
+        prompt: CompiledPrompt,
+        cheap_model: str,
+        model: str,
+        temperature: float,
+        max_tokens: int,
+        cancellation: Optional[CancellationToken] = None
+    ) -> Dict[str, Any]:
+        """Re-annotate flagged chunks with the strong model, replacing their first-pass entities.
+        
+        Flagged chunks still waiting when the request is cancelled keep their
+        first-pass entities and are marked "escalation_cancelled".
+        """
+        tokens_by_model = {
+            cheap_model: {"input_tokens": 0, "output_tokens": 0},
+            model: {"input_tokens": 0, "output_tokens": 0}
+        }
+        for row in chunk_results:
+            if row.get("model") == cheap_model:
+                tokens_by_model[cheap_model]["input_tokens"] += row.get("input_tokens", 0)
+                tokens_by_model[cheap_model]["output_tokens"] += row.get("output_tokens", 0)
+        
+        reasons_count: Dict[str, int] = {}
+        for reasons in escalations.values():
+            for reason in reasons:
+                reasons_count[reason] = reasons_count.get(reason, 0) + 1
+        
+        # Cheap tokens of chunks that were not escalated, priced later as if the strong model had read them
+        kept_input = tokens_by_model[cheap_model]["input_tokens"]
+        kept_output = tokens_by_model[cheap_model]["output_tokens"]
+        
+        if escalations:
+            chunk_ids = entities.extra_column("chunk_id")
+            entities = entities.take([row for row, chunk_id in enumerate(chunk_ids) if chunk_id not in escalations])
+        
+        by_id = {chunk["chunk_id"]: chunk for chunk in chunks}
+        index = get_document_index(text)
+        failed = 0
+        cancelled = 0
+        for chunk_id, reasons in escalations.items():
+            chunk = by_id[chunk_id]
+            first_pass = chunk_results[result_rows[chunk_id]]
+            
+            result = None
+            if cancellation is None or not await cancellation.poll():
+                call = self._annotate_chunk(text, chunk, prompt, model, temperature, max_tokens, index)
+                try:
+                    result, aligned_entities, alignment_stats = \
+                        await (cancellation.guard(call) if cancellation is not None else call)
+                except RequestCancelled:
+                    pass
+                except Exception as e:
+                    result = e
+            if result is None:
+                cancelled += 1
+                first_pass["escalation_cancelled"] = True
+                first_pass["escalation_reasons"] = reasons
+                if chunk_id in annotated:
+                    entities.extend(annotated[chunk_id][1], chunk_id=chunk_id)
+                continue
+            
+            kept_input -= first_pass.get("input_tokens", 0)
+            kept_output -= first_pass.get("output_tokens", 0)
+            annotated.pop(chunk_id, None)
+            
+            escalated = {
+                "chunk_id": chunk_id,
+                "model": model,
+                "escalated": True,
+                "escalation_reasons": reasons,
+                "first_pass": {
+                    key: first_pass[key]
+                    for key in ("model", "entities_found", "input_tokens", "output_tokens", "error")
+                    if key in first_pass
+                },
+                "chunk_tokens": first_pass.get("chunk_tokens")
+            }
+            if isinstance(result, Exception):
+                error_msg = str(result)
+                if self._is_critical_error(error_msg):
+                    raise Exception(f"Annotation failed due to API authentication/authorization issue: {error_msg}")
+                failed += 1
+                print(f"⚠️  Chunk {chunk_id} failed on {model} too: {error_msg}")
+                chunk_results[result_rows[chunk_id]] = {
+                    **escalated, "error": error_msg, "entities_found": 0, "input_tokens": 0, "output_tokens": 0
+                }
+                continue
+            
+            entities.extend(aligned_entities, chunk_id=chunk_id)
+            annotated[chunk_id] = (chunk, aligned_entities, result)
+            tokens_by_model[model]["input_tokens"] += result.get("input_tokens", 0)
+            tokens_by_model[model]["output_tokens"] += result.get("output_tokens", 0)
+            chunk_results[result_rows[chunk_id]] = {
+                **escalated,
+                "entities_found": len(result.get("annotations", [])),
+                "input_tokens": result.get("input_tokens", 0),
+                "output_tokens": result.get("output_tokens", 0),
+                "alignment": alignment_stats
+            }
+        
+        return {
+            "entities": entities,
+            "cheap_model": cheap_model,
+            "strong_model": model,
+            "chunks_escalated": len(escalations) - cancelled,
+            "chunks_failed": failed,
+            **({"escalations_cancelled": cancelled} if cancelled else {}),
+            "escalation_reasons": reasons_count,
+            "tokens_by_model": tokens_by_model,
+            "kept_tokens": {"input_tokens": max(0, kept_input), "output_tokens": max(0, kept_output)}
+        }
+    
+    @staticmethod
+    def _cascade_costs(
+        tokens_by_model: Dict[str, Dict[str, int]],
+        model: str,
+        kept_tokens: Dict[str, int]
+    ) -> Dict[str, float]:
+        """Actual cascade cost and what running every chunk on the strong model would have cost"""
+        calculator = CostCalculator()
+        cost = sum(
+            calculator.calculate_cost(name, usage["input_tokens"], usage["output_tokens"])["total_cost"]
+            for name, usage in tokens_by_model.items()
+        )
+        strong = tokens_by_model[model]
+        strong_only_cost = calculator.calculate_cost(
+            model,
+            strong["input_tokens"] + kept_tokens["input_tokens"],
+            strong["output_tokens"] + kept_tokens["output_tokens"]
+        )["total_cost"]
+        return {
+            "cost": round(cost, 6),
+            "strong_only_cost": round(strong_only_cost, 6),
+            "cost_saved": round(strong_only_cost - cost, 6)
         }
     
+    async def _stitch_chunk_boundaries(
+        self,
+        text: str,
+        chunks: List[Dict[str, Any]],
+        entities: EntityTable,
+        prompt: CompiledPrompt,
+        model: str,
+        temperature: float,
+        max_tokens: int,
+        cancellation: Optional[CancellationToken] = None
+    ) -> Tuple[EntityTable, List[Dict[str, Any]], Dict[str, Any]]:
+        """Re-annotate a window around each chunk boundary an entity touches or a word straddles.
+        
+        Entities from the neighbouring chunks that reach the boundary may be truncated,
+        so they are replaced by what the window finds across it. Boundaries left when
+        the request is cancelled keep the chunk entities as they are.
+        """
+        index = get_document_index(text)
+        half_window = settings.stitch_window // 2
+        stats = {"boundaries": max(0, len(chunks) - 1), "requeried": 0, "entities_replaced": 0,
+                 "boundaries_skipped": 0, "input_tokens": 0, "output_tokens": 0}
+        results = []
+        # Copies: views of the table's buffers would block the extend below
+        starts = np.array(entities.start_array())
+        ends = np.array(entities.end_array())
+        
+        replaced_rows = set()
+        window_entities = []
+        for left, right in zip(chunks, chunks[1:]):
+            if left.get("reused") and right.get("reused"):
+                # Both sides were carried over from the previous run unchanged
+                continue
+            boundary = right["start_char"]
+            touching = np.flatnonzero((starts <= boundary) & (ends >= boundary))
+            if not len(touching) and not index.splits_word(boundary, boundary):
+                continue
+            
+            window_start = index.token_floor(max(left["start_char"], boundary - half_window))
+            window_end = index.token_ceil(min(right["end_char"], boundary + half_window))
+            if cancellation is not None and await cancellation.poll():
+                stats["boundaries_skipped"] += 1
+                continue
+            stats["requeried"] += 1
+            
+            try:
+                call = self.annotate_text(
+                    text[window_start:window_end],
+                    prompt,
+                    model=model,
+                    temperature=temperature,
+                    max_tokens=max_tokens
+                )
+                result = await (cancellation.guard(call) if cancellation is not None else call)
+            except RequestCancelled:
+                stats["requeried"] -= 1
+                stats["boundaries_skipped"] += 1
+                continue
+            except Exception as e:
+                # Keep the chunk entities as they are when the window cannot be re-queried
+                print(f"⚠️  Boundary at {boundary} could not be stitched: {e}")
+                results.append({"chunk_id": right["chunk_id"], "boundary": boundary, "error": str(e),
+                                "entities_found": 0, "input_tokens": 0, "output_tokens": 0})
+                continue
+            
+            aligned, alignment_stats = align_chunk_entities(
+                text, result.get("annotations", []), window_start, window_end,
+                margin=settings.alignment_margin, index=index
+            )
+            crossing = [e for e in aligned if e["start_char"] <= boundary <= e["end_char"]]
+            window_entities.extend(crossing)
+            # A window that finds nothing across the boundary is a miss, not evidence the
+            # chunk entities are wrong: they stay and deduplication merges any repeats
+            if crossing:
+                replaced_rows.update(touching.tolist())
+            
+            stats["input_tokens"] += result.get("input_tokens", 0)
+            stats["output_tokens"] += result.get("output_tokens", 0)
+            # A boundary row belongs to the chunk that starts at the boundary
+            results.append({
+                "chunk_id": right["chunk_id"],
+                "boundary": boundary,
+                "window": [window_start, window_end],
+                "entities_found": len(crossing),
+                "entities_replaced": len(touching) if crossing else 0,
+                "input_tokens": result.get("input_tokens", 0),
+                "output_tokens": result.get("output_tokens", 0),
+                "alignment": alignment_stats
+            })
+        
+        stats["entities_replaced"] = len(replaced_rows)
+        if replaced_rows:
+            entities = entities.take([row for row in range(len(entities)) if row not in replaced_rows])
+        entities.extend(window_entities)
+        
+        print(f"🧵 Stitched {stats['requeried']}/{stats['boundaries']} chunk boundaries")
+        return entities, results, stats
+    
     async def annotate_text(
         self,
         text: str,
@@ -282,6 +1278,11 @@ class LLMService:
     ) -> Dict[str, Any]:
         """Annotate text using specified LLM model"""
         
+        if isinstance(tag_definitions, ShardedPrompt):
+            return await self._annotate_sharded(text, tag_definitions, model, temperature, max_tokens)
+        if isinstance(tag_definitions, PaginatedPrompt):
+            return await self._annotate_paginated(text, tag_definitions, model, temperature, max_tokens)
+        
         if model.startswith("gpt"):
             return await self._annotate_with_openai(
                 text, tag_definitions, model, temperature, max_tokens
@@ -293,6 +1294,136 @@ class LLMService:
         else:
             raise ValueError(f"Unsupported model: {model}")
     
+    async def _annotate_sharded(
+        self,
+        text: str,
+        prompt: ShardedPrompt,
+        model: str,
+        temperature: float,
+        max_tokens: int
+    ) -> Dict[str, Any]:
+        """Annotate text with every shard prompt concurrently and merge the results"""
+        results = await asyncio.gather(
+            *(self.annotate_text(text, shard, model, temperature, max_tokens) for shard in prompt.shards),
+            return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+        
+        annotations, conflicts = resolve_shard_conflicts(
+            [result.get("annotations", []) for result in results], text
+        )
+        confidence_scores = {}
+        for result in results:
+            if isinstance(result.get("confidence_scores"), dict):
+                confidence_scores.update(result["confidence_scores"])
+        input_tokens = sum(result.get("input_tokens", 0) for result in results)
+        output_tokens = sum(result.get("output_tokens", 0) for result in results)
+        
+        return {
+            "annotations": annotations,
+            "confidence_scores": confidence_scores,
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens,
+            # Each shard had its own output budget, so truncation is judged per shard
+            "truncated": any(
+                result.get("truncated", result.get("output_tokens", 0) >= max_tokens) for result in results
+            ),
+            "conflicts_resolved": conflicts,
+            **({
+                "pages": sum(result["pages"] for result in results),
+                "complete": all(result["complete"] for result in results)
+            } if all("pages" in result for result in results) else {}),
+            "shards": [
+                {
+                    "tags": len(shard.tags),
+                    "entities_found": len(result.get("annotations", [])),
+                    "input_tokens": result.get("input_tokens", 0),
+                    "output_tokens": result.get("output_tokens", 0)
+                }
+                for shard, result in zip(prompt.shards, results)
+            ]
+        }
+    
+    async def _annotate_paginated(
+        self,
+        text: str,
+        prompt: PaginatedPrompt,
+        model: str,
+        temperature: float,
+        max_tokens: int
+    ) -> Dict[str, Any]:
+        """Collect a long text's entities one page per call until the model reports it is done"""
+        page_size = max(1, max_tokens // settings.long_context_tokens_per_entity)
+        returned: List[Dict[str, Any]] = []
+        seen = set()
+        confidence_scores = {}
+        input_tokens = output_tokens = pages = 0
+        complete = False
+        retried = False
+        
+        while pages < settings.long_context_max_pages:
+            page_prompt = prompt.page(page_size, returned)
+            try:
+                result = await self.annotate_text(text, page_prompt, model, temperature, max_tokens)
+            except Exception as e:
+                if self._is_critical_error(str(e)):
+                    raise
+                # The failed call is billed but its usage is lost with the response:
+                # estimate it as the prompt plus a reply that used all of max_tokens
+                input_tokens += get_tokenizer(model).count(
+                    page_prompt.system_prompt + page_prompt.user_prompt(text)
+                )
+                output_tokens += max_tokens
+                # A page cut off mid-JSON is retried once with half as many entities
+                if not retried and page_size > 1:
+                    page_size //= 2
+                    retried = True
+                    continue
+                if not returned:
+                    raise
+                print(f"⚠️  Stopping after page {pages}: {e}")
+                break
+            retried = False
+            pages += 1
+            input_tokens += result.get("input_tokens", 0)
+            output_tokens += result.get("output_tokens", 0)
+            if isinstance(result.get("confidence_scores"), dict):
+                confidence_scores.update(result["confidence_scores"])
+            
+            page = result.get("annotations", [])
+            new = []
+            for annotation in page:
+                if not isinstance(annotation, dict):
+                    continue
+                key = tuple(str(annotation.get(field)) for field in ("start_char", "end_char", "label", "text"))
+                if key not in seen:
+                    seen.add(key)
+                    new.append(annotation)
+            returned.extend(new)
+            
+            # Models that ignore the "done" flag are taken as finished on a short page;
+            # a page of nothing but repeats means there is nothing left either
+            done = result.get("done")
+            if done is True or not new or (done is None and len(page) < page_size):
+                complete = True
+                break
+        
+        if not complete:
+            print(f"⚠️  Long-context window incomplete after {pages} pages")
+        return {
+            "annotations": returned,
+            "confidence_scores": confidence_scores,
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens,
+            "pages": pages,
+            "complete": complete,
+            "truncated": not complete
+        }
+    
     async def _annotate_with_openai(
         self,
         text: str,
@@ -306,15 +1437,18 @@ class LLMService:
         if not self.openai_client:
             raise Exception("OpenAI client not initialized. Please check your API key configuration.")
         
-        system_prompt = self._create_system_prompt(tag_definitions)
-        user_prompt = self._create_user_prompt(text)
+        prompt = compile_prompt(tag_definitions)
+        system_prompt = prompt.system_prompt
+        user_prompt = prompt.user_prompt(text)
         
         print(f"🤖 Making OpenAI API call with model: {model}")
         print(f"📝 Text length: {len(text)} characters")
         print(f"🏷️  Tag definitions: {len(tag_definitions) if hasattr(tag_definitions, '__len__') else 'Unknown'}")
         
         try:
-            response = self.openai_client.chat.completions.create(
+            # The client blocks, so calls run in a thread and concurrent chunks or shards overlap
+            response = await get_request_limiter("openai").run(
+                self.openai_client.chat.completions.create,
                 model=model,
                 messages=[
                     {"role": "system", "content": system_prompt},
@@ -326,6 +1460,7 @@ class LLMService:
             )
             
             result_text = response.choices[0].message.content
+            truncated = response.choices[0].finish_reason == "length"
             print(f"✅ OpenAI response received: {len(result_text)} characters")
             
             try:
@@ -339,6 +1474,8 @@ class LLMService:
             return {
                 "annotations": annotations.get("annotations", []),
                 "confidence_scores": annotations.get("confidence_scores", {}),
+                **({"done": annotations["done"]} if "done" in annotations else {}),
+                "truncated": truncated,
                 "input_tokens": response.usage.prompt_tokens,
                 "output_tokens": response.usage.completion_tokens,
                 "total_tokens": response.usage.total_tokens
@@ -358,11 +1495,13 @@ class LLMService:
     ) -> Dict[str, Any]:
         """Annotate using Anthropic Claude models"""
         
-        system_prompt = self._create_system_prompt(tag_definitions)
-        user_prompt = self._create_user_prompt(text)
+        prompt = compile_prompt(tag_definitions)
+        system_prompt = prompt.system_prompt
+        user_prompt = prompt.user_prompt(text)
         
         try:
-            response = self.anthropic_client.messages.create(
+            response = await get_request_limiter("anthropic").run(
+                self.anthropic_client.messages.create,
                 model=model,
                 max_tokens=max_tokens,
                 temperature=temperature,
@@ -376,12 +1515,15 @@ class LLMService:
             annotations = json.loads(result_text)
             
             # Claude provides token counts in usage
-            input_tokens = response.usage.input_tokens if hasattr(response, 'usage') else len(system_prompt + user_prompt) // 4
-            output_tokens = response.usage.output_tokens if hasattr(response, 'usage') else len(result_text) // 4
+            tokenizer = get_tokenizer(model)
+            input_tokens = response.usage.input_tokens if hasattr(response, 'usage') else tokenizer.count(system_prompt + user_prompt)
+            output_tokens = response.usage.output_tokens if hasattr(response, 'usage') else tokenizer.count(result_text)
             
             return {
                 "annotations": annotations.get("annotations", []),
                 "confidence_scores": annotations.get("confidence_scores", {}),
+                **({"done": annotations["done"]} if "done" in annotations else {}),
+                "truncated": response.stop_reason == "max_tokens",
                 "input_tokens": input_tokens,
                 "output_tokens": output_tokens,
                 "total_tokens": input_tokens + output_tokens
@@ -392,113 +1534,67 @@ class LLMService:
     
     def _create_system_prompt(self, tag_definitions: Any) -> str:
         """Create system prompt for annotation"""
-        if isinstance(tag_definitions, pd.DataFrame):
-            tag_df = tag_definitions
-        else:
-            tag_df = pd.DataFrame(tag_definitions)
-        
-        tag_section = self._format_tag_section(tag_df)
-        
-        return f"""You are a scientific named entity recognition (NER) expert. Extract entities that match the SEMANTIC MEANING of tag definitions, not the literal tag labels themselves.
-
-STRICT RULES:
-• Extract concrete examples of the categories, not the category names themselves
-• Return valid JSON array format only
-• Each entity must have: start_char, end_char, text, label
-• Positions must be accurate character indices
-• Only annotate text that clearly belongs to one of the defined categories
-
-TAG DEFINITIONS:
-{tag_section}
-
-Return JSON array format:
-{{"annotations": [{{"start_char": 0, "end_char": 10, "text": "example", "label": "TAG_NAME"}}]}}"""
+        return compile_prompt(tag_definitions).system_prompt
 
     def _create_user_prompt(self, text: str) -> str:
         """Create user prompt with text to annotate"""
-        return f"""TARGET TEXT:
-{text}
-
-Extract all entities that match the tag definitions. Return only valid JSON."""
+        return user_prompt(text)
     
-    def _format_tag_section(self, tag_df: pd.DataFrame) -> str:
-        """Format tag definitions for prompt"""
-        tag_texts = []
-        for _, row in tag_df.iterrows():
-            tag_block = (
-                f"TAG: {row['tag_name']}\n"
-                f"Definition: {row['definition']}\n"
-                f"Examples: {row['examples']}\n"
-            )
-            tag_texts.append(tag_block)
-        return "\n".join(tag_texts)
-    
-    def _remove_duplicate_entities(self, entities: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    def _remove_duplicate_entities(self, entities: EntityTable) -> EntityTable:
         """Remove duplicate entities from overlapping chunks"""
-        unique_entities = []
-        seen_entities = set()
-        
-        for entity in entities:
-            # Create a unique key based on text and position
-            key = (entity.get("text", ""), entity.get("start_char", 0), entity.get("end_char", 0), entity.get("label", ""))
-            
-            if key not in seen_entities:
-                seen_entities.add(key)
-                # Remove chunk_id from final entities
-                clean_entity = {k: v for k, v in entity.items() if k != "chunk_id"}
-                unique_entities.append(clean_entity)
+        unique_entities = entities.remove_duplicates()
         
+        # Remove chunk_id from final entities
+        unique_entities.drop_extra("chunk_id")
         return unique_entities
     
-    def _validate_entity_positions(self, text: str, entities: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    def _validate_entity_positions(self, text: str, entities: EntityTable) -> EntityTable:
         """Validate and fix entity positions"""
-        validated_entities = []
+        starts = entities.start_array()
+        ends = entities.end_array()
         
-        for entity in entities:
-            try:
-                start = entity.get("start_char", 0)
-                end = entity.get("end_char", 0)
-                expected_text = entity.get("text", "")
-                
-                # Check if positions are valid
-                if start < 0 or end > len(text) or start >= end:
-                    continue
-                
-                # Check if text matches
-                actual_text = text[start:end]
-                if actual_text == expected_text:
-                    validated_entities.append(entity)
-                else:
-                    # Try to find correct position
-                    corrected_entity = self._fix_entity_position(text, entity)
-                    if corrected_entity:
-                        validated_entities.append(corrected_entity)
-                        
-            except Exception:
-                continue
+        # Rows with impossible offsets are dropped outright
+        in_bounds = (starts >= 0) & (ends <= len(text)) & (starts < ends)
+        keep = set(np.flatnonzero(in_bounds).tolist())
         
-        return validated_entities
-    
-    def _fix_entity_position(self, text: str, entity: Dict[str, Any]) -> Optional[Dict[str, Any]]:
-        """Try to fix entity position by finding text in document"""
-        expected_text = entity.get("text", "")
-        if not expected_text:
-            return None
-        
-        # Find all occurrences of the text
-        start_pos = 0
-        while True:
-            pos = text.find(expected_text, start_pos)
-            if pos == -1:
-                break
+        # Only rows whose text disagrees with their offsets need repair
+        needs_fix = [row for row in entities.mismatched_rows() if row in keep]
+        
+        if needs_fix:
+            # One pass over the document finds every candidate position for all broken entities
+            resolver = SpanResolver(
+                entities.text_at(row) for row in needs_fix if isinstance(entities.text_at(row), str)
+            )
+            occurrences = resolver.find_all(text)
+            index = get_document_index(entities.source_text)
             
-            # Return first occurrence (could be improved with better matching)
-            fixed_entity = entity.copy()
-            fixed_entity["start_char"] = pos
-            fixed_entity["end_char"] = pos + len(expected_text)
-            return fixed_entity
+            for row in needs_fix:
+                if not self._fix_entity_position(entities, row, occurrences, index):
+                    keep.discard(row)
         
-        return None
+        return entities.take(sorted(keep))
+    
+    def _fix_entity_position(
+        self,
+        entities: EntityTable,
+        row: int,
+        occurrences: Dict[str, List[int]],
+        index: DocumentIndex
+    ) -> bool:
+        """Try to fix entity position by moving it to the nearest occurrence of its text"""
+        expected_text = entities.text_at(row)
+        if not expected_text or not isinstance(expected_text, str):
+            return False
+        
+        positions = SpanResolver.whole_word_positions(
+            occurrences.get(expected_text, []), len(expected_text), index
+        )
+        pos = SpanResolver.nearest(positions, entities.starts[row])
+        if pos is None:
+            return False
+        
+        entities.set_span(row, pos, pos + len(expected_text))
+        return True
     
     async def validate_annotation(
         self,
@@ -514,33 +1610,31 @@ Extract all entities that match the tag definitions. Return only valid JSON."""
             "suggestions": []
         }
         
+        columns = EntityColumns.from_annotations(
+            annotations, start_key="start", end_key="end", label_key="tag"
+        )
+        
         # Check for overlapping annotations
-        sorted_annotations = sorted(annotations, key=lambda x: x["start"])
-        for i in range(len(sorted_annotations) - 1):
-            current = sorted_annotations[i]
-            next_ann = sorted_annotations[i + 1]
-            
-            if current["end"] > next_ann["start"]:
-                validation_results["is_valid"] = False
-                validation_results["issues"].append({
-                    "type": "overlap",
-                    "message": f"Overlapping annotations: '{current['text']}' and '{next_ann['text']}'"
-                })
+        for current_idx, next_idx in find_adjacent_overlaps(columns):
+            validation_results["is_valid"] = False
+            validation_results["issues"].append({
+                "type": "overlap",
+                "message": f"Overlapping annotations: '{annotations[current_idx]['text']}' and '{annotations[next_idx]['text']}'"
+            })
         
         # Check if annotated text matches positions
-        for annotation in annotations:
-            start, end = annotation["start"], annotation["end"]
-            if start < 0 or end > len(text) or start >= end:
-                validation_results["is_valid"] = False
+        invalid_bounds = find_invalid_bounds(columns, len(text))
+        mismatched = find_text_mismatches(columns, text, ~invalid_bounds)
+        for i in np.flatnonzero(invalid_bounds | mismatched):
+            annotation = annotations[i]
+            validation_results["is_valid"] = False
+            if invalid_bounds[i]:
                 validation_results["issues"].append({
                     "type": "invalid_position",
                     "message": f"Invalid position for annotation: '{annotation['text']}'"
                 })
-                continue
-            
-            expected_text = text[start:end]
-            if expected_text != annotation["text"]:
-                validation_results["is_valid"] = False
+            else:
+                expected_text = text[columns.starts[i]:columns.ends[i]]
                 validation_results["issues"].append({
                     "type": "text_mismatch",
                     "message": f"Text mismatch: expected '{expected_text}', got '{annotation['text']}'"
@@ -548,94 +1642,196 @@ Extract all entities that match the tag definitions. Return only valid JSON."""
         
         # Check if tags are valid
         valid_tags = set(tag_definitions.keys())
-        for annotation in annotations:
-            if annotation["tag"] not in valid_tags:
-                validation_results["is_valid"] = False
-                validation_results["issues"].append({
-                    "type": "invalid_tag",
-                    "message": f"Invalid tag: '{annotation['tag']}'"
-                })
+        invalid_label_ids = [i for i, label in enumerate(columns.labels) if label not in valid_tags]
+        for i in np.flatnonzero(np.isin(columns.label_ids, invalid_label_ids)):
+            validation_results["is_valid"] = False
+            validation_results["issues"].append({
+                "type": "invalid_tag",
+                "message": f"Invalid tag: '{annotations[i]['tag']}'"
+            })
         
         return validation_results
     
-    async def evaluate_annotations_with_llm(
+    async def _complete(
+        self,
+        system_prompt: str,
+        user_prompt: str,
+        model: str,
+        temperature: float,
+        max_tokens: int
+    ) -> Dict[str, Any]:
+        """One JSON-mode request returning the raw reply text, token usage and truncation"""
+        if model.startswith("gpt"):
+            if not self.openai_client:
+                raise Exception("OpenAI client not initialized. Please check your API key configuration.")
+            response = await get_request_limiter("openai").run(
+                self.openai_client.chat.completions.create,
+                model=model,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_prompt}
+                ],
+                temperature=temperature,
+                max_tokens=max_tokens,
+                response_format={"type": "json_object"}
+            )
+            choice = response.choices[0]
+            return {
+                "text": choice.message.content or "",
+                "input_tokens": response.usage.prompt_tokens,
+                "output_tokens": response.usage.completion_tokens,
+                "truncated": choice.finish_reason == "length"
+            }
+        elif model.startswith("claude"):
+            response = await get_request_limiter("anthropic").run(
+                self.anthropic_client.messages.create,
+                model=model,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                system=system_prompt,
+                messages=[
+                    {"role": "user", "content": user_prompt}
+                ]
+            )
+            return {
+                "text": response.content[0].text,
+                "input_tokens": response.usage.input_tokens,
+                "output_tokens": response.usage.output_tokens,
+                "truncated": response.stop_reason == "max_tokens"
+            }
+        else:
+            raise ValueError(f"Unsupported model: {model}")
+    
+    async def _evaluate_batch(
+        self,
+        prompt: CompiledPrompt,
+        annotations: List[Dict[str, Any]],
+        indices: List[int],
+        model: str,
+        temperature: float,
+        max_tokens: int,
+        round_number: int
+    ) -> Tuple[Dict[int, Dict[str, Any]], Dict[str, Any]]:
+        """Verdicts of one batch keyed by annotation index, and the batch's stats"""
+        batch = [annotations[index] for index in indices]
+        started = time.perf_counter()
+        stats = {"round": round_number, "size": len(indices), "input_tokens": 0, "output_tokens": 0}
+        try:
+            result = await self._complete(
+                prompt.evaluation_system_prompt,
+                prompt.evaluation_prompt(batch),
+                model, temperature, max_tokens
+            )
+        except Exception as e:
+            print(f"❌ Evaluation batch of {len(indices)} failed: {e}")
+            stats.update(latency_ms=round((time.perf_counter() - started) * 1000), verdicts=0,
+                         truncated=False, error=str(e))
+            return {}, stats
+        
+        verdicts = parse_verdicts(result["text"], batch, prompt.tag_names)
+        stats.update(
+            latency_ms=round((time.perf_counter() - started) * 1000),
+            input_tokens=result["input_tokens"],
+            output_tokens=result["output_tokens"],
+            verdicts=len(verdicts),
+            truncated=result["truncated"]
+        )
+        return {indices[position]: verdict for position, verdict in verdicts.items()}, stats
+    
+    async def run_evaluation(
         self,
         annotations: List[Dict[str, Any]],
         tag_definitions: List[Dict[str, Any]],
         model: str = "gpt-4o-mini",
         temperature: float = 0.1,
-        max_tokens: int = 2000
-    ) -> List[Dict[str, Any]]:
-        """Evaluate annotations using LLM to suggest improvements"""
+        max_tokens: int = 2000,
+        text: Optional[str] = None,
+        context_words: Optional[int] = None,
+        verdict_store: Optional[VerdictStore] = None,
+        user_id: Optional[str] = None,
+        reuse_verdicts: bool = False
+    ) -> Dict[str, Any]:
+        """Evaluate annotations in concurrent token-sized batches, retrying missing verdicts.
+
+        Annotations are grouped by normalized (text, label) key, with a context
+        signature when text and context_words are given; one member per group is
+        sent and its verdict applies to the whole group. Groups already judged for
+        this tag set, model and temperature are taken from verdict_store when
+        reuse_verdicts is on; new verdicts are always stored.
+
+        Batches go out together and share the provider request limiter with annotation
+        runs. Groups whose verdict is missing (failed request, truncated or malformed
+        reply) are re-batched for up to settings.evaluation_max_retries more rounds;
+        only those still unanswered come back as "review".
+        """
+        prompt = compile_prompt(tag_definitions)
+        tokenizer = get_tokenizer(model)
+        if context_words is None:
+            context_words = settings.evaluation_context_words
+        keys, groups = group_annotations(annotations, text, context_words)
         
-        # Convert tag definitions to DataFrame format
-        tag_df = pd.DataFrame(tag_definitions)
+        cached: Dict[str, Dict[str, Any]] = {}
+        if verdict_store is not None and user_id and reuse_verdicts:
+            cached = verdict_store.get_many(user_id, prompt.tag_set_hash, model, temperature, list(groups))
         
-        evaluation_results = []
+        verdicts: Dict[int, Dict[str, Any]] = {}
+        batch_stats: List[Dict[str, Any]] = []
+        last_error: Dict[int, str] = {}
+        pending = [members[0] for key, members in groups.items() if key not in cached]
+        print(f"🔎 Evaluating {len(annotations)} annotations: {len(groups)} distinct, {len(cached)} already judged")
         
-        # Process annotations in batches
-        batch_size = 10
-        for i in range(0, len(annotations), batch_size):
-            batch = annotations[i:i + batch_size]
-            
-            try:
-                evaluation_prompt = self._create_evaluation_prompt(batch, tag_df)
-                
-                result = await self.annotate_text(
-                    evaluation_prompt,
-                    tag_df,
-                    model=model,
-                    temperature=temperature,
-                    max_tokens=max_tokens
-                )
-                
-                # Parse evaluation results
-                for j, annotation in enumerate(batch):
-                    evaluation_results.append({
-                        "entity_index": i + j,
-                        "original_annotation": annotation,
-                        "is_correct": True,  # Default assumption
-                        "recommendation": "keep",
-                        "reasoning": "Annotation appears correct",
-                        "suggested_label": annotation.get("label", ""),
-                        "confidence": 0.8
-                    })
-                    
-            except Exception as e:
-                # If evaluation fails, mark as uncertain
-                for j, annotation in enumerate(batch):
-                    evaluation_results.append({
-                        "entity_index": i + j,
-                        "original_annotation": annotation,
-                        "is_correct": False,
-                        "recommendation": "review",
-                        "reasoning": f"Evaluation failed: {str(e)}",
-                        "suggested_label": annotation.get("label", ""),
-                        "confidence": 0.5
-                    })
-        
-        return evaluation_results
-    
-    def _create_evaluation_prompt(self, annotations: List[Dict[str, Any]], tag_df: pd.DataFrame) -> str:
-        """Create prompt for evaluating annotations"""
+        for round_number in range(1, settings.evaluation_max_retries + 2):
+            if not pending:
+                break
+            batches = plan_batches(prompt, annotations, pending, tokenizer, max_tokens)
+            print(f"🔎 Evaluation round {round_number}: {len(pending)} annotations in {len(batches)} batches")
+            results = await asyncio.gather(*(
+                self._evaluate_batch(prompt, annotations, indices, model, temperature, max_tokens, round_number)
+                for indices in batches
+            ))
+            for indices, (batch_verdicts, stats) in zip(batches, results):
+                verdicts.update(batch_verdicts)
+                stats["batch"] = len(batch_stats)
+                batch_stats.append(stats)
+                if stats.get("error"):
+                    last_error.update(dict.fromkeys(indices, stats["error"]))
+            pending = [index for index in pending if index not in verdicts]
         
-        tag_section = self._format_tag_section(tag_df)
+        new_verdicts = {keys[index]: verdict for index, verdict in verdicts.items()}
+        if verdict_store is not None and user_id:
+            verdict_store.save_many(user_id, prompt.tag_set_hash, model, temperature, new_verdicts)
         
-        annotations_text = ""
-        for i, ann in enumerate(annotations):
-            annotations_text += f"{i+1}. Text: '{ann.get('text', '')}' | Label: {ann.get('label', '')} | Position: [{ann.get('start_char', 0)}:{ann.get('end_char', 0)}]\n"
+        evaluation_results = []
+        for index, annotation in enumerate(annotations):
+            key = keys[index]
+            representative = groups[key][0]
+            verdict = cached.get(key) or new_verdicts.get(key)
+            if verdict is None:
+                result = unresolved_result(index, annotation, last_error.get(representative))
+            else:
+                result = {"entity_index": index, "original_annotation": annotation, **verdict}
+            result.update(group_size=len(groups[key]), cached=key in cached)
+            evaluation_results.append(result)
         
-        return f"""Evaluate the following annotations against the tag definitions. For each annotation, determine if it's correct, needs a different label, or should be deleted.
-
-TAG DEFINITIONS:
-{tag_section}
-
-ANNOTATIONS TO EVALUATE:
-{annotations_text}
-
-For each annotation, respond with:
-- CORRECT: if the annotation matches the tag definition
-- CHANGE_LABEL: if the text should have a different label
-- DELETE: if the annotation is incorrect
-
-Provide reasoning for each decision."""
+        return {
+            "evaluation_results": evaluation_results,
+            "batches": batch_stats,
+            "summary": {
+                **summarize_batches(batch_stats, evaluation_results),
+                "distinct_groups": len(groups),
+                "cached_groups": len(cached),
+                "evaluated_groups": len(new_verdicts)
+            }
+        }
+    
+    async def evaluate_annotations_with_llm(
+        self,
+        annotations: List[Dict[str, Any]],
+        tag_definitions: List[Dict[str, Any]],
+        model: str = "gpt-4o-mini",
+        temperature: float = 0.1,
+        max_tokens: int = 2000
+    ) -> List[Dict[str, Any]]:
+        """Evaluate annotations using LLM to suggest improvements"""
+        evaluation = await self.run_evaluation(annotations, tag_definitions, model, temperature, max_tokens)
+        return evaluation["evaluation_results"]
@@ -0,0 +1,100 @@
+from typing import Dict, List, Any, Optional
+import json
+
+from app.config import LLM_MODELS, settings
+from app.services.prompt_compiler import CompiledPrompt
+
+
+_PAGE_TEMPLATE = """TARGET TEXT:
+{text}
+
+Extract all entities that match the tag definitions, in order of appearance in the text.
+Return at most {page_size} entities in this response.
+{continuation}Return only valid JSON: {{"annotations": [...], "done": true}} with "done" false if more entities follow the last one returned."""
+
+_CONTINUATION_TEMPLATE = """{count} entities were already returned, the last being {last}. Continue with the entities after it.
+"""
+
+
+def model_limits(model: str) -> Optional[Dict[str, Any]]:
+    """LLM_MODELS entry for a model id, falling back to the longest listed id it extends"""
+    entries = [entry for provider in LLM_MODELS.values() for entry in provider["models"]]
+    exact = next((entry for entry in entries if entry["id"] == model), None)
+    if exact is not None:
+        return exact
+    # Dated or suffixed ids ("gpt-4o-2024-08-06") share the limits of their family
+    family = [entry for entry in entries if model.startswith(entry["id"])]
+    return max(family, key=lambda entry: len(entry["id"])) if family else None
+
+
+def context_window(model: str) -> Optional[int]:
+    limits = model_limits(model)
+    return limits["max_tokens"] if limits else None
+
+
+def page_tokens(model: str, max_tokens: int) -> int:
+    """Output budget of one page: settings.long_context_page_tokens, within the model's output limit"""
+    limits = model_limits(model) or {}
+    budget = max(max_tokens, settings.long_context_page_tokens)
+    return min(budget, limits.get("max_output_tokens", budget))
+
+
+def window_token_budget(model: str, output_tokens: int) -> int:
+    """Prompt tokens one window may use: the context window minus a page of output and a margin"""
+    window = context_window(model)
+    if window is None:
+        raise ValueError(f"Context window of {model} is unknown; add it to LLM_MODELS to use long-context mode")
+    return min(window - output_tokens - settings.long_context_margin_tokens, settings.long_context_max_window_tokens)
+
+
+class PaginatedPrompt:
+    """A prompt whose entities are collected page by page through continuation calls.
+
+    Wraps a CompiledPrompt and exposes the same attributes, so the pipeline passes
+    it around unchanged; LLMService.annotate_text recognizes it and pages.
+    """
+
+    def __init__(self, base: CompiledPrompt):
+        self.base = base
+        self.tags = base.tags
+        self.tag_names = base.tag_names
+        self.tag_set_hash = base.tag_set_hash
+        self.system_prompt = base.system_prompt
+
+    def __len__(self) -> int:
+        return len(self.tags)
+
+    def user_prompt(self, text: str) -> str:
+        return self.page(0).user_prompt(text)
+
+    def page(self, page_size: int, returned: Optional[List[Dict[str, Any]]] = None) -> "PagePrompt":
+        return PagePrompt(self.system_prompt, page_size, returned or [])
+
+
+class PagePrompt:
+    """One request of a paginated window: the page size and where the previous page stopped"""
+
+    def __init__(self, system_prompt: str, page_size: int, returned: List[Dict[str, Any]]):
+        self.system_prompt = system_prompt
+        self.page_size = page_size
+        self.returned = returned
+
+    def user_prompt(self, text: str) -> str:
+        continuation = ""
+        if self.returned:
+            last = self.returned[-1]
+            continuation = _CONTINUATION_TEMPLATE.format(
+                count=len(self.returned),
+                last=json.dumps({key: last.get(key) for key in ("text", "label", "start_char", "end_char")},
+                                ensure_ascii=False)
+            )
+        return _PAGE_TEMPLATE.format(text=text, page_size=self.page_size or "all", continuation=continuation)
+
+
+def paginate(prompt: Any) -> Any:
+    """Wrap a prompt, or each shard of a sharded one, for paginated output"""
+    if isinstance(prompt, PaginatedPrompt):
+        return prompt
+    if hasattr(prompt, "shards"):
+        return type(prompt)([PaginatedPrompt(shard) for shard in prompt.shards])
+    return PaginatedPrompt(prompt)
@@ -0,0 +1,253 @@
+from typing import Dict, List, Any, Optional, Tuple
+from bisect import bisect_right
+from collections import OrderedDict
+import hashlib
+import re
+import threading
+import numpy as np
+
+from app.config import settings
+from app.services.caching import LRUCache
+from app.services.incremental import diff_equal_regions
+from app.services.span_resolver import SpanResolver
+
+
+_WORD_PATTERN = re.compile(r"\w+")
+_MERSENNE_PRIME = np.uint64((1 << 31) - 1)
+
+
+def _permutations(num_perm: int) -> Tuple[np.ndarray, np.ndarray]:
+    # Fixed seed: signatures must stay comparable across processes and restarts
+    rng = np.random.RandomState(1)
+    a = rng.randint(1, (1 << 31) - 1, size=num_perm).astype(np.uint64)
+    b = rng.randint(0, (1 << 31) - 1, size=num_perm).astype(np.uint64)
+    return a, b
+
+
+def shingles(text: str, size: int = 5) -> List[str]:
+    """Lower-cased word n-grams; texts shorter than one n-gram give a single shingle"""
+    words = [word.lower() for word in _WORD_PATTERN.findall(text)]
+    if len(words) <= size:
+        return [" ".join(words)] if words else []
+    return [" ".join(words[i:i + size]) for i in range(len(words) - size + 1)]
+
+
+def minhash_signature(text: str, num_perm: int, shingle_size: int = 5) -> np.ndarray:
+    """MinHash signature over the text's word shingles"""
+    a, b = _permutations(num_perm)
+    pieces = shingles(text, shingle_size)
+    if not pieces:
+        return np.full(num_perm, _MERSENNE_PRIME, dtype=np.uint64)
+
+    hashes = np.fromiter(
+        (int.from_bytes(hashlib.blake2b(piece.encode("utf-8"), digest_size=4).digest(), "little") for piece in set(pieces)),
+        dtype=np.uint64
+    )
+    # 31-bit a and 32-bit hashes keep a * h + b inside uint64
+    return ((a[:, None] * hashes[None, :] + b[:, None]) % _MERSENNE_PRIME).min(axis=1)
+
+
+def realign_entities(
+    old_text: str,
+    new_text: str,
+    entities: List[Dict[str, Any]]
+) -> List[Dict[str, Any]]:
+    """Move entities annotated on old_text onto new_text.
+
+    Entities inside an unchanged region are shifted with it; the others are looked
+    up by their text nearest to where they would have moved, and dropped if gone.
+    """
+    regions = diff_equal_regions(old_text, new_text)
+    region_starts = [old_start for old_start, _, _ in regions]
+
+    aligned = []
+    pending: List[Tuple[Dict[str, Any], str, int]] = []
+    for entity in entities:
+        start, end = entity["start_char"], entity["end_char"]
+        i = bisect_right(region_starts, start) - 1
+        if i >= 0:
+            old_start, new_start, length = regions[i]
+            if end <= old_start + length:
+                shift = new_start - old_start
+                aligned.append({**entity, "start_char": start + shift, "end_char": end + shift})
+                continue
+            hint = start + new_start - old_start
+        else:
+            hint = start
+        pending.append((entity, entity.get("text") or old_text[start:end], hint))
+
+    if pending:
+        occurrences = SpanResolver(span for _, span, _ in pending).find_all(new_text)
+        for entity, span, hint in pending:
+            position = SpanResolver.nearest(occurrences.get(span, []), hint)
+            if position is not None:
+                aligned.append({**entity, "start_char": position, "end_char": position + len(span)})
+    return aligned
+
+
+def chunk_relative_entities(entities: List[Dict[str, Any]], start: int, end: int) -> List[Dict[str, Any]]:
+    """Entities lying wholly in [start, end], with offsets relative to start, as the index stores them.
+
+    Entities without a label cannot be replayed as annotations and are left out.
+    """
+    return [
+        {
+            "start_char": entity["start_char"] - start,
+            "end_char": entity["end_char"] - start,
+            "text": entity.get("text", ""),
+            "label": entity["label"]
+        }
+        for entity in entities
+        if entity.get("label") and start <= entity["start_char"] and entity["end_char"] <= end
+    ]
+
+
+class NearDuplicateEntry:
+    """An annotated chunk kept for reuse: its text, chunk-relative entities and what it cost"""
+
+    __slots__ = ("text", "entities", "input_tokens", "output_tokens", "signature")
+
+    def __init__(
+        self,
+        text: str,
+        entities: List[Dict[str, Any]],
+        input_tokens: int,
+        output_tokens: int,
+        signature: np.ndarray
+    ):
+        self.text = text
+        self.entities = entities
+        self.input_tokens = input_tokens
+        self.output_tokens = output_tokens
+        self.signature = signature
+
+
+class NearDuplicateIndex:
+    """MinHash/LSH index over the annotated chunks of one user and tag set.
+
+    Signatures are split into bands; chunks sharing any band are candidates, and a
+    candidate is a match when its estimated Jaccard similarity reaches the threshold.
+    The oldest chunks are evicted once max_chunks is exceeded.
+    """
+
+    def __init__(
+        self,
+        num_perm: int = 64,
+        bands: int = 16,
+        threshold: float = 0.85,
+        max_chunks: int = 5000
+    ):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.max_chunks = max_chunks
+
+        self._entries: "OrderedDict[int, NearDuplicateEntry]" = OrderedDict()
+        self._buckets: Dict[Tuple[int, bytes], List[int]] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+        self.lookups = 0
+        self.hits = 0
+        self.tokens_saved = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _band_keys(self, signature: np.ndarray) -> List[Tuple[int, bytes]]:
+        return [
+            (band, signature[band * self.rows:(band + 1) * self.rows].tobytes())
+            for band in range(self.bands)
+        ]
+
+    def add(
+        self,
+        text: str,
+        entities: List[Dict[str, Any]],
+        input_tokens: int = 0,
+        output_tokens: int = 0
+    ):
+        """Index an annotated chunk; entities use offsets relative to the chunk"""
+        signature = minhash_signature(text, self.num_perm)
+        entry = NearDuplicateEntry(text, entities, input_tokens, output_tokens, signature)
+
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = entry
+            for key in self._band_keys(signature):
+                self._buckets.setdefault(key, []).append(entry_id)
+
+            while len(self._entries) > self.max_chunks:
+                old_id, old_entry = self._entries.popitem(last=False)
+                for key in self._band_keys(old_entry.signature):
+                    bucket = self._buckets.get(key)
+                    if bucket is not None:
+                        bucket.remove(old_id)
+                        if not bucket:
+                            del self._buckets[key]
+
+    def lookup(self, text: str) -> Optional[Tuple[NearDuplicateEntry, float]]:
+        """Most similar indexed chunk at or above the threshold, with its similarity"""
+        signature = minhash_signature(text, self.num_perm)
+
+        with self._lock:
+            self.lookups += 1
+            candidates = set()
+            for key in self._band_keys(signature):
+                candidates.update(self._buckets.get(key, ()))
+
+            best, best_similarity = None, self.threshold
+            for entry_id in candidates:
+                entry = self._entries[entry_id]
+                # Very different lengths cannot be near-duplicates whatever the shingles say
+                if min(len(entry.text), len(text)) < self.threshold * max(len(entry.text), len(text)):
+                    continue
+                similarity = float(np.mean(entry.signature == signature))
+                if similarity >= best_similarity:
+                    best, best_similarity = entry, similarity
+
+        return None if best is None else (best, best_similarity)
+
+    def reuse(self, text: str) -> Optional[Dict[str, Any]]:
+        """Entities for a near-duplicate of text, re-aligned to it, or None on a miss"""
+        match = self.lookup(text)
+        if match is None:
+            return None
+
+        entry, similarity = match
+        entities = entry.entities if entry.text == text else realign_entities(entry.text, text, entry.entities)
+        tokens_saved = entry.input_tokens + entry.output_tokens
+        with self._lock:
+            self.hits += 1
+            self.tokens_saved += tokens_saved
+        return {"entities": entities, "similarity": similarity, "tokens_saved": tokens_saved}
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "indexed_chunks": len(self._entries),
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+            "tokens_saved": self.tokens_saved
+        }
+
+
+_indexes = LRUCache(maxsize=settings.near_duplicate_index_cache_size)
+
+
+def get_near_duplicate_index(user_id: str, tag_set_hash: str, model: str, temperature: float) -> NearDuplicateIndex:
+    """Shared near-duplicate index for a user's tag set, model and temperature.
+
+    Entities are only reused for the configuration that produced them, so a
+    request for another model or temperature never receives their output.
+    """
+    return _indexes.get_or_create((user_id, tag_set_hash, model, float(temperature)), lambda: NearDuplicateIndex(
+        num_perm=settings.near_duplicate_permutations,
+        bands=settings.near_duplicate_bands,
+        threshold=settings.near_duplicate_threshold,
+        max_chunks=settings.near_duplicate_max_chunks
+    ))
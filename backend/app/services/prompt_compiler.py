@@ -0,0 +1,141 @@
+from typing import Dict, List, Any, Iterable, Optional, Tuple
+import hashlib
+import json
+
+from app.services.caching import LRUCache
+
+
+_SYSTEM_TEMPLATE = """You are a scientific named entity recognition (NER) expert. Extract entities that match the SEMANTIC MEANING of tag definitions, not the literal tag labels themselves.
+
+STRICT RULES:
+• Extract concrete examples of the categories, not the category names themselves
+• Return valid JSON array format only
+• Each entity must have: start_char, end_char, text, label
+• Positions must be accurate character indices
+• Only annotate text that clearly belongs to one of the defined categories
+
+TAG DEFINITIONS:
+{tag_section}{few_shot_section}
+
+Return JSON array format:
+{{"annotations": [{{"start_char": 0, "end_char": 10, "text": "example", "label": "TAG_NAME"}}]}}"""
+
+_USER_TEMPLATE = """TARGET TEXT:
+{text}
+
+Extract all entities that match the tag definitions. Return only valid JSON."""
+
+_EVALUATION_SYSTEM_TEMPLATE = """You are an annotation quality reviewer. Evaluate annotations against the tag definitions below. For each annotation, decide whether it is correct, needs a different label, or should be deleted.
+
+TAG DEFINITIONS:
+{tag_section}
+Verdicts:
+- CORRECT: the annotation matches the tag definition
+- CHANGE_LABEL: the text belongs to a different tag; give it as suggested_label
+- DELETE: the text matches none of the tags
+
+Return only valid JSON, one object per annotation, using the annotation numbers you are given:
+{{"evaluations": [{{"index": 1, "verdict": "CORRECT", "suggested_label": null, "confidence": 0.9, "reasoning": "short justification"}}]}}"""
+
+_EVALUATION_TEMPLATE = """ANNOTATIONS TO EVALUATE:
+{annotations_text}
+Return a verdict for every numbered annotation."""
+
+
+_USER_PREFIX, _USER_SUFFIX = _USER_TEMPLATE.split("{text}")
+
+
+def user_prompt(text: str) -> str:
+    """User message wrapping the text to annotate (the same for every tag set)"""
+    return _USER_PREFIX + text + _USER_SUFFIX
+
+
+def _normalize_tags(tag_definitions: Any) -> Tuple[Tuple[str, str, str], ...]:
+    """Tag definitions as (tag_name, definition, examples) string triples"""
+    if hasattr(tag_definitions, "to_dict"):
+        # DataFrames are only converted here, once per compile
+        tag_definitions = tag_definitions.to_dict("records")
+    return tuple(
+        (str(tag.get("tag_name", "")), str(tag.get("definition", "")), str(tag.get("examples", "")))
+        for tag in tag_definitions
+    )
+
+
+def _normalize_few_shot(few_shot_examples: Optional[Iterable[Dict[str, Any]]]) -> Tuple[Tuple[str, str], ...]:
+    if not few_shot_examples:
+        return ()
+    return tuple((str(example["text"]), str(example["output"])) for example in few_shot_examples)
+
+
+def tag_set_hash(tag_definitions: Any) -> str:
+    """Content hash of a tag set (names, definitions and examples, in order)"""
+    return _hash_key(_normalize_tags(tag_definitions), ())
+
+
+def _hash_key(tags: Tuple[Tuple[str, str, str], ...], few_shot: Tuple[Tuple[str, str], ...]) -> str:
+    payload = json.dumps([tags, few_shot], ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class CompiledPrompt:
+    """Immutable prompt pieces for one tag set, rendered once and shared across chunks and requests"""
+
+    __slots__ = (
+        "tag_set_hash", "tags", "tag_names", "tag_section", "few_shot_section", "system_prompt"
+    )
+
+    def __init__(self, tags: Tuple[Tuple[str, str, str], ...], few_shot: Tuple[Tuple[str, str], ...]):
+        set_ = object.__setattr__
+        set_(self, "tag_set_hash", _hash_key(tags, few_shot))
+        set_(self, "tags", tags)
+        set_(self, "tag_names", tuple(name for name, _, _ in tags))
+        set_(self, "tag_section", "\n".join(
+            f"TAG: {name}\nDefinition: {definition}\nExamples: {examples}\n"
+            for name, definition, examples in tags
+        ))
+
+        few_shot_section = ""
+        if few_shot:
+            few_shot_section = "\nFEW-SHOT EXAMPLES:\n" + "".join(
+                f"\nExample {i}:\nText: \"{text}\"\nOutput: {output}\n"
+                for i, (text, output) in enumerate(few_shot[:3], 1)
+            )
+        set_(self, "few_shot_section", few_shot_section)
+        set_(self, "system_prompt", _SYSTEM_TEMPLATE.format(
+            tag_section=self.tag_section, few_shot_section=few_shot_section
+        ))
+
+    def __setattr__(self, name: str, value: Any):
+        raise AttributeError("CompiledPrompt is immutable")
+
+    def user_prompt(self, text: str) -> str:
+        return user_prompt(text)
+
+    @property
+    def evaluation_system_prompt(self) -> str:
+        return _EVALUATION_SYSTEM_TEMPLATE.format(tag_section=self.tag_section)
+
+    def evaluation_prompt(self, annotations: List[Dict[str, Any]]) -> str:
+        """User message listing annotations numbered from 1, as the verdicts refer to them"""
+        annotations_text = "".join(
+            f"{i+1}. Text: '{ann.get('text', '')}' | Label: {ann.get('label', '')} | Position: [{ann.get('start_char', 0)}:{ann.get('end_char', 0)}]\n"
+            for i, ann in enumerate(annotations)
+        )
+        return _EVALUATION_TEMPLATE.format(annotations_text=annotations_text)
+
+
+_compiled_prompts = LRUCache(maxsize=256)
+
+
+def compile_prompt(
+    tag_definitions: Any,
+    few_shot_examples: Optional[Iterable[Dict[str, Any]]] = None
+) -> CompiledPrompt:
+    """Compiled prompt for a tag set, cached by its content hash"""
+    if isinstance(tag_definitions, CompiledPrompt) or hasattr(tag_definitions, "system_prompt"):
+        # Compiled prompts and their wrappers (pages of a long-context window) pass through
+        return tag_definitions
+
+    tags = _normalize_tags(tag_definitions)
+    few_shot = _normalize_few_shot(few_shot_examples)
+    return _compiled_prompts.get_or_create(_hash_key(tags, few_shot), lambda: CompiledPrompt(tags, few_shot))
@@ -0,0 +1,167 @@
+from typing import Dict, Any, Awaitable, Callable, Hashable, Optional, Tuple
+from datetime import datetime, timedelta
+import asyncio
+import hashlib
+import json
+import weakref
+
+from app.config import settings
+from app.services.caching import LRUCache
+from app.services.cancellation import CancellationToken
+
+
+class IdempotencyConflict(Exception):
+    """An idempotency key reused for a request with different content"""
+
+
+def request_fingerprint(user_id: str, scope: str, payload: Dict[str, Any]) -> str:
+    """Hash of who asked for what: the user, the endpoint and its canonical JSON parameters"""
+    body = json.dumps([user_id, scope, payload], sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha256(body.encode("utf-8")).hexdigest()
+
+
+class SingleFlight:
+    """Runs one computation per key at a time; callers asking for a running key await the same result.
+
+    The shared task is shielded, so a caller that goes away does not cancel the
+    work the other callers are waiting on. Tasks belong to one event loop, so the
+    in-flight table is kept per running loop.
+    """
+
+    def __init__(self):
+        self._flights: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Hashable, asyncio.Task]]" = \
+            weakref.WeakKeyDictionary()
+
+    def _table(self) -> Dict[Hashable, asyncio.Task]:
+        loop = asyncio.get_running_loop()
+        table = self._flights.get(loop)
+        if table is None:
+            table = self._flights[loop] = {}
+        return table
+
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self._table()
+
+    async def run(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """(result, shared): shared is True when this call joined a computation already running"""
+        table = self._table()
+        task = table.get(key)
+        shared = task is not None
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            table[key] = task
+            task.add_done_callback(lambda _: table.pop(key, None) if table.get(key) is task else None)
+        return await asyncio.shield(task), shared
+
+
+class IdempotencyStore:
+    """Responses per (user, scope, idempotency key): in-process LRU in front of the idempotency_keys table.
+
+    Only successful responses are kept, so a retry after a failure runs again.
+    """
+
+    _memory = LRUCache(maxsize=settings.idempotency_cache_size, ttl=settings.idempotency_ttl_seconds)
+
+    def __init__(self, db: Any = None):
+        self.db = db
+
+    def get(self, user_id: str, scope: str, key: str) -> Optional[Dict[str, Any]]:
+        """{"fingerprint", "response"} stored for the key, if it has not expired"""
+        entry = self._memory.get((user_id, scope, key))
+        if entry is not None or self.db is None:
+            return entry
+
+        try:
+            cutoff = (datetime.utcnow() - timedelta(seconds=settings.idempotency_ttl_seconds)).isoformat()
+            result = self.db.table("idempotency_keys").select("fingerprint,response") \
+                .eq("user_id", user_id).eq("scope", scope).eq("idempotency_key", key) \
+                .gt("created_at", cutoff).limit(1).execute()
+            if result.data:
+                entry = result.data[0]
+                self._memory.set((user_id, scope, key), entry)
+        except Exception as e:
+            print(f"⚠️  Failed to look up idempotency key: {e}")
+        return entry
+
+    def save(self, user_id: str, scope: str, key: str, fingerprint: str, response: Dict[str, Any]):
+        entry = {"fingerprint": fingerprint, "response": response}
+        self._memory.set((user_id, scope, key), entry)
+        if self.db is None:
+            return
+
+        try:
+            self.db.table("idempotency_keys").upsert({
+                "user_id": user_id,
+                "scope": scope,
+                "idempotency_key": key,
+                "fingerprint": fingerprint,
+                "response": response,
+                "created_at": datetime.utcnow().isoformat()
+            }, on_conflict="user_id,scope,idempotency_key").execute()
+        except Exception as e:
+            print(f"⚠️  Failed to save idempotent response: {e}")
+
+
+_flights = SingleFlight()
+# Idempotency keys of requests still running, mapped to their fingerprints
+_pending_keys: Dict[Tuple[str, str, str], str] = {}
+# Cancellation token of the request that started each flight
+_flight_tokens: Dict[Tuple[str, str], CancellationToken] = {}
+
+
+async def coalesce(
+    user_id: str,
+    scope: str,
+    payload: Dict[str, Any],
+    compute: Callable[[], Awaitable[Dict[str, Any]]],
+    idempotency_key: Optional[str] = None,
+    store: Optional[IdempotencyStore] = None,
+    cancellation: Optional[CancellationToken] = None,
+    replayable: Callable[[Dict[str, Any]], bool] = lambda response: True
+) -> Dict[str, Any]:
+    """Run compute once for identical concurrent requests, and once ever per idempotency key.
+
+    Requests with the same fingerprint (user, scope, payload) that arrive while one
+    is running attach to it. With an idempotency key, a finished response is
+    replayed for retries; reusing the key for different content raises
+    IdempotencyConflict.
+
+    cancellation is the token compute was built with. An attaching request adds
+    its own to the running one, so shared work stops only when every waiter has
+    gone. Responses failing `replayable` (cut short by a cancellation) are not
+    stored, so a retry with the same key runs again.
+    """
+    fingerprint = request_fingerprint(user_id, scope, payload)
+    store = store or IdempotencyStore()
+
+    if idempotency_key:
+        key = (user_id, scope, idempotency_key)
+        stored = store.get(user_id, scope, idempotency_key)
+        known = stored["fingerprint"] if stored else _pending_keys.get(key)
+        if known is not None and known != fingerprint:
+            raise IdempotencyConflict(f"Idempotency key {idempotency_key} was used for a different request")
+        if stored:
+            print(f"🔁 Replaying stored response for idempotency key {idempotency_key}")
+            return stored["response"]
+        _pending_keys[key] = fingerprint
+
+    flight = (scope, fingerprint)
+    if cancellation is not None:
+        if not _flights.in_flight(flight):
+            _flight_tokens[flight] = cancellation
+        elif flight in _flight_tokens:
+            _flight_tokens[flight].attach(cancellation)
+
+    try:
+        response, shared = await _flights.run(flight, compute)
+    finally:
+        if idempotency_key:
+            _pending_keys.pop((user_id, scope, idempotency_key), None)
+        if cancellation is not None and not _flights.in_flight(flight):
+            _flight_tokens.pop(flight, None)
+
+    if shared:
+        print(f"🔗 Joined an identical {scope} request already in flight")
+    if idempotency_key and replayable(response):
+        store.save(user_id, scope, idempotency_key, fingerprint, response)
+    return response
@@ -0,0 +1,73 @@
+from typing import Any, Callable, Dict
+import asyncio
+import contextvars
+import functools
+import weakref
+
+from app.config import settings
+
+
+class RequestLimiter:
+    """Caps the provider requests in flight across every request the process is serving.
+
+    asyncio semaphores belong to one event loop, so one is kept per running loop;
+    in the server that is a single semaphore shared by all requests.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = \
+            weakref.WeakKeyDictionary()
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.limit)
+            self._semaphores[loop] = semaphore
+        return semaphore
+
+    async def __aenter__(self):
+        await self._semaphore().acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._semaphore().release()
+
+    async def run(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """Run a blocking provider call in a worker thread while holding a slot.
+
+        The slot is released when the thread returns rather than when the caller
+        stops waiting, so calls abandoned by cancelled requests still count
+        against the limit while the provider is working on them.
+        """
+        semaphore = self._semaphore()
+        await semaphore.acquire()
+        try:
+            context = contextvars.copy_context()
+            future = asyncio.get_running_loop().run_in_executor(
+                None, functools.partial(context.run, func, *args, **kwargs)
+            )
+        except BaseException:
+            semaphore.release()
+            raise
+
+        def release(finished: asyncio.Future):
+            semaphore.release()
+            if not finished.cancelled():
+                finished.exception()  # Retrieved, so an abandoned call's error is not logged as unhandled
+
+        future.add_done_callback(release)
+        # Shielded: cancelling the caller must not detach the thread from its slot
+        return await asyncio.shield(future)
+
+
+_limiters: Dict[str, RequestLimiter] = {}
+
+
+def get_request_limiter(provider: str) -> RequestLimiter:
+    """Shared limiter for a provider ("openai" or "anthropic")"""
+    limiter = _limiters.get(provider)
+    if limiter is None:
+        limiter = _limiters.setdefault(provider, RequestLimiter(settings.llm_max_concurrent_requests))
+    return limiter
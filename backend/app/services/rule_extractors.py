@@ -0,0 +1,253 @@
+from typing import Dict, List, Any, Callable, Optional, Tuple
+import json
+import re
+
+try:
+    from re import _parser as _sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse as _sre_parse
+
+from app.config import settings
+from app.services.caching import LRUCache
+
+
+_ELEMENTS = set("""
+H He Li Be B C N O F Ne Na Mg Al Si P S Cl Ar K Ca Sc Ti V Cr Mn Fe Co Ni Cu Zn Ga Ge As Se Br Kr
+Rb Sr Y Zr Nb Mo Tc Ru Rh Pd Ag Cd In Sn Sb Te I Xe Cs Ba La Ce Pr Nd Pm Sm Eu Gd Tb Dy Ho Er Tm Yb
+Lu Hf Ta W Re Os Ir Pt Au Hg Tl Pb Bi Po At Rn Fr Ra Ac Th Pa U Np Pu Am Cm Bk Cf Es Fm Md No Lr
+""".split())
+
+# Two-letter symbols first so "Co" is not read as "C" followed by "o"
+_ELEMENT = "|".join(sorted(_ELEMENTS, key=len, reverse=True))
+_ELEMENT_TOKEN = re.compile(r"([A-Z][a-z]?)(\d*(?:\.\d+)?)")
+
+_UNITS = [
+    "wt%", "at%", "vol%", "mol%", "%",
+    "°C", "°F", "K",
+    "GPa", "MPa", "kPa", "Pa", "bar", "mbar", "atm", "Torr",
+    "nm", "µm", "μm", "mm", "cm", "km", "m", "Å",
+    "mg", "kg", "µg", "μg", "g", "t",
+    "mmol", "µmol", "μmol", "mol", "mM", "µM", "μM", "M",
+    "mL", "µL", "μL", "L",
+    "ms", "µs", "μs", "ns", "s", "min", "h",
+    "meV", "keV", "MeV", "eV", "mV", "kV", "V", "mA", "µA", "μA", "A",
+    "mW", "kW", "MW", "W", "kJ", "MJ", "J", "GHz", "MHz", "kHz", "Hz",
+    "kN", "N", "rpm", "ppm", "ppb"
+]
+
+_NUMBER = r"[-+−]?\d+(?:[.,]\d+)?(?:\s?(?:[eE][-+−]?\d+|[×x]\s?10\^?[-+−]?\d+))?"
+# Single-letter units only count when attached to the number ("3h", "300K"), so
+# "Figure 2 A" or "step 3 h" is not read as a quantity
+_LETTER_UNITS = [unit for unit in _UNITS if len(unit) == 1 and unit.isalpha()]
+# Longer units are tried first so "mm" is not read as "m"
+_UNIT = "|".join(
+    re.escape(unit) for unit in sorted(_UNITS, key=len, reverse=True) if unit not in _LETTER_UNITS
+)
+_LETTER_UNIT = "|".join(_LETTER_UNITS)
+
+
+def _is_formula(span: str) -> bool:
+    """Two or more element symbols, and either a count or mixed case (NaCl, GaN)"""
+    tokens = _ELEMENT_TOKEN.findall(span)
+    if len(tokens) < 2 or "".join(symbol + count for symbol, count in tokens) != span:
+        return False
+    if any(symbol not in _ELEMENTS for symbol, _ in tokens):
+        return False
+    return any(count for _, count in tokens) or any(c.islower() for c in span)
+
+
+# name -> (pattern, validator)
+BUILTIN_EXTRACTORS: Dict[str, Tuple[str, Optional[Callable[[str], bool]]]] = {
+    "quantity": (rf"(?<![\w.]){_NUMBER}(?:\s?(?:{_UNIT})|(?:{_LETTER_UNIT}))(?![\w])", None),
+    "chemical_formula": (rf"(?<![\w])(?:(?:{_ELEMENT})\d*(?:\.\d+)?){{2,}}(?![\w])", _is_formula),
+    "doi": (r"\b10\.\d{4,9}/[-._;()/:A-Za-z0-9]*[A-Za-z0-9/]", None),
+    "sample_id": (r"(?<![\w-])[A-Z]{1,4}[-_]\d{1,4}[A-Za-z]?(?![\w-])", None)
+}
+
+
+def _tag_name(tag: Dict[str, Any]) -> str:
+    return str(tag.get("tag_name", tag.get("name", "")))
+
+
+class RuleSet:
+    """Regex extractors attached to a tag set, combined into one pattern and run in one pass.
+
+    A tag opts in with an "extractors" list of built-in names (see BUILTIN_EXTRACTORS)
+    or {"pattern": ..., "flags": "i"} dicts (see _validate_pattern for what a user
+    pattern may contain). extract is CPU-bound; async callers run it in a thread.
+    Tags marked "rule_only" are found by their extractors alone and are left out of
+    the LLM prompt.
+    """
+
+    def __init__(self, rules: List[Tuple[str, str, int, Optional[Callable[[str], bool]]]], rule_only: List[str]):
+        self.rules = rules
+        self.rule_only = tuple(rule_only)
+        # Each rule is a named alternative, so match.lastgroup tells which rule matched
+        self.pattern = re.compile("|".join(
+            f"(?P<r{i}>(?{_flag_letters(flags)}:{pattern}))" if flags else f"(?P<r{i}>{pattern})"
+            for i, (_, pattern, flags, _) in enumerate(rules)
+        ))
+
+    @property
+    def labels(self) -> List[str]:
+        return sorted({label for label, _, _, _ in self.rules})
+
+    def extract(self, text: str) -> List[Dict[str, Any]]:
+        """Every rule match in the text as an entity (leftmost, then first-listed rule wins)"""
+        entities = []
+        for match in self.pattern.finditer(text):
+            label, _, _, validator = self.rules[int(match.lastgroup[1:])]
+            span = match.group()
+            if validator is not None and not validator(span):
+                continue
+            entities.append({
+                "start_char": match.start(),
+                "end_char": match.end(),
+                "text": span,
+                "label": label,
+                "confidence": 1.0,
+                "source": "rule"
+            })
+        return entities
+
+    def llm_tag_definitions(self, tag_definitions: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Tag definitions still sent to the LLM: everything not marked rule_only"""
+        return [tag for tag in tag_definitions if _tag_name(tag) not in self.rule_only]
+
+
+def _flag_letters(flags: int) -> str:
+    letters = ""
+    if flags & re.IGNORECASE:
+        letters += "i"
+    if flags & re.MULTILINE:
+        letters += "m"
+    return letters
+
+
+def _parse_flags(flags: str) -> int:
+    value = 0
+    for letter in flags or "":
+        if letter == "i":
+            value |= re.IGNORECASE
+        elif letter == "m":
+            value |= re.MULTILINE
+        else:
+            raise ValueError(f"Unsupported extractor flag: {letter}")
+    return value
+
+
+def _references_groups(parsed) -> bool:
+    """Whether a parsed pattern contains a backreference or a conditional on a group"""
+    for op, av in parsed:
+        if op in (_sre_parse.GROUPREF, _sre_parse.GROUPREF_EXISTS):
+            return True
+        for item in av if isinstance(av, (tuple, list)) else (av,):
+            if isinstance(item, _sre_parse.SubPattern) and _references_groups(item):
+                return True
+            if isinstance(item, list) and any(
+                isinstance(branch, _sre_parse.SubPattern) and _references_groups(branch) for branch in item
+            ):
+                return True
+    return False
+
+
+_REPEATS = tuple(
+    op for op in (
+        _sre_parse.MAX_REPEAT, _sre_parse.MIN_REPEAT, getattr(_sre_parse, "POSSESSIVE_REPEAT", None)
+    ) if op is not None
+)
+
+
+def _nested_repeat(parsed, repeated: bool = False) -> bool:
+    """Whether a repeat sits inside another repeat, as in (a+)+ or (?:\w*,)*: the
+    shape that backtracks exponentially on near-miss input"""
+    for op, av in parsed:
+        if op in _REPEATS:
+            _, high, body = av
+            if high > 1:
+                if repeated:
+                    return True
+                if _nested_repeat(body, True):
+                    return True
+                continue
+            if _nested_repeat(body, repeated):
+                return True
+            continue
+        for item in av if isinstance(av, (tuple, list)) else (av,):
+            if isinstance(item, _sre_parse.SubPattern) and _nested_repeat(item, repeated):
+                return True
+            if isinstance(item, list) and any(
+                isinstance(branch, _sre_parse.SubPattern) and _nested_repeat(branch, repeated) for branch in item
+            ):
+                return True
+    return False
+
+
+def _validate_pattern(tag_name: str, pattern: str, flags: int):
+    """Reject patterns that cannot run as one alternative of the combined pattern.
+
+    Rules share one regex, so group names would collide between rules and group
+    numbers shift by the rules listed before; named groups and backreferences
+    are refused rather than silently matching something else. User patterns run
+    over whole documents, so overlong patterns, nested repeats (catastrophic
+    backtracking) and patterns that can match the empty string are refused too.
+    """
+    if len(pattern) > settings.extractor_max_pattern_length:
+        raise ValueError(
+            f"Extractor pattern on tag {tag_name} is longer than {settings.extractor_max_pattern_length} characters"
+        )
+    try:
+        compiled = re.compile(pattern, flags)
+        parsed = _sre_parse.parse(pattern, flags)
+    except re.error as e:
+        raise ValueError(f"Invalid extractor pattern on tag {tag_name}: {e}")
+    if compiled.groupindex:
+        raise ValueError(f"Extractor pattern on tag {tag_name} uses named groups; use (?:...) instead")
+    if _references_groups(parsed):
+        raise ValueError(f"Extractor pattern on tag {tag_name} uses backreferences, which are not supported")
+    if parsed.getwidth()[0] == 0:
+        raise ValueError(f"Extractor pattern on tag {tag_name} can match an empty string")
+    if _nested_repeat(parsed):
+        raise ValueError(f"Extractor pattern on tag {tag_name} nests repeats, which can backtrack for a very long time")
+
+
+def _build_rule_set(specs: List[Tuple[str, List[Any], bool]]) -> Optional[RuleSet]:
+    rules = []
+    rule_only = []
+    for tag_name, extractors, only in specs:
+        for extractor in extractors:
+            if isinstance(extractor, str):
+                if extractor not in BUILTIN_EXTRACTORS:
+                    raise ValueError(f"Unknown extractor '{extractor}' on tag {tag_name}")
+                pattern, validator = BUILTIN_EXTRACTORS[extractor]
+                rules.append((tag_name, pattern, 0, validator))
+            else:
+                pattern = extractor["pattern"]
+                flags = _parse_flags(extractor.get("flags", ""))
+                # Fail early with the tag's own pattern rather than the combined one
+                _validate_pattern(tag_name, pattern, flags)
+                rules.append((tag_name, pattern, flags, None))
+        if only and extractors:
+            rule_only.append(tag_name)
+    return RuleSet(rules, rule_only) if rules else None
+
+
+_rule_sets = LRUCache(maxsize=256)
+
+
+def compile_rules(tag_definitions: Any) -> Optional[RuleSet]:
+    """RuleSet for the extractors declared on a tag set, or None when there are none"""
+    if not isinstance(tag_definitions, list):
+        # DataFrames and compiled prompts carry no extractor declarations
+        return None
+
+    specs = [
+        (_tag_name(tag), list(tag.get("extractors") or []), bool(tag.get("rule_only", False)))
+        for tag in tag_definitions
+        if tag.get("extractors")
+    ]
+    if not specs:
+        return None
+
+    key = json.dumps(specs, sort_keys=True, ensure_ascii=False)
+    return _rule_sets.get_or_create(key, lambda: _build_rule_set(specs))
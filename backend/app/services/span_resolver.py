@@ -0,0 +1,190 @@
+from typing import Dict, List, Any, Iterable, Optional, Tuple
+from bisect import bisect_left
+
+from app.services.document_index import DocumentIndex, get_document_index
+
+
+class SpanResolver:
+    """Aho-Corasick automaton that locates many entity surface strings in one pass"""
+
+    def __init__(self, patterns: Iterable[str]):
+        self.patterns: List[str] = sorted({p for p in patterns if p})
+
+        # Trie transitions, failure links, the pattern ids that end in each state and
+        # those plus every id reachable through failure links
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._terminal: List[List[int]] = [[]]
+        self._output: List[List[int]] = [[]]
+
+        for pattern_id, pattern in enumerate(self.patterns):
+            self._add_pattern(pattern_id, pattern)
+        self._build_failure_links()
+
+    def add_patterns(self, patterns: Iterable[str]):
+        """Extend the automaton in place: new patterns go into the existing trie and only the links are redone"""
+        known = set(self.patterns)
+        added = False
+        for pattern in sorted({p for p in patterns if p} - known):
+            self.patterns.append(pattern)
+            self._add_pattern(len(self.patterns) - 1, pattern)
+            added = True
+        if added:
+            self._build_failure_links()
+
+    def _add_pattern(self, pattern_id: int, pattern: str):
+        state = 0
+        for char in pattern:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._terminal.append([])
+                self._output.append([])
+            state = next_state
+        self._terminal[state].append(pattern_id)
+
+    def _build_failure_links(self):
+        # Breadth-first so every failure target is finished before it is used
+        queue = list(self._goto[0].values())
+        for state in queue:
+            self._output[state] = self._terminal[state]
+        head = 0
+        while head < len(queue):
+            state = queue[head]
+            head += 1
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(char, 0)
+                self._fail[next_state] = target if target != next_state else 0
+                self._output[next_state] = self._terminal[next_state] + self._output[self._fail[next_state]]
+
+    def find_all(self, text: str, start: int = 0, end: Optional[int] = None) -> Dict[str, List[int]]:
+        """Return every (possibly overlapping) start position of every pattern in text[start:end]"""
+        if end is None:
+            end = len(text)
+
+        occurrences: Dict[str, List[int]] = {pattern: [] for pattern in self.patterns}
+        if not self.patterns:
+            return occurrences
+
+        goto = self._goto
+        fail = self._fail
+        output = self._output
+        patterns = self.patterns
+        state = 0
+
+        for pos in range(start, end):
+            char = text[pos]
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                for pattern_id in output[state]:
+                    pattern = patterns[pattern_id]
+                    occurrences[pattern].append(pos - len(pattern) + 1)
+
+        return occurrences
+
+    @staticmethod
+    def nearest(positions: List[int], hint: int) -> Optional[int]:
+        """Pick the occurrence closest to hint from a sorted position list (earlier wins ties)"""
+        if not positions:
+            return None
+
+        index = bisect_left(positions, hint)
+        if index == 0:
+            return positions[0]
+        if index == len(positions):
+            return positions[-1]
+
+        before = positions[index - 1]
+        after = positions[index]
+        return before if hint - before <= after - hint else after
+
+    @staticmethod
+    def whole_word_positions(positions: List[int], length: int, index: DocumentIndex) -> List[int]:
+        """Occurrences that do not cut a word in half, or all of them if none qualify"""
+        whole = [pos for pos in positions if not index.splits_word(pos, pos + length)]
+        return whole or positions
+
+
+def align_chunk_entities(
+    text: str,
+    entities: List[Dict[str, Any]],
+    chunk_start: int,
+    chunk_end: int,
+    margin: int = 100,
+    index: Optional[DocumentIndex] = None
+) -> Tuple[List[Dict[str, Any]], Dict[str, int]]:
+    """Move chunk-relative entities to document offsets, searching only around the chunk.
+
+    index is the text's DocumentIndex; callers aligning many chunks of one document
+    pass it in, since looking it up hashes the whole text.
+
+    Each aligned entity is tagged with how it was resolved: "exact" when the offsets
+    reported for the chunk were right, "shifted" when its text was found elsewhere
+    inside the chunk and "relocated" when it was only found in the margin around it.
+    Entities whose text does not occur in the window are dropped.
+    """
+    stats = {"exact": 0, "shifted": 0, "relocated": 0, "unaligned": 0}
+    aligned: List[Dict[str, Any]] = []
+    pending: List[Tuple[Dict[str, Any], int]] = []
+
+    for entity in entities:
+        if "start_char" not in entity or "end_char" not in entity:
+            continue
+
+        expected_text = entity.get("text", "")
+        try:
+            # Models sometimes report offsets as floats ("12.0") or numeric strings
+            start = int(entity["start_char"]) + chunk_start
+            end = int(entity["end_char"]) + chunk_start
+        except (TypeError, ValueError, OverflowError):
+            stats["unaligned"] += 1
+            continue
+
+        if 0 <= start < end <= len(text) and text[start:end] == expected_text:
+            entity["start_char"] = start
+            entity["end_char"] = end
+            entity["alignment"] = "exact"
+            aligned.append(entity)
+            stats["exact"] += 1
+        elif isinstance(expected_text, str) and expected_text:
+            pending.append((entity, start))
+        else:
+            stats["unaligned"] += 1
+
+    if pending:
+        window_start = max(0, chunk_start - margin)
+        window_end = min(len(text), chunk_end + margin)
+        occurrences = SpanResolver(entity["text"] for entity, _ in pending).find_all(
+            text, window_start, window_end
+        )
+        if index is None:
+            index = get_document_index(text)
+
+        for entity, hint in pending:
+            positions = SpanResolver.whole_word_positions(
+                occurrences[entity["text"]], len(entity["text"]), index
+            )
+            pos = SpanResolver.nearest(positions, hint)
+            if pos is None:
+                stats["unaligned"] += 1
+                continue
+
+            entity["start_char"] = pos
+            entity["end_char"] = pos + len(entity["text"])
+            if chunk_start <= pos and entity["end_char"] <= chunk_end:
+                entity["alignment"] = "shifted"
+            else:
+                entity["alignment"] = "relocated"
+            aligned.append(entity)
+            stats[entity["alignment"]] += 1
+
+    return aligned, stats
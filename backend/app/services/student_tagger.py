@@ -0,0 +1,399 @@
+from typing import Dict, List, Any, Iterable, Optional, Tuple
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import numpy as np
+
+from app.config import settings
+from app.services.caching import LRUCache
+from app.services.prompt_compiler import tag_set_hash
+
+
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+_SHAPE_RUNS = re.compile(r"(.)\1+")
+
+
+def tokenize(text: str, start: int = 0, end: Optional[int] = None) -> List[Tuple[int, int]]:
+    """Word and punctuation token spans of text[start:end], as absolute offsets"""
+    end = len(text) if end is None else end
+    return [(match.start(), match.end()) for match in _TOKEN_PATTERN.finditer(text, start, end)]
+
+
+def _shape(word: str) -> str:
+    shape = "".join("X" if c.isupper() else "x" if c.islower() else "d" if c.isdigit() else c for c in word)
+    return _SHAPE_RUNS.sub(r"\1", shape)
+
+
+def _sequence_features(words: List[str]) -> List[List[str]]:
+    """Sparse features of every token: the word, its affixes and shape, and its neighbours"""
+    lowered = [word.lower() for word in words]
+    shapes = [_shape(word) for word in words]
+    features = []
+    for i, word in enumerate(words):
+        lower = lowered[i]
+        previous = lowered[i - 1] if i > 0 else "<s>"
+        following = lowered[i + 1] if i + 1 < len(words) else "</s>"
+        token = [
+            "bias",
+            "w=" + lower,
+            "p3=" + lower[:3],
+            "s3=" + lower[-3:],
+            "s2=" + lower[-2:],
+            "shape=" + shapes[i],
+            "w-1=" + previous,
+            "w+1=" + following,
+            "shape-1=" + (shapes[i - 1] if i > 0 else "<s>"),
+            "shape+1=" + (shapes[i + 1] if i + 1 < len(words) else "</s>"),
+            "w-1|w=" + previous + "|" + lower
+        ]
+        if word[:1].isupper():
+            token.append("title")
+        if any(c.isdigit() for c in word):
+            token.append("digit")
+        features.append(token)
+    return features
+
+
+class StudentTagger:
+    """Averaged-perceptron BIO sequence tagger with first-order transitions and Viterbi decoding.
+
+    Trained on annotations the LLM produced and users kept, it tags a chunk on the
+    CPU in milliseconds. Forward-backward over the same scores gives per-token
+    marginals, whose minimum over a chunk is the chunk's confidence.
+    """
+
+    def __init__(self, labels: Iterable[str]):
+        self.labels = sorted(set(labels))
+        self.tags = ["O"] + [f"{prefix}-{label}" for label in self.labels for prefix in ("B", "I")]
+        self._tag_ids = {tag: i for i, tag in enumerate(self.tags)}
+        size = len(self.tags)
+
+        self.weights: Dict[str, np.ndarray] = {}
+        # Sequences are treated as following an "O": chunks and training sentences
+        # both start mid-document, so there is no separate start state
+        self.transitions = np.zeros((size, size))
+        self.metrics: Dict[str, Any] = {}
+
+        # I-X may only follow B-X or I-X
+        self._allowed = np.zeros((size, size))
+        for j, tag in enumerate(self.tags):
+            if tag.startswith("I-"):
+                label = tag[2:]
+                for i in range(size):
+                    if self.tags[i][2:] != label:
+                        self._allowed[i, j] = -np.inf
+
+    # Decoding
+
+    def _emissions(self, features: List[List[str]]) -> np.ndarray:
+        scores = np.zeros((len(features), len(self.tags)))
+        for i, token in enumerate(features):
+            for feature in token:
+                weights = self.weights.get(feature)
+                if weights is not None:
+                    scores[i] += weights
+        return scores
+
+    def _viterbi(self, emissions: np.ndarray) -> List[int]:
+        transitions = self.transitions + self._allowed
+        score = transitions[0] + emissions[0]
+        backpointers = np.zeros(emissions.shape, dtype=np.int64)
+        for i in range(1, len(emissions)):
+            candidates = score[:, None] + transitions
+            backpointers[i] = candidates.argmax(axis=0)
+            score = candidates.max(axis=0) + emissions[i]
+        path = [int(score.argmax())]
+        for i in range(len(emissions) - 1, 0, -1):
+            path.append(int(backpointers[i, path[-1]]))
+        return path[::-1]
+
+    def _marginals(self, emissions: np.ndarray) -> np.ndarray:
+        """Per-token tag marginals, treating the perceptron scores as log-potentials"""
+        transitions = self.transitions + self._allowed
+        size = len(self.tags)
+        count = len(emissions)
+
+        def logsumexp(values: np.ndarray, axis: int) -> np.ndarray:
+            peak = values.max(axis=axis, keepdims=True)
+            peak = np.where(np.isfinite(peak), peak, 0.0)
+            return (peak + np.log(np.exp(values - peak).sum(axis=axis, keepdims=True))).squeeze(axis)
+
+        forward = np.zeros((count, size))
+        backward = np.zeros((count, size))
+        forward[0] = transitions[0] + emissions[0]
+        for i in range(1, count):
+            forward[i] = logsumexp(forward[i - 1][:, None] + transitions, axis=0) + emissions[i]
+        for i in range(count - 2, -1, -1):
+            backward[i] = logsumexp(transitions + (emissions[i + 1] + backward[i + 1])[None, :], axis=1)
+
+        joint = forward + backward
+        return np.exp(joint - logsumexp(joint, axis=1)[:, None])
+
+    def predict(self, text: str, start: int = 0, end: Optional[int] = None) -> Tuple[List[Dict[str, Any]], float]:
+        """Entities in text[start:end] at absolute offsets, and the tagger's confidence in the whole span"""
+        spans = tokenize(text, start, end)
+        if not spans or not self.weights:
+            return [], 1.0 if not spans else 0.0
+
+        emissions = self._emissions(_sequence_features([text[s:e] for s, e in spans]))
+        path = self._viterbi(emissions)
+        confidences = self._marginals(emissions)[np.arange(len(path)), path]
+
+        entities = []
+        current = None
+        for i, tag_id in enumerate(path + [0]):
+            tag = self.tags[tag_id]
+            if current is not None and not (tag.startswith("I-") and tag[2:] == current[0]):
+                label, first = current
+                entities.append({
+                    "start_char": spans[first][0],
+                    "end_char": spans[i - 1][1],
+                    "text": text[spans[first][0]:spans[i - 1][1]],
+                    "label": label,
+                    "confidence": round(float(confidences[first:i].mean()), 3),
+                    "source": "student"
+                })
+                current = None
+            if tag.startswith("B-"):
+                current = (tag[2:], i)
+        return entities, float(confidences.min())
+
+    # Training
+
+    def _gold_sequences(self, text: str, entities: List[Dict[str, Any]]) -> List[Tuple[List[List[str]], List[int]]]:
+        """BIO tag ids of a document, split into sentence-sized training sequences"""
+        spans = tokenize(text)
+        tags = [0] * len(spans)
+        starts = [s for s, _ in spans]
+        for entity in sorted(entities, key=lambda e: (e.get("start_char", 0), -e.get("end_char", 0))):
+            label = entity.get("label")
+            if label not in self.labels:
+                continue
+            first = np.searchsorted(starts, entity["start_char"])
+            last = first
+            while last < len(spans) and spans[last][1] <= entity["end_char"]:
+                last += 1
+            # Entities that do not line up with token boundaries, or overlap a tagged one, are skipped
+            if first == last or spans[first][0] != entity["start_char"] or spans[last - 1][1] != entity["end_char"]:
+                continue
+            if any(tags[first:last]):
+                continue
+            tags[first] = self._tag_ids[f"B-{label}"]
+            for i in range(first + 1, last):
+                tags[i] = self._tag_ids[f"I-{label}"]
+
+        # Features see across sentence boundaries, as they do when a chunk is tagged
+        features = _sequence_features([text[s:e] for s, e in spans])
+        sequences = []
+        begin = 0
+        for i, (s, e) in enumerate(spans):
+            ends_sentence = text[s:e] in (".", "!", "?") and (i + 1 == len(spans) or tags[i + 1] == 0)
+            if ends_sentence or i + 1 == len(spans):
+                sequences.append((features[begin:i + 1], tags[begin:i + 1]))
+                begin = i + 1
+        return sequences
+
+    def train(
+        self,
+        documents: List[Tuple[str, List[Dict[str, Any]]]],
+        epochs: int = 5,
+        holdout: float = 0.0,
+        seed: int = 0
+    ) -> Dict[str, Any]:
+        """Fit on (text, entities) documents, optionally scoring entity F1 on a held-out share"""
+        documents = list(documents)
+        random.Random(seed).shuffle(documents)
+        held = documents[:int(len(documents) * holdout)] if holdout > 0 else []
+        sequences = [sequence for text, entities in documents[len(held):]
+                     for sequence in self._gold_sequences(text, entities)]
+
+        size = len(self.tags)
+        weights: Dict[str, np.ndarray] = {}
+        totals: Dict[str, np.ndarray] = {}
+        stamps: Dict[str, int] = {}
+        transition_totals = np.zeros_like(self.transitions)
+        transition_stamp = 0
+        step = 0
+
+        def update(feature: str, tag: int, delta: float):
+            if feature not in weights:
+                weights[feature] = np.zeros(size)
+                totals[feature] = np.zeros(size)
+                stamps[feature] = step
+            # Lazy averaging: credit the weights with the steps they stayed unchanged
+            totals[feature] += (step - stamps[feature]) * weights[feature]
+            stamps[feature] = step
+            weights[feature][tag] += delta
+
+        rng = random.Random(seed)
+        for _ in range(epochs):
+            rng.shuffle(sequences)
+            for features, gold in sequences:
+                step += 1
+                self.weights = weights
+                predicted = self._viterbi(self._emissions(features))
+                if predicted == gold:
+                    continue
+
+                transition_totals += (step - transition_stamp) * self.transitions
+                transition_stamp = step
+                previous_gold = previous_predicted = 0
+                for i, token in enumerate(features):
+                    if gold[i] != predicted[i]:
+                        for feature in token:
+                            update(feature, gold[i], 1.0)
+                            update(feature, predicted[i], -1.0)
+                    if (previous_gold, gold[i]) != (previous_predicted, predicted[i]):
+                        self.transitions[previous_gold, gold[i]] += 1.0
+                        self.transitions[previous_predicted, predicted[i]] -= 1.0
+                    previous_gold, previous_predicted = gold[i], predicted[i]
+
+        step = max(step, 1)
+        for feature in weights:
+            totals[feature] += (step - stamps[feature]) * weights[feature]
+        transition_totals += (step - transition_stamp) * self.transitions
+        self.weights = {feature: total / step for feature, total in totals.items() if total.any()}
+        self.transitions = transition_totals / step
+
+        self.metrics = {
+            "documents": len(documents) - len(held),
+            "sequences": len(sequences),
+            "features": len(self.weights),
+            "epochs": epochs,
+            **({"holdout": self.evaluate(held)} if held else {})
+        }
+        return self.metrics
+
+    def evaluate(self, documents: List[Tuple[str, List[Dict[str, Any]]]]) -> Dict[str, Any]:
+        """Exact-span entity precision, recall and F1 over labelled documents"""
+        true_positives = predicted_count = gold_count = 0
+        for text, entities in documents:
+            gold = {(e["start_char"], e["end_char"], e["label"]) for e in entities if e.get("label") in self.labels}
+            predicted = {(e["start_char"], e["end_char"], e["label"]) for e in self.predict(text)[0]}
+            true_positives += len(gold & predicted)
+            predicted_count += len(predicted)
+            gold_count += len(gold)
+        precision = true_positives / predicted_count if predicted_count else 0.0
+        recall = true_positives / gold_count if gold_count else 0.0
+        f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+        return {"documents": len(documents), "precision": precision, "recall": recall, "f1": f1}
+
+    # Persistence
+
+    def save(self, path: str):
+        """Write the model atomically, so readers only ever see a complete file"""
+        features = list(self.weights)
+        matrix = np.stack([self.weights[f] for f in features]) if features else np.zeros((0, len(self.tags)))
+        directory = os.path.dirname(path) or "."
+        os.makedirs(directory, exist_ok=True)
+        handle, temporary = tempfile.mkstemp(dir=directory, suffix=".npz")
+        with os.fdopen(handle, "wb") as output:
+            np.savez_compressed(
+                output,
+                features=np.array(features, dtype=str),
+                weights=matrix,
+                transitions=self.transitions,
+                meta=np.array(json.dumps({"labels": self.labels, "metrics": self.metrics}))
+            )
+        os.replace(temporary, path)
+
+    @classmethod
+    def load(cls, path: str) -> "StudentTagger":
+        # Plain arrays only: a model file is never unpickled
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data["meta"]))
+            tagger = cls(meta["labels"])
+            tagger.weights = dict(zip(data["features"].tolist(), data["weights"]))
+            tagger.transitions = data["transitions"]
+            tagger.metrics = meta.get("metrics", {})
+        return tagger
+
+
+def _labels_of(tag_definitions: List[Dict[str, Any]]) -> List[str]:
+    return [str(tag.get("tag_name", tag.get("name", ""))) for tag in tag_definitions]
+
+
+class StudentStore:
+    """Per (user, tag set) student models on disk, loaded into memory and hot-swapped when retrained"""
+
+    _models = LRUCache(maxsize=settings.student_cache_size)
+    _training_lock = threading.Lock()
+
+    def __init__(self, db: Any = None):
+        self.db = db
+
+    @staticmethod
+    def path(user_id: str, set_hash: str) -> str:
+        return os.path.join(settings.student_model_dir, f"{user_id}_{set_hash}.npz")
+
+    def get(self, user_id: str, tag_definitions: Any) -> Optional[StudentTagger]:
+        """Latest trained model for the tag set if it passed the F1 gate, else None.
+
+        The file's modification time is checked on every call, so a model retrained
+        by any worker replaces the cached one without a restart.
+        """
+        path = self.path(user_id, tag_set_hash(tag_definitions))
+        try:
+            modified = os.path.getmtime(path)
+        except OSError:
+            return None
+
+        cached = self._models.get(path)
+        if cached is None or cached[0] != modified:
+            try:
+                cached = (modified, StudentTagger.load(path))
+            except Exception as e:
+                print(f"⚠️  Failed to load student model {path}: {e}")
+                return None
+            self._models.set(path, cached)
+
+        tagger = cached[1]
+        f1 = tagger.metrics.get("holdout", {}).get("f1", 0.0)
+        return tagger if f1 >= settings.student_min_f1 else None
+
+    def training_documents(self, user_id: str, tag_definitions: Any) -> List[Tuple[str, List[Dict[str, Any]]]]:
+        """Stored annotations of the tag set, minus those a validation rejected"""
+        set_hash = tag_set_hash(tag_definitions)
+        annotations = self.db.table("annotations").select("id,text,entities,tag_definitions") \
+            .eq("user_id", user_id).execute().data or []
+        rejected = {
+            row["annotation_id"]
+            for row in self.db.table("annotation_validations").select("annotation_id,is_valid")
+                .eq("user_id", user_id).eq("is_valid", False).execute().data or []
+        }
+        return [
+            (annotation["text"], annotation.get("entities") or [])
+            for annotation in annotations
+            if annotation["id"] not in rejected
+            and annotation.get("text")
+            and tag_set_hash(annotation.get("tag_definitions") or []) == set_hash
+        ]
+
+    def train(
+        self,
+        user_id: str,
+        tag_definitions: Any,
+        documents: Optional[List[Tuple[str, List[Dict[str, Any]]]]] = None
+    ) -> Dict[str, Any]:
+        """Train a fresh model and swap it in; blocking, so run it off the event loop"""
+        if documents is None:
+            documents = self.training_documents(user_id, tag_definitions)
+        if len(documents) < settings.student_min_documents:
+            raise ValueError(
+                f"Need at least {settings.student_min_documents} annotated documents to train, found {len(documents)}"
+            )
+
+        with self._training_lock:
+            tagger = StudentTagger(_labels_of(tag_definitions))
+            metrics = tagger.train(documents, epochs=settings.student_epochs, holdout=settings.student_holdout)
+            path = self.path(user_id, tag_set_hash(tag_definitions))
+            tagger.save(path)
+            self._models.set(path, (os.path.getmtime(path), tagger))
+
+        f1 = metrics.get("holdout", {}).get("f1")
+        print(f"🎓 Trained student model on {metrics['documents']} documents"
+              + (f", held-out F1 {f1:.3f}" if f1 is not None else ""))
+        return metrics
@@ -0,0 +1,214 @@
+from typing import Dict, List, Any, Optional, Tuple
+import hashlib
+import math
+import re
+import numpy as np
+
+from app.services.caching import LRUCache
+from app.services.document_index import DocumentIndex
+from app.services.prompt_compiler import CompiledPrompt, compile_prompt, user_prompt
+from app.services.span_resolver import align_chunk_entities
+
+
+_WORD_PATTERN = re.compile(r"[A-Za-z]{3,}")
+_CAMEL_BOUNDARY = re.compile(r"(?<=[a-z])(?=[A-Z])")
+_STOPWORDS = {
+    "the", "and", "for", "with", "that", "this", "are", "from", "such", "any", "its", "into", "used",
+    "use", "which", "include", "includes", "including", "e.g", "etc", "other", "like", "not", "all",
+    "can", "may", "their", "they", "these", "those", "than", "has", "have", "been", "also", "example",
+    "examples", "entity", "entities", "term", "terms", "mention", "mentions", "name", "names", "refers"
+}
+
+
+def _tag_name(tag: Dict[str, Any]) -> str:
+    return str(tag.get("tag_name", tag.get("name", "")))
+
+
+def _tag_terms(tag: Dict[str, Any]) -> List[str]:
+    """Lower-cased content words of a tag, with the words of its name counted twice"""
+    name = _CAMEL_BOUNDARY.sub(" ", _tag_name(tag)).replace("_", " ").replace("-", " ")
+    body = f"{tag.get('definition', '')} {tag.get('examples', '')}"
+    words = _WORD_PATTERN.findall(name) * 2 + _WORD_PATTERN.findall(body)
+    # Crude plural folding, enough to pair "materials" with "material"
+    return [word.lower().rstrip("s") for word in words if word.lower() not in _STOPWORDS]
+
+
+def _tfidf(tags: List[Dict[str, Any]]) -> np.ndarray:
+    """Unit-length TF-IDF rows, one per tag"""
+    documents = [_tag_terms(tag) for tag in tags]
+    vocabulary = {term: i for i, term in enumerate(sorted({term for doc in documents for term in doc}))}
+    counts = np.zeros((len(tags), max(1, len(vocabulary))))
+    for row, doc in enumerate(documents):
+        for term in doc:
+            counts[row, vocabulary[term]] += 1
+    document_frequency = (counts > 0).sum(axis=0)
+    vectors = counts * np.log((1 + len(tags)) / (1 + document_frequency))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1.0)
+
+
+def _balanced_clusters(vectors: np.ndarray, count: int, iterations: int = 10) -> List[int]:
+    """Capacity-constrained k-means: cluster id per row, no cluster above ceil(n / count)"""
+    n = len(vectors)
+    capacity = math.ceil(n / count)
+
+    # Farthest-first seeds starting from the row least like the rest, for a deterministic result
+    similarity = vectors @ vectors.T
+    seeds = [int(similarity.sum(axis=1).argmin())]
+    while len(seeds) < count:
+        seeds.append(int(similarity[:, seeds].max(axis=1).argmin()))
+    centroids = vectors[seeds]
+
+    assignment = [-1] * n
+    for _ in range(iterations):
+        scores = vectors @ centroids.T
+        # Most confident (row, cluster) pairs are placed first, until clusters fill up
+        order = np.dstack(np.unravel_index(np.argsort(-scores, axis=None), scores.shape))[0]
+        new_assignment = [-1] * n
+        load = [0] * count
+        for row, cluster in order:
+            if new_assignment[row] == -1 and load[cluster] < capacity:
+                new_assignment[row] = int(cluster)
+                load[cluster] += 1
+        if new_assignment == assignment:
+            break
+        assignment = new_assignment
+        for cluster in range(count):
+            members = [row for row in range(n) if assignment[row] == cluster]
+            if members:
+                centroid = vectors[members].mean(axis=0)
+                norm = np.linalg.norm(centroid)
+                centroids[cluster] = centroid / norm if norm > 0 else centroid
+    return assignment
+
+
+def shard_tags(tag_definitions: List[Dict[str, Any]], max_tags: int) -> List[List[Dict[str, Any]]]:
+    """Split a tag set into shards of at most max_tags semantically related tags.
+
+    Tags that declare a "group" stay together with their group (groups larger than
+    max_tags are split, small ones packed together); the others are clustered by
+    the TF-IDF similarity of their names, definitions and examples. Tags keep their
+    original order inside each shard.
+    """
+    tags = list(tag_definitions)
+    if max_tags <= 0 or len(tags) <= max_tags:
+        return [tags]
+
+    grouped: Dict[str, List[int]] = {}
+    free = []
+    for position, tag in enumerate(tags):
+        if tag.get("group"):
+            grouped.setdefault(str(tag["group"]), []).append(position)
+        else:
+            free.append(position)
+
+    buckets: List[List[int]] = []
+    for members in grouped.values():
+        buckets.extend(members[i:i + max_tags] for i in range(0, len(members), max_tags))
+    if free:
+        count = math.ceil(len(free) / max_tags)
+        assignment = _balanced_clusters(_tfidf([tags[i] for i in free]), count) if count > 1 else [0] * len(free)
+        for cluster in range(count):
+            buckets.append([free[row] for row in range(len(free)) if assignment[row] == cluster])
+
+    # First-fit decreasing packs small buckets so no shard goes out nearly empty
+    shards: List[List[int]] = []
+    for bucket in sorted((b for b in buckets if b), key=len, reverse=True):
+        target = next((shard for shard in shards if len(shard) + len(bucket) <= max_tags), None)
+        if target is None:
+            shards.append(list(bucket))
+        else:
+            target.extend(bucket)
+    return [[tags[i] for i in sorted(shard)] for shard in sorted(shards, key=min)]
+
+
+class ShardedPrompt:
+    """A tag set split into shard prompts that are sent concurrently for the same text.
+
+    Stands in for a CompiledPrompt wherever the pipeline passes one around;
+    LLMService.annotate_text fans it out and merges the shard results.
+    """
+
+    def __init__(self, shards: List[CompiledPrompt]):
+        self.shards = tuple(shards)
+        self.tags = tuple(tag for shard in self.shards for tag in shard.tags)
+        self.tag_names = tuple(name for shard in self.shards for name in shard.tag_names)
+        layout = "|".join(shard.tag_set_hash for shard in self.shards)
+        self.tag_set_hash = hashlib.sha256(layout.encode("utf-8")).hexdigest()
+
+    def __len__(self) -> int:
+        return len(self.tags)
+
+    def user_prompt(self, text: str) -> str:
+        return user_prompt(text)
+
+
+_sharded_prompts = LRUCache(maxsize=64)
+
+
+def compile_sharded_prompt(tag_definitions: List[Dict[str, Any]], max_tags: Optional[int]) -> Any:
+    """ShardedPrompt when the tag set exceeds max_tags, else the ordinary CompiledPrompt"""
+    if not max_tags or not isinstance(tag_definitions, list) or len(tag_definitions) <= max_tags:
+        return compile_prompt(tag_definitions)
+
+    key = (compile_prompt(tag_definitions).tag_set_hash, max_tags)
+    return _sharded_prompts.get_or_create(key, lambda: ShardedPrompt([
+        compile_prompt(shard) for shard in shard_tags(tag_definitions, max_tags)
+    ]))
+
+
+def resolve_shard_conflicts(
+    shard_annotations: List[List[Dict[str, Any]]],
+    text: Optional[str] = None
+) -> Tuple[List[Dict[str, Any]], int]:
+    """Merge per-shard annotations, settling overlaps between different shards.
+
+    Overlapping spans from one shard are left alone (the shard meant them). When
+    spans from different shards overlap, the one with the higher self-reported
+    confidence wins, then the longer one, then the earlier shard.
+
+    With the annotated text, spans are compared where alignment will put them
+    (align_chunk_entities on copies) rather than at the model's raw offsets; the
+    annotations themselves are returned unchanged for the caller to align.
+    """
+    candidates = []
+    # Built here rather than taken from the shared cache: the text is one chunk, and
+    # caching every chunk would push whole-document indexes out of it
+    index = DocumentIndex(text) if text is not None else None
+    for shard, annotations in enumerate(shard_annotations):
+        annotations = [annotation for annotation in annotations if isinstance(annotation, dict)]
+        if text is not None:
+            copies = [dict(annotation) for annotation in annotations]
+            aligned, _ = align_chunk_entities(text, copies, 0, len(text), margin=0, index=index)
+            positions = {id(copy): (copy["start_char"], copy["end_char"]) for copy in aligned}
+            for annotation, copy in zip(annotations, copies):
+                start, end = positions.get(id(copy), (None, None))
+                candidates.append((start, end, shard, annotation))
+            continue
+        for annotation in annotations:
+            try:
+                start, end = int(annotation["start_char"]), int(annotation["end_char"])
+            except (KeyError, TypeError, ValueError):
+                candidates.append((None, None, shard, annotation))
+                continue
+            candidates.append((start, end, shard, annotation))
+
+    def rank(candidate) -> Tuple[float, int, int]:
+        start, end, shard, annotation = candidate
+        confidence = annotation.get("confidence")
+        confidence = confidence if isinstance(confidence, (int, float)) else 1.0
+        return (-confidence, -(end - start), shard)
+
+    kept: List[Tuple[int, int, int, Dict[str, Any]]] = []
+    conflicts = 0
+    # Unpositioned annotations cannot conflict here; alignment places or drops them later
+    merged = [annotation for start, _, _, annotation in candidates if start is None]
+    for candidate in sorted((c for c in candidates if c[0] is not None), key=rank):
+        start, end, shard, _ = candidate
+        if any(s < end and start < e and other != shard for s, e, other, _ in kept):
+            conflicts += 1
+            continue
+        kept.append(candidate)
+
+    merged.extend(annotation for _, _, _, annotation in sorted(kept, key=lambda c: (c[0], c[1])))
+    return merged, conflicts
@@ -0,0 +1,149 @@
+from typing import Dict, Optional
+from abc import ABC, abstractmethod
+import math
+import re
+import threading
+
+try:
+    import tiktoken
+except ImportError:  # Optional: exact counts for OpenAI models
+    tiktoken = None
+
+
+class Tokenizer(ABC):
+    """Counts tokens for one model family"""
+
+    name = "base"
+    is_exact = False
+
+    @abstractmethod
+    def count(self, text: str) -> int:
+        """Tokens the model would see for text"""
+
+    @property
+    def chars_per_token(self) -> float:
+        """Average characters per token seen so far, used to size budgets without text"""
+        return 4.0
+
+    def raw_count(self, text: str) -> float:
+        """Count before any calibration; the same as count for exact tokenizers"""
+        return float(self.count(text))
+
+    def count_raw(self, raw_tokens: float) -> int:
+        """Tokens for a raw_count under the current calibration"""
+        return int(math.ceil(raw_tokens))
+
+    def observe(self, raw_tokens: float, actual_tokens: int):
+        """Feed back a provider-reported token count for text whose raw_count was raw_tokens"""
+
+
+class TiktokenTokenizer(Tokenizer):
+    """Exact counts from the model's local BPE vocabulary"""
+
+    is_exact = True
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        self.name = f"tiktoken:{encoding.name}"
+        self._chars = 0
+        self._tokens = 0
+
+    def count(self, text: str) -> int:
+        tokens = len(self.encoding.encode(text, disallowed_special=()))
+        self._chars += len(text)
+        self._tokens += tokens
+        return tokens
+
+    @property
+    def chars_per_token(self) -> float:
+        if self._tokens < 500:
+            return 4.0
+        return self._chars / self._tokens
+
+
+class EstimatedTokenizer(Tokenizer):
+    """Heuristic BPE-like count, rescaled from provider-reported usage.
+
+    Words are charged by length, digit runs in groups of three and every symbol or
+    non-ASCII character separately, which tracks formula- and unit-heavy scientific
+    text far better than a flat characters-per-token ratio. The scale factor is a
+    moving average of actual / raw (unscaled) counts reported back through observe().
+    """
+
+    name = "estimate"
+
+    _PIECE_PATTERN = re.compile(r"[A-Za-z]+|[0-9]+|\n+|[ \t]+|[^\sA-Za-z0-9]")
+
+    def __init__(self, scale: float = 1.0, smoothing: float = 0.2):
+        self.scale = scale
+        self.smoothing = smoothing
+        self.observations = 0
+        self._lock = threading.Lock()
+
+    def raw_count(self, text: str) -> float:
+        count = 0.0
+        for piece in self._PIECE_PATTERN.findall(text):
+            first = piece[0]
+            if first.isalpha():
+                count += 1 + (len(piece) - 1) // 5
+            elif first.isdigit():
+                count += math.ceil(len(piece) / 3)
+            elif first == "\n":
+                count += 1
+            elif first in " \t":
+                # A single space is folded into the following word
+                count += 0 if len(piece) == 1 else 1
+            else:
+                count += 1
+        return count
+
+    def count(self, text: str) -> int:
+        return self.count_raw(self.raw_count(text))
+
+    def count_raw(self, raw_tokens: float) -> int:
+        return int(math.ceil(raw_tokens * self.scale))
+
+    @property
+    def chars_per_token(self) -> float:
+        return 4.0 / self.scale
+
+    def observe(self, raw_tokens: float, actual_tokens: int):
+        # Compared with the unscaled count, the same ratio observed again converges on
+        # that ratio instead of compounding into the scale
+        if raw_tokens <= 0 or actual_tokens <= 0:
+            return
+        ratio = min(4.0, max(0.25, actual_tokens / raw_tokens))
+        with self._lock:
+            self.scale += self.smoothing * (ratio - self.scale)
+            self.observations += 1
+
+
+_tokenizers: Dict[str, Tokenizer] = {}
+_tokenizers_lock = threading.Lock()
+
+
+def _load_tiktoken(model: str) -> Optional[Tokenizer]:
+    if tiktoken is None or not model.startswith("gpt"):
+        return None
+    try:
+        try:
+            encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            encoding = tiktoken.get_encoding("o200k_base" if model.startswith("gpt-4o") else "cl100k_base")
+        return TiktokenTokenizer(encoding)
+    except Exception as e:
+        # The vocabulary is fetched on first use; offline hosts fall back to the estimator
+        print(f"⚠️  tiktoken unavailable for {model}, using estimator: {e}")
+        return None
+
+
+def get_tokenizer(model: str) -> Tokenizer:
+    """Shared tokenizer for a model: exact when a local vocabulary exists, calibrated estimate otherwise"""
+    tokenizer = _tokenizers.get(model)
+    if tokenizer is None:
+        with _tokenizers_lock:
+            tokenizer = _tokenizers.get(model)
+            if tokenizer is None:
+                tokenizer = _load_tiktoken(model) or EstimatedTokenizer()
+                _tokenizers[model] = tokenizer
+    return tokenizer
@@ -0,0 +1,184 @@
+from typing import Any, Callable, Dict, Optional
+from abc import ABC, abstractmethod
+import asyncio
+import json
+import threading
+
+from app.config import settings
+from app.services.caching import LRUCache
+
+try:
+    import redis
+except ImportError:  # Optional: user cache shared by every worker
+    redis = None
+
+
+# Credentials never leave the users table, so a shared cache holds nothing worth stealing
+_PRIVATE_FIELDS = ("hashed_password", "email_verification_token", "email_verification_expires")
+
+
+class UserCacheBackend(ABC):
+    """Where cached user rows live, keyed by JWT subject"""
+
+    name = "base"
+    # Whether calls wait on the network, so async callers must not make them on the event loop
+    blocking = False
+
+    @abstractmethod
+    def get(self, subject: str) -> Optional[Dict[str, Any]]:
+        """The cached user row, or None on a miss"""
+
+    @abstractmethod
+    def set(self, subject: str, user: Dict[str, Any]):
+        """Cache a user row"""
+
+    @abstractmethod
+    def delete(self, subject: str):
+        """Drop a subject's cached row"""
+
+    def size(self) -> Optional[int]:
+        return None
+
+
+class MemoryUserCacheBackend(UserCacheBackend):
+    """Per-process LRU with a TTL; each worker keeps and invalidates its own copy"""
+
+    name = "memory"
+
+    def __init__(self, maxsize: int, ttl: float):
+        self._cache = LRUCache(maxsize=maxsize, ttl=ttl)
+
+    def get(self, subject):
+        user = self._cache.get(subject, count=False)
+        # A copy, so a handler changing its current_user leaves the cached row alone
+        return dict(user) if user is not None else None
+
+    def set(self, subject, user):
+        self._cache.set(subject, dict(user))
+
+    def delete(self, subject):
+        self._cache.pop(subject)
+
+    def size(self):
+        return len(self._cache)
+
+
+class RedisUserCacheBackend(UserCacheBackend):
+    """Redis keys with an expiry, so an invalidation in one worker reaches all of them.
+
+    Redis errors count as misses; authentication then falls back to the users table.
+    """
+
+    name = "redis"
+    blocking = True
+
+    def __init__(self, url: str, ttl: float, prefix: str = "user_cache:"):
+        if redis is None:
+            raise RuntimeError("user_cache_backend is 'redis' but the redis package is not installed")
+        self.client = redis.Redis.from_url(url)
+        self.ttl = max(1, int(ttl))
+        self.prefix = prefix
+
+    def get(self, subject):
+        try:
+            raw = self.client.get(self.prefix + subject)
+        except Exception as e:
+            print(f"⚠️  Failed to read user cache: {e}")
+            return None
+        return json.loads(raw) if raw else None
+
+    def set(self, subject, user):
+        try:
+            self.client.setex(self.prefix + subject, self.ttl, json.dumps(user, default=str))
+        except Exception as e:
+            print(f"⚠️  Failed to write user cache: {e}")
+
+    def delete(self, subject):
+        try:
+            self.client.delete(self.prefix + subject)
+        except Exception as e:
+            print(f"⚠️  Failed to invalidate user cache: {e}")
+
+
+class UserCache:
+    """Authenticated user rows by JWT subject, in front of the users table.
+
+    Only users that were found are cached, without their credential fields. Every
+    write the API makes to a user's row calls invalidate, so profile updates show
+    at once; changes made outside the API (e.g. setting is_active to false in the
+    database console) take effect after the TTL.
+    """
+
+    def __init__(self, backend: Optional[UserCacheBackend]):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, subject: str, load: Callable[[], Optional[Dict[str, Any]]]) -> Optional[Dict[str, Any]]:
+        """The cached user for subject, or load() on a miss (cached when it finds one)"""
+        user = self.backend.get(subject) if self.backend is not None else None
+        with self._lock:
+            if user is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if user is not None:
+            return user
+
+        user = load()
+        if user is None:
+            return None
+        user = {key: value for key, value in user.items() if key not in _PRIVATE_FIELDS}
+        if self.backend is not None:
+            self.backend.set(subject, user)
+        return user
+
+    def invalidate(self, subject: Optional[str]):
+        if subject and self.backend is not None:
+            self.backend.delete(subject)
+
+    async def get_async(
+        self, subject: str, load: Callable[[], Optional[Dict[str, Any]]]
+    ) -> Optional[Dict[str, Any]]:
+        """get for async callers; with a blocking backend it runs in a worker thread"""
+        if self.backend is not None and self.backend.blocking:
+            return await asyncio.to_thread(self.get, subject, load)
+        return self.get(subject, load)
+
+    async def invalidate_async(self, subject: Optional[str]):
+        """invalidate for async callers; with a blocking backend it runs in a worker thread"""
+        if self.backend is not None and self.backend.blocking:
+            await asyncio.to_thread(self.invalidate, subject)
+        else:
+            self.invalidate(subject)
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit ratio of this process's lookups; the backend size where it is known"""
+        lookups = self.hits + self.misses
+        return {
+            "backend": self.backend.name if self.backend is not None else "off",
+            "size": self.backend.size() if self.backend is not None else 0,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0
+        }
+
+
+_user_cache: Optional[UserCache] = None
+
+
+def get_user_cache() -> UserCache:
+    """Process-wide user cache built from settings.user_cache_backend ("memory", "redis" or "off")"""
+    global _user_cache
+    if _user_cache is None:
+        if settings.user_cache_backend == "memory":
+            backend = MemoryUserCacheBackend(settings.user_cache_size, settings.user_cache_ttl_seconds)
+        elif settings.user_cache_backend == "redis":
+            backend = RedisUserCacheBackend(settings.user_cache_redis_url, settings.user_cache_ttl_seconds)
+        elif settings.user_cache_backend == "off":
+            backend = None
+        else:
+            raise ValueError(f"Unsupported user cache backend: {settings.user_cache_backend}")
+        _user_cache = UserCache(backend)
+    return _user_cache
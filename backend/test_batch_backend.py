@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Test script for provider batch execution against the in-process FakeBatchAdapter
+"""
+
+import sys
+import json
+import time
+import asyncio
+from pathlib import Path
+
+# Add the current directory to Python path
+current_dir = Path(__file__).parent
+sys.path.insert(0, str(current_dir))
+
+from app.services.batch_backend import FakeBatchAdapter, run_batch
+from app.services.batch_jobs import BatchJobStore, cancel_batch_job, start_batch_job
+from app.services.file_processor import FileProcessor
+
+TAGSET = {"tags": [{"tag_name": "MATERIAL", "definition": "Materials", "examples": "steel"}]}
+TEXT = "The steel sample was annealed. The steel bar was rolled afterwards. " * 40
+
+
+def steel_responder(text, model):
+    """Raw model output marking every "steel" in a chunk"""
+    annotations = []
+    start = text.find("steel")
+    while start != -1:
+        annotations.append({"start_char": start, "end_char": start + 5, "text": "steel", "label": "MATERIAL"})
+        start = text.find("steel", start + 5)
+    return json.dumps({"annotations": annotations})
+
+
+class SlowStatusAdapter(FakeBatchAdapter):
+    """Fake adapter whose status check blocks like a provider request"""
+
+    def status(self, batch_id):
+        time.sleep(0.2)
+        return super().status(batch_id)
+
+
+def test_run_batch_keeps_event_loop_free():
+    async def run():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        ticking = asyncio.create_task(ticker())
+        adapter = SlowStatusAdapter(steel_responder, polls_until_done=2)
+        requests = [{"custom_id": "c-0", "model": "fake", "text": "steel", "prompt_tokens": 1}]
+        results = await run_batch(adapter, requests, poll_interval=0.01)
+        ticking.cancel()
+        return results, ticks
+
+    results, ticks = asyncio.run(run())
+    assert json.loads(results["c-0"]["content"])["annotations"][0]["text"] == "steel"
+    # Two blocking status checks of 0.2s each; the loop kept ticking through them
+    assert ticks >= 20, ticks
+    print(f"✅ run_batch polled in worker threads ({ticks} ticks while waiting)")
+
+
+def test_batch_job_runs_in_background():
+    async def run():
+        processor = FileProcessor()
+        store = BatchJobStore()
+        adapter = FakeBatchAdapter(steel_responder, polls_until_done=3)
+
+        def process(cancellation):
+            return processor.process_batch_files(
+                [{"id": "f1", "content": TEXT}], TAGSET, model="gpt-4o-mini",
+                execution="batch", batch_adapter=adapter, cancellation=cancellation
+            )
+
+        from app.config import settings
+        settings.batch_poll_interval = 0.01
+        job = start_batch_job("user-1", {"file_ids": ["f1"]}, process, store)
+        assert store.get("user-1", job["id"])["status"] == "in_progress"
+        assert store.get("user-2", job["id"]) is None
+
+        for _ in range(500):
+            if store.get("user-1", job["id"])["status"] != "in_progress":
+                break
+            await asyncio.sleep(0.01)
+        return store.get("user-1", job["id"])
+
+    job = asyncio.run(run())
+    assert job["status"] == "completed", job
+    file_result = job["result"]["results"][0]
+    assert file_result["status"] == "success", file_result
+    assert file_result["result"]["total_annotations"] == TEXT.count("steel")
+    print(f"✅ Background batch job completed with {file_result['result']['total_annotations']} annotations")
+
+
+def test_batch_job_cancellation():
+    async def run():
+        processor = FileProcessor()
+        store = BatchJobStore()
+        adapter = FakeBatchAdapter(steel_responder, polls_until_done=10 ** 6)
+
+        def process(cancellation):
+            return processor.process_batch_files(
+                [{"id": "f1", "content": TEXT}], TAGSET, model="gpt-4o-mini",
+                execution="batch", batch_adapter=adapter, cancellation=cancellation
+            )
+
+        from app.config import settings
+        settings.batch_poll_interval = 0.01
+        job = start_batch_job("user-1", {"file_ids": ["f1"]}, process, store)
+        await asyncio.sleep(0.05)
+        assert cancel_batch_job(job["id"])
+
+        for _ in range(500):
+            if store.get("user-1", job["id"])["status"] != "in_progress":
+                break
+            await asyncio.sleep(0.01)
+        return store.get("user-1", job["id"]), adapter
+
+    job, adapter = asyncio.run(run())
+    assert job["status"] == "cancelled", job
+    assert all(batch.get("cancelled") for batch in adapter.batches.values())
+    assert not cancel_batch_job(job["id"])
+    print("✅ Cancelled batch job stopped its provider batch")
+
+
+if __name__ == "__main__":
+    test_run_batch_keeps_event_loop_free()
+    test_batch_job_runs_in_background()
+    test_batch_job_cancellation()
+    print("🎉 All tests passed!")
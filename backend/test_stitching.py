@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Test script for boundary stitching (boundary_mode="stitch") with a scripted model
+"""
+
+import sys
+import asyncio
+from pathlib import Path
+
+# Add the current directory to Python path
+current_dir = Path(__file__).parent
+sys.path.insert(0, str(current_dir))
+
+from app.services.entity_table import EntityTable
+from app.services.llm_service import LLMService
+from app.services.prompt_compiler import compile_prompt
+
+PROMPT = compile_prompt([{"tag_name": "MATERIAL", "definition": "Materials", "examples": "steel"}])
+
+
+def make_service(window_annotations):
+    """LLMService whose model answers every boundary window with window_annotations(window_text)"""
+    service = LLMService.__new__(LLMService)
+
+    async def annotate_text(text, tag_definitions, model="gpt-4", temperature=0.1, max_tokens=4000):
+        return {"annotations": window_annotations(text), "input_tokens": 10, "output_tokens": 5}
+
+    service.annotate_text = annotate_text
+    return service
+
+
+def split_chunks(text, boundary):
+    return [
+        {"text": text[:boundary], "start_char": 0, "end_char": boundary, "chunk_id": 0},
+        {"text": text[boundary:], "start_char": boundary, "end_char": len(text), "chunk_id": 1}
+    ]
+
+
+def find(text, word):
+    """Window-relative annotation for word, as the model would report it"""
+    start = text.find(word)
+    return [{"start_char": start, "end_char": start + len(word), "text": word, "label": "MATERIAL"}] if start != -1 else []
+
+
+def test_word_split_boundary_without_touching_entities():
+    # Only the split word sends the boundary to the model; no chunk entity touches it
+    text = "A steel plate was coated with polyethylene and stored for a week."
+    boundary = text.index("polyethylene") + 4
+    entities = EntityTable.from_dicts(text, [
+        {"start_char": 2, "end_char": 7, "text": "steel", "label": "MATERIAL"}
+    ])
+    service = make_service(lambda window: find(window, "polyethylene"))
+
+    stitched, results, stats = asyncio.run(service._stitch_chunk_boundaries(
+        text, split_chunks(text, boundary), entities, PROMPT, "gpt-4o", 0.1, 500
+    ))
+    found = sorted(stitched.text_at(row) for row in range(len(stitched)))
+    assert found == ["polyethylene", "steel"], found
+    assert stats["requeried"] == 1 and stats["entities_replaced"] == 0, stats
+    assert results[0]["chunk_id"] == 1
+    print("✅ Word-split boundary stitched without touching entities")
+
+
+def test_window_miss_keeps_chunk_entities():
+    # The window answer comes back empty: the chunk entities at the boundary stay
+    text = "Samples of stainless steel were annealed at 900 C before testing."
+    boundary = text.index("stainless") + 4
+    entities = EntityTable.from_dicts(text, [
+        {"start_char": text.index("stainless"), "end_char": boundary, "text": "stai", "label": "MATERIAL"},
+        {"start_char": boundary, "end_char": text.index(" were"), "text": text[boundary:text.index(" were")], "label": "MATERIAL"}
+    ])
+    service = make_service(lambda window: [])
+
+    stitched, _, stats = asyncio.run(service._stitch_chunk_boundaries(
+        text, split_chunks(text, boundary), entities, PROMPT, "gpt-4o", 0.1, 500
+    ))
+    assert len(stitched) == 2, len(stitched)
+    assert stats["entities_replaced"] == 0, stats
+    print("✅ Window miss kept the chunk entities")
+
+
+def test_crossing_entity_replaces_truncated_halves():
+    text = "Samples of stainless steel were annealed at 900 C before testing."
+    boundary = text.index("stainless") + 4
+    entities = EntityTable.from_dicts(text, [
+        {"start_char": text.index("stainless"), "end_char": boundary, "text": "stai", "label": "MATERIAL"},
+        {"start_char": boundary, "end_char": text.index(" steel"), "text": "nless", "label": "MATERIAL"}
+    ])
+    service = make_service(lambda window: find(window, "stainless steel"))
+
+    stitched, _, stats = asyncio.run(service._stitch_chunk_boundaries(
+        text, split_chunks(text, boundary), entities, PROMPT, "gpt-4o", 0.1, 500
+    ))
+    found = [stitched.text_at(row) for row in range(len(stitched))]
+    assert found == ["stainless steel"], found
+    assert stats["entities_replaced"] == 2, stats
+    print("✅ Crossing entity replaced the truncated halves")
+
+
+if __name__ == "__main__":
+    test_word_split_boundary_without_touching_entities()
+    test_window_miss_keeps_chunk_entities()
+    test_crossing_entity_replaces_truncated_halves()
+    print("🎉 All tests passed!")
@@ -8,6 +8,7 @@ from helper_manual_annotations import (
     display_processing_summary,  # Function to show processing summary
     generate_label_colors,  # Function to generate colors for labels
     get_token_recommendations,  # Function to get token recommendations based on chunk size
+    get_tuning_samples,  # Chunk outcomes of this session's runs, to tune max_tokens
     validate_annotations_streamlit,  # Function to validate annotations
     fix_annotation_positions_streamlit,  # Function to fix annotation positions
     run_annotation_pipeline,  # Function to run the annotation pipeline
@@ -82,7 +83,8 @@ chunk_size = st.sidebar.slider("Chunk size (characters)", 200, 4000, 1000, step=
                               help="Size of text chunks to process separately")
 
 
-min_tokens, max_tokens_limit, default_tokens = get_token_recommendations(chunk_size)
+tuning_samples = get_tuning_samples(model, st.session_state.tag_df)
+min_tokens, max_tokens_limit, default_tokens = get_token_recommendations(chunk_size, tuning_samples)
 
 max_tokens = st.sidebar.slider(
     "Max tokens per response", 
@@ -91,6 +93,7 @@ max_tokens = st.sidebar.slider(
     default_tokens, 
     step=50,
     help=f"Recommended: {default_tokens} tokens for {chunk_size} character chunks"
+         + (f" (learned from {len(tuning_samples)} chunks annotated this session)" if len(tuning_samples) >= 20 else "")
 )
 
 # Show the relationship
@@ -513,9 +516,11 @@ if st.session_state.get("annotation_complete") and (st.session_state.get("annota
                 # Combine all annotations for validation
                 all_annotations = st.session_state.annotated_entities + st.session_state.manual_annotations
                 
+                # Large annotation sets skip the per-entity progress loop
                 validation_results = validate_annotations_streamlit(
                     st.session_state.text_data, 
-                    all_annotations
+                    all_annotations,
+                    mode='vectorized' if len(all_annotations) > 500 else 'standard'
                 )
                 
                 # Store validation results in session state
@@ -571,6 +576,10 @@ if st.session_state.get("annotation_complete") and (st.session_state.get("annota
                         st.write(f"**Overlap {i+1}:**")
                         st.write(f"- Entity 1: '{warning['entity1']['text']}' [{warning['entity1']['start_char']}:{warning['entity1']['end_char']}]")
                         st.write(f"- Entity 2: '{warning['entity2']['text']}' [{warning['entity2']['start_char']}:{warning['entity2']['end_char']}]")
+                    elif warning.get('type') == 'same_label_nesting':
+                        st.write(f"**Nested {warning['entity2']['label']} {i+1}:**")
+                        st.write(f"- Outer: '{warning['entity1']['text']}' [{warning['entity1']['start_char']}:{warning['entity1']['end_char']}]")
+                        st.write(f"- Inner: '{warning['entity2']['text']}' [{warning['entity2']['start_char']}:{warning['entity2']['end_char']}]")
                     else:
                         st.write(f"**Zero-length annotation {i+1}:** {warning}")
                 
@@ -0,0 +1,81 @@
+# document_index.py
+
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
+import numpy as np
+
+
+_TOKEN_PATTERN = re.compile(r"\S+")
+_WORD_PATTERN = re.compile(r"\w+")
+
+
+class DocumentIndex:
+    """
+    Boundary offsets of one document (line starts, whitespace tokens, word spans),
+    computed once and then looked up by bisection.
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+
+        self.line_starts = array("q", [0])
+        self.line_starts.extend(m.end() for m in re.finditer("\n", text))
+
+        self.token_starts = array("q")
+        self.token_ends = array("q")
+        for match in _TOKEN_PATTERN.finditer(text):
+            self.token_starts.append(match.start())
+            self.token_ends.append(match.end())
+
+        self.word_starts = array("q")
+        self.word_ends = array("q")
+        for match in _WORD_PATTERN.finditer(text):
+            self.word_starts.append(match.start())
+            self.word_ends.append(match.end())
+
+        self._codepoints = None
+
+    @property
+    def codepoints(self) -> np.ndarray:
+        """UTF-32 code points of the text for vectorized comparisons"""
+        if self._codepoints is None:
+            self._codepoints = np.frombuffer(self.text.encode('utf-32-le'), dtype=np.uint32)
+        return self._codepoints
+
+    def last_line_break(self, lo: int, hi: int) -> int:
+        """Position of the last newline in [lo, hi), or -1"""
+        index = bisect_left(self.line_starts, hi + 1) - 1
+        if index > 0 and self.line_starts[index] > lo:
+            return self.line_starts[index] - 1
+        return -1
+
+    def last_token_end(self, lo: int, hi: int) -> int:
+        """End offset of the last whitespace token ending in (lo, hi), or -1"""
+        index = bisect_left(self.token_ends, hi) - 1
+        if index >= 0 and self.token_ends[index] > lo:
+            return self.token_ends[index]
+        return -1
+
+    def splits_word(self, start: int, end: int) -> bool:
+        """True when either end of the span falls strictly inside a word"""
+        return self._inside_word(start) or self._inside_word(end)
+
+    def find_span(self, span: str, start: int = 0) -> int:
+        """First occurrence of span from start that does not cut a word, else the first occurrence"""
+        first = self.text.find(span, start)
+        idx = first
+        while idx != -1 and self.splits_word(idx, idx + len(span)):
+            idx = self.text.find(span, idx + 1)
+        return first if idx == -1 else idx
+
+    def _inside_word(self, pos: int) -> bool:
+        index = bisect_right(self.word_starts, pos) - 1
+        return index >= 0 and self.word_starts[index] < pos < self.word_ends[index]
+
+
+@lru_cache(maxsize=16)
+def get_document_index(text: str) -> DocumentIndex:
+    """Shared DocumentIndex for a text, reused across reruns of the app"""
+    return DocumentIndex(text)
@@ -1,16 +1,23 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import io
 import json
 import streamlit as st
 import pandas as pd
-from prompts_flat import build_annotation_prompt
+from prompts_flat import compile_prompts
+from document_index import get_document_index
 from llm_clients import LLMClient
 import html
 import time
 import streamlit.components.v1 as components
 import colorsys
 import hashlib
+import re
+import string
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 
 def display_annotated_entities_with_selection(entities_list):
     """
@@ -195,7 +202,7 @@ def highlight_text_with_entities_and_selection(text: str, entities: list, label_
     Enhanced version that handles both LLM and manual annotations with different styling.
     """
     import html
-    used_positions = set()
+    index = get_document_index(text)
     highlighted = []
     last_pos = 0
 
@@ -207,38 +214,29 @@ def highlight_text_with_entities_and_selection(text: str, entities: list, label_
         source = ent.get("source", "llm")
         color = label_colors.get(label, "#e0e0e0")  # fallback if missing
 
-        search_start = last_pos
-        found = False
-        while search_start < len(text):
-            idx = text.find(span, search_start)
-            if idx == -1:
-                break
-            if any(i in used_positions for i in range(idx, idx + len(span))):
-                search_start = idx + 1
-                continue
-            else:
-                highlighted.append(html.escape(text[last_pos:idx]))
-                
-                # Different styling for manual annotations
-                additional_class = "manual-annotation" if source == "manual" else ""
-                manual_color = "#ffeb3b" if source == "manual" else color
-                
-                # Improved HTML with better tooltip styling
-                highlighted.append(
-                    f'<span class="{additional_class}" style="background-color: {manual_color}; font-weight: bold; padding: 2px 4px; '
-                    f'border-radius: 3px; cursor: help; display: inline-block; '
-                    f'border: 1px solid {manual_color};" '
-                    f'data-tooltip="{html.escape(label)}" data-source="{source.upper()}">'
-                    f'{html.escape(span)}<span class="tooltip"></span></span>'
-                )
-                used_positions.update(range(idx, idx + len(span)))
-                last_pos = idx + len(span)
-                found = True
-                break
-
-        if not found:
+        # Trust the stored offsets when they still point at the entity text
+        idx = ent.get("start_char", -1)
+        if not (isinstance(idx, int) and last_pos <= idx and text[idx:idx + len(span)] == span):
+            idx = index.find_span(span, last_pos)
+        if idx == -1:
             continue
 
+        highlighted.append(html.escape(text[last_pos:idx]))
+        
+        # Different styling for manual annotations
+        additional_class = "manual-annotation" if source == "manual" else ""
+        manual_color = "#ffeb3b" if source == "manual" else color
+        
+        # Improved HTML with better tooltip styling
+        highlighted.append(
+            f'<span class="{additional_class}" style="background-color: {manual_color}; font-weight: bold; padding: 2px 4px; '
+            f'border-radius: 3px; cursor: help; display: inline-block; '
+            f'border: 1px solid {manual_color};" '
+            f'data-tooltip="{html.escape(label)}" data-source="{source.upper()}">'
+            f'{html.escape(span)}<span class="tooltip"></span></span>'
+        )
+        last_pos = idx + len(span)
+
     # Append any remaining text after all entities
     highlighted.append(html.escape(text[last_pos:]))
 
@@ -352,24 +350,73 @@ def display_chunk_progress(current_chunk, total_chunks, chunk_text, start_time=N
             key=f"chunk_preview_{current_chunk}"
         )
 
-# Dynamic token calculation based on chunk size
-def get_token_recommendations(chunk_size):
+# Tuning from this session's runs: share of chunks allowed to hit max_tokens, and history needed
+TUNING_TARGET_TRUNCATION = 0.02
+TUNING_MIN_SAMPLES = 20
+TUNING_OUTPUT_MARGIN = 0.1
+
+
+def record_tuning_sample(model, tag_set_hash, chunk_chars, response, max_tokens, parsed_ok):
+    """Remember a chunk's size, reply length and whether the reply looks cut off at max_tokens."""
+    output_tokens = estimate_tokens(response or "")
+    truncated = output_tokens >= 0.95 * max_tokens or (not parsed_ok and bool((response or "").strip()))
+    samples = st.session_state.setdefault('tuning_samples', {}).setdefault((model, tag_set_hash), [])
+    samples.append((chunk_chars, output_tokens, max_tokens, truncated))
+
+
+def get_tuning_samples(model, tag_df=None):
+    """Samples for the model and tag set, or for the model alone while the tag set has too few."""
+    all_samples = st.session_state.get('tuning_samples', {})
+    if tag_df is not None:
+        tag_samples = all_samples.get((model, compile_prompts(tag_df).tag_set_hash), [])
+        if len(tag_samples) >= TUNING_MIN_SAMPLES:
+            return tag_samples
+    return [sample for (sample_model, _), samples in all_samples.items() if sample_model == model for sample in samples]
+
+
+def tuned_max_tokens(samples, chunk_size):
+    """
+    max_tokens at which only TUNING_TARGET_TRUNCATION of chunks of this size would be cut off,
+    from output tokens per character; truncated replies count as larger than any observed one.
+    """
+    if not samples or len(samples) < TUNING_MIN_SAMPLES:
+        return None
+    ranked = sorted(float('inf') if truncated else output / chars
+                    for chars, output, _, truncated in samples if chars > 0)
+    ratio = ranked[min(len(ranked) - 1, int(np.ceil((1 - TUNING_TARGET_TRUNCATION) * len(ranked))) - 1)]
+    if ratio == float('inf'):
+        # Too many cut-off replies to read the tail: go half again past the largest known lower bound
+        ratio = max(max_tokens / chars for chars, _, max_tokens, truncated in samples if truncated and chars > 0) * 1.5
+    return int(np.ceil(ratio * chunk_size * (1 + TUNING_OUTPUT_MARGIN)))
+
+
+# Dynamic token calculation based on chunk size, tuned by this session's runs when there are enough
+def get_token_recommendations(chunk_size, samples=None):
     if chunk_size <= 500:
-        return 200, 800, 300
+        recommendation = 200, 800, 300
     elif chunk_size <= 1000:
-        return 300, 1200, 400
+        recommendation = 300, 1200, 400
     elif chunk_size <= 2000:
-        return 500, 1800, 1000
+        recommendation = 500, 1800, 1000
     elif chunk_size <= 3000:
-        return 700, 2500, 1400
+        recommendation = 700, 2500, 1400
     else:
-        return 1000, 3000, 1800
+        recommendation = 1000, 3000, 1800
+
+    learned = tuned_max_tokens(samples, chunk_size)
+    if learned is None:
+        return recommendation
+    min_tokens, max_tokens_limit, _ = recommendation
+    # Slider values move in steps of 50
+    default_tokens = int(np.ceil(learned / 50) * 50)
+    return min(min_tokens, default_tokens), max(max_tokens_limit, default_tokens), default_tokens
     
 def chunk_text(text: str, chunk_size: int):
     """
     Splits text into chunks of approximately chunk_size characters.
     Tries to split on newline or space to avoid cutting words abruptly.
     """
+    index = get_document_index(text)
     chunks = []
     start = 0
     length = len(text)
@@ -378,10 +425,10 @@ def chunk_text(text: str, chunk_size: int):
         if end >= length:
             chunks.append(text[start:])
             break
-        # Try to split on last newline before end
-        split_pos = text.rfind('\n', start, end)
+        # Try to split on last newline before end, then after the last whole word
+        split_pos = index.last_line_break(start, end)
         if split_pos == -1 or split_pos <= start:
-            split_pos = text.rfind(' ', start, end)
+            split_pos = index.last_token_end(start, end)
         if split_pos == -1 or split_pos <= start:
             split_pos = end  # fallback hard cut
 
@@ -400,7 +447,7 @@ def aggregate_entities(all_entities, offset):
 
 def highlight_text_with_entities(text: str, entities: list, label_colors: dict) -> str:
     import html
-    used_positions = set()
+    index = get_document_index(text)
     highlighted = []
     last_pos = 0
 
@@ -411,33 +458,24 @@ def highlight_text_with_entities(text: str, entities: list, label_colors: dict)
         label = ent["label"]
         color = label_colors.get(label, "#e0e0e0")  # fallback if missing
 
-        search_start = last_pos
-        found = False
-        while search_start < len(text):
-            idx = text.find(span, search_start)
-            if idx == -1:
-                break
-            if any(i in used_positions for i in range(idx, idx + len(span))):
-                search_start = idx + 1
-                continue
-            else:
-                highlighted.append(html.escape(text[last_pos:idx]))
-                # Improved HTML with better tooltip styling
-                highlighted.append(
-                    f'<span style="background-color: {color}; font-weight: bold; padding: 2px 4px; '
-                    f'border-radius: 3px; cursor: help; display: inline-block; '
-                    f'border: 1px solid {color};" '
-                    f'data-tooltip="{html.escape(label)}">'
-                    f'{html.escape(span)}</span>'
-                )
-                used_positions.update(range(idx, idx + len(span)))
-                last_pos = idx + len(span)
-                found = True
-                break
-
-        if not found:
+        # Trust the stored offsets when they still point at the entity text
+        idx = ent.get("start_char", -1)
+        if not (isinstance(idx, int) and last_pos <= idx and text[idx:idx + len(span)] == span):
+            idx = index.find_span(span, last_pos)
+        if idx == -1:
             continue
 
+        highlighted.append(html.escape(text[last_pos:idx]))
+        # Improved HTML with better tooltip styling
+        highlighted.append(
+            f'<span style="background-color: {color}; font-weight: bold; padding: 2px 4px; '
+            f'border-radius: 3px; cursor: help; display: inline-block; '
+            f'border: 1px solid {color};" '
+            f'data-tooltip="{html.escape(label)}">'
+            f'{html.escape(span)}</span>'
+        )
+        last_pos = idx + len(span)
+
     # Append any remaining text after all entities
     highlighted.append(html.escape(text[last_pos:]))
 
@@ -544,7 +582,7 @@ def display_annotated_entities():
         # Use Streamlit's HTML component to render the complete HTML
         components.html(full_html, height=400, scrolling=True)
 
-def validate_annotations_streamlit(text, entities):
+def validate_annotations_streamlit(text, entities, mode='standard'):
     """
     Validate that start_char and end_char positions in annotations match the actual text.
     Modified for Streamlit integration.
@@ -552,11 +590,16 @@ def validate_annotations_streamlit(text, entities):
     Args:
         text (str): The source text
         entities (list): List of entity dictionaries
+        mode (str): 'standard' checks entities one by one with a progress bar,
+            'vectorized' runs the checks over NumPy arrays in one go
     
     Returns:
         dict: Validation results with errors and statistics
     """
     
+    if mode == 'vectorized':
+        return validate_annotations_vectorized(text, entities)
+    
     validation_results = {
         'total_entities': len(entities),
         'correct_entities': 0,
@@ -649,6 +692,120 @@ def validate_annotations_streamlit(text, entities):
     
     return validation_results
 
+def validate_annotations_vectorized(text, entities):
+    """
+    Columnar version of validate_annotations_streamlit.
+    Starts, ends and label ids are loaded into NumPy arrays; bounds, zero-length spans,
+    overlaps and same-label nesting are found with array operations and only the
+    failing spans are sliced out of the text.
+    """
+    validation_results = {
+        'total_entities': len(entities),
+        'correct_entities': 0,
+        'errors': [],
+        'warnings': []
+    }
+    if not entities:
+        return validation_results
+    
+    count = len(entities)
+    starts = np.zeros(count, dtype=np.int64)
+    ends = np.zeros(count, dtype=np.int64)
+    complete = np.zeros(count, dtype=bool)
+    expected_texts = []
+    
+    for i, entity in enumerate(entities):
+        start_char = entity.get('start_char')
+        end_char = entity.get('end_char')
+        expected_text = entity.get('text')
+        expected_texts.append(expected_text if isinstance(expected_text, str) else '')
+        if None in [start_char, end_char, expected_text]:
+            continue
+        try:
+            starts[i] = int(start_char)
+            ends[i] = int(end_char)
+            complete[i] = True
+        except (TypeError, ValueError):
+            continue
+    
+    label_lookup = {}
+    label_ids = np.fromiter(
+        (label_lookup.setdefault(entity.get('label'), len(label_lookup)) for entity in entities),
+        dtype=np.int64,
+        count=count
+    )
+    
+    # Python slicing clamps out-of-range offsets, so mirror that to keep results identical
+    text_length = len(text)
+    clamped_starts = np.clip(np.where(starts < 0, starts + text_length, starts), 0, text_length)
+    clamped_ends = np.clip(np.where(ends < 0, ends + text_length, ends), 0, text_length)
+    slice_lengths = np.maximum(clamped_ends - clamped_starts, 0)
+    expected_lengths = np.fromiter((len(t) for t in expected_texts), dtype=np.int64, count=count)
+    
+    # Same length spans are compared code point by code point in one gather
+    matches = complete & (slice_lengths == expected_lengths)
+    candidates = np.flatnonzero(matches & (expected_lengths > 0))
+    if len(candidates):
+        document = get_document_index(text).codepoints
+        expected = np.frombuffer(''.join(expected_texts[i] for i in candidates).encode('utf-32-le'), dtype=np.uint32)
+        lengths = expected_lengths[candidates]
+        offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        gather = np.repeat(clamped_starts[candidates] - offsets, lengths) + np.arange(len(expected))
+        differs = np.add.reduceat(document[gather] != expected, offsets) > 0
+        matches[candidates[differs]] = False
+    
+    validation_results['correct_entities'] = int(np.count_nonzero(matches))
+    
+    for i in np.flatnonzero(~matches):
+        entity = entities[i]
+        error_info = {
+            'entity_index': int(i),
+            'expected_text': entity.get('text'),
+            'start_char': entity.get('start_char'),
+            'end_char': entity.get('end_char'),
+            'label': entity.get('label', 'Unknown')
+        }
+        if complete[i]:
+            error_info['actual_text'] = text[starts[i]:ends[i]]
+        else:
+            error_info['error'] = 'Missing required fields'
+        validation_results['errors'].append(error_info)
+    
+    # Overlaps between neighbours in start order
+    positioned = np.flatnonzero([('start_char' in e and 'end_char' in e) for e in entities])
+    positioned = positioned[complete[positioned]]
+    order = positioned[np.argsort(starts[positioned], kind='stable')]
+    if len(order) > 1:
+        overlapping = ends[order[:-1]] > starts[order[1:]]
+        for current_idx, next_idx in zip(order[:-1][overlapping], order[1:][overlapping]):
+            validation_results['warnings'].append({
+                'type': 'overlap',
+                'entity1': entities[current_idx],
+                'entity2': entities[next_idx]
+            })
+    
+    # Spans nested inside an earlier span with the same label
+    spans = np.flatnonzero(complete & (starts >= 0) & (ends > starts))
+    if len(spans) > 1:
+        nest_order = spans[np.lexsort((-ends[spans], starts[spans], label_ids[spans]))]
+        stride = int(ends[nest_order].max()) + 1
+        shifted_ends = ends[nest_order] + label_ids[nest_order] * stride
+        running_max = np.maximum.accumulate(shifted_ends)
+        nested = np.concatenate(([False], shifted_ends[1:] <= running_max[:-1]))
+        setter = np.maximum.accumulate(np.where(shifted_ends == running_max, np.arange(len(nest_order)), 0))
+        for pos in np.flatnonzero(nested):
+            validation_results['warnings'].append({
+                'type': 'same_label_nesting',
+                'entity1': entities[nest_order[setter[pos - 1]]],
+                'entity2': entities[nest_order[pos]]
+            })
+    
+    # Zero-length annotations are reported as the entities themselves
+    zero_length = np.flatnonzero([e.get('start_char') == e.get('end_char') for e in entities])
+    validation_results['warnings'].extend(entities[i] for i in zero_length)
+    
+    return validation_results
+
 def find_all_occurrences(text, pattern):
     """Find all occurrences of pattern in text"""
     positions = []
@@ -800,132 +957,166 @@ def fix_annotation_positions_streamlit(text, entities, strategy='closest'):
     return fixed_entities, stats
 
 
-def evaluate_annotations_with_llm(entities, tag_df, client, temperature=0.1, max_tokens=2000):
+# Evaluation batches are sized by prompt tokens and by the verdicts that fit max_tokens
+EVALUATION_BATCH_TOKENS = 3000
+EVALUATION_TOKENS_PER_VERDICT = 120
+EVALUATION_MAX_BATCH_SIZE = 25
+EVALUATION_MAX_RETRIES = 2
+EVALUATION_MAX_WORKERS = 4
+
+
+def plan_evaluation_batches(entities, indices, max_tokens):
+    """Split entity indices into batches within the prompt token and output budgets."""
+    size_limit = max(1, min(max_tokens // EVALUATION_TOKENS_PER_VERDICT, EVALUATION_MAX_BATCH_SIZE))
+    batches, current, current_tokens = [], [], 0
+    for index in indices:
+        entity = entities[index]
+        # Rendered entity block in the evaluation prompt, plus its share of the JSON reply format
+        tokens = estimate_tokens(f"{entity.get('text', '')} {entity.get('label', '')}") + 20
+        if current and (len(current) >= size_limit or current_tokens + tokens > EVALUATION_BATCH_TOKENS):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(index)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def evaluation_group_key(entity, text=None, context_words=0):
+    """Normalized (surface text, label) key, plus a short hash of nearby words when text is given."""
+    surface = " ".join(str(entity.get('text', '')).split()).strip(string.punctuation + "“”‘’").casefold()
+    key = f"{surface}\x1f{entity.get('label', '')}"
+    if text and context_words > 0 and 'start_char' in entity and 'end_char' in entity:
+        start, end = int(entity['start_char']), int(entity['end_char'])
+        left = re.findall(r"\w+", text[max(0, start - 20 * context_words):start])[-context_words:]
+        right = re.findall(r"\w+", text[end:end + 20 * context_words])[:context_words]
+        signature = " ".join(left).lower() + "|" + " ".join(right).lower()
+        key += "\x1f" + hashlib.sha1(signature.encode('utf-8')).hexdigest()[:12]
+    return key
+
+
+def _match_batch_evaluations(batch_evaluations, batch_indices):
+    """Map parsed evaluations to global entity indices via the 1-based entity_index of the prompt."""
+    matched = {}
+    for eval_result in batch_evaluations:
+        local_idx = eval_result.get('entity_index', 0) - 1
+        if 0 <= local_idx < len(batch_indices) and batch_indices[local_idx] not in matched:
+            eval_result['entity_index'] = batch_indices[local_idx]
+            matched[batch_indices[local_idx]] = eval_result
+    return matched
+
+
+def evaluate_annotations_with_llm(entities, tag_df, client, temperature=0.1, max_tokens=2000,
+                                  text=None, context_words=0):
     """
     Use LLM to evaluate whether annotations match their label definitions.
-    FIXED VERSION with better error handling and entity tracking.
+    Entities are grouped by normalized (text, label) key and each group is judged
+    once; verdicts are kept per tag set, model and temperature in the session and
+    reused by later runs.
+    Batches run concurrently; groups whose verdicts are missing are retried in
+    follow-up rounds before falling back to manual review.
     """
     if not entities:
         st.warning("No entities to evaluate")
         return []
         
-    from prompts_flat import build_evaluation_prompt
-    
-    # Split entities into batches if too many (to avoid token limits)
-    batch_size = 20  # REDUCED from 50 to ensure better processing
-    all_evaluations = []
-    
-    entity_batches = [entities[i:i + batch_size] for i in range(0, len(entities), batch_size)]
-    
-    st.write(f"📊 Processing {len(entities)} entities in {len(entity_batches)} batches...")
-    
-    for batch_idx, entity_batch in enumerate(entity_batches):
-        st.write(f"🤖 Evaluating batch {batch_idx + 1}/{len(entity_batches)} ({len(entity_batch)} entities)...")
-        
-        try:
-            prompt = build_evaluation_prompt(tag_df, entity_batch)
-            
-            with st.spinner(f"LLM evaluating batch {batch_idx + 1}..."):
-                response = client.generate(prompt, temperature=temperature, max_tokens=max_tokens)
-                
-                # Debug: Show raw response
-                with st.expander(f"🔍 Debug: Batch {batch_idx + 1} Raw Response", expanded=False):
+    # Tag section is rendered once for all batches
+    prompts = compile_prompts(tag_df)
+    verdict_cache = st.session_state.setdefault('evaluation_verdict_cache', {}).setdefault(
+        (prompts.tag_set_hash, getattr(client, 'model', None), float(temperature)), {}
+    )
+
+    keys = [evaluation_group_key(entity, text, context_words) for entity in entities]
+    groups = {}
+    for entity_idx, key in enumerate(keys):
+        groups.setdefault(key, []).append(entity_idx)
+    cached_keys = {key for key in groups if key in verdict_cache}
+    st.write(f"🧮 {len(entities)} entities form {len(groups)} distinct (text, label) groups; "
+             f"{len(cached_keys)} already judged in this session")
+
+    evaluations = {}
+    batch_stats = []
+    failures = {}
+    pending = [members[0] for key, members in groups.items() if key not in cached_keys]
+    ctx = get_script_run_ctx()
+
+    def run_batch(batch_indices):
+        # Worker threads need the script context for st calls made inside the client
+        add_script_run_ctx(threading.current_thread(), ctx)
+        started = time.time()
+        prompt = prompts.evaluation_prompt([entities[i] for i in batch_indices])
+        response = client.generate(prompt, temperature=temperature, max_tokens=max_tokens)
+        return response, time.time() - started
+
+    for round_idx in range(EVALUATION_MAX_RETRIES + 1):
+        if not pending:
+            break
+        batches = plan_evaluation_batches(entities, pending, max_tokens)
+        st.write(f"📊 Round {round_idx + 1}: evaluating {len(pending)} groups in {len(batches)} concurrent batches...")
+
+        with ThreadPoolExecutor(max_workers=EVALUATION_MAX_WORKERS) as executor:
+            futures = [executor.submit(run_batch, batch_indices) for batch_indices in batches]
+            # Responses are parsed here, on the script thread
+            for batch_idx, (batch_indices, future) in enumerate(zip(batches, futures)):
+                try:
+                    response, latency = future.result()
+                except Exception as e:
+                    st.error(f"❌ Batch {batch_idx + 1} failed: {e}")
+                    failures.update(dict.fromkeys(batch_indices, str(e)))
+                    continue
+
+                with st.expander(f"🔍 Debug: Round {round_idx + 1} Batch {batch_idx + 1} Raw Response", expanded=False):
                     st.text(f"Response length: {len(response) if response else 0} characters")
                     st.code(response[:500] + "..." if len(response) > 500 else response, language="text")
-                
-                batch_evaluations = parse_evaluation_response(response, batch_idx)
-                
-                # CRITICAL FIX: Ensure we have evaluation for each entity in batch
-                if len(batch_evaluations) != len(entity_batch):
-                    st.warning(f"⚠️ Batch {batch_idx + 1}: Expected {len(entity_batch)} evaluations, got {len(batch_evaluations)}")
-                    
-                    # Fill missing evaluations with default values
-                    for i in range(len(entity_batch)):
-                        global_entity_idx = batch_idx * batch_size + i
-                        
-                        # Check if we have evaluation for this entity
-                        found_eval = False
-                        for eval_result in batch_evaluations:
-                            if eval_result.get('entity_index') == i:  # Local batch index
-                                # Update to global index
-                                eval_result['entity_index'] = global_entity_idx
-                                found_eval = True
-                                break
-                        
-                        # If no evaluation found, create a default one
-                        if not found_eval:
-                            entity = entity_batch[i]
-                            default_eval = {
-                                'entity_index': global_entity_idx,
-                                'current_text': entity.get('text', ''),
-                                'current_label': entity.get('label', ''),
-                                'is_correct': False,  # Conservative default
-                                'recommendation': 'manual_review',
-                                'reasoning': 'LLM evaluation failed - requires manual review',
-                                'suggested_label': entity.get('label', ''),
-                                'confidence': 0.0
-                            }
-                            batch_evaluations.append(default_eval)
-                            st.warning(f"Created default evaluation for entity {global_entity_idx}")
-                else:
-                    # Update entity indices to global indices
-                    for i, eval_result in enumerate(batch_evaluations):
-                        # eval_result['entity_index'] = batch_idx * batch_size + eval_result.get('entity_index', i)
-                        eval_result['entity_index'] = batch_idx * batch_size + i
-                
-                all_evaluations.extend(batch_evaluations)
-                st.success(f"✅ Batch {batch_idx + 1} completed! Processed {len(batch_evaluations)} evaluations.")
-                
-        except Exception as e:
-            st.error(f"❌ Batch {batch_idx + 1} failed: {e}")
-            
-            # Create default evaluations for failed batch
-            for i, entity in enumerate(entity_batch):
-                global_entity_idx = batch_idx * batch_size + i
-                default_eval = {
-                    'entity_index': global_entity_idx,
-                    'current_text': entity.get('text', ''),
-                    'current_label': entity.get('label', ''),
-                    'is_correct': False,
-                    'recommendation': 'manual_review',
-                    'reasoning': f'Batch evaluation failed: {str(e)}',
-                    'suggested_label': entity.get('label', ''),
-                    'confidence': 0.0
-                }
-                all_evaluations.append(default_eval)
-            
-            st.warning(f"Created {len(entity_batch)} default evaluations for failed batch")
-    
-    # FINAL VERIFICATION: Ensure we have evaluation for every entity
-    if len(all_evaluations) != len(entities):
-        st.error(f"❌ CRITICAL: Expected {len(entities)} evaluations, got {len(all_evaluations)}")
-        
-        # Find missing entities and create default evaluations
-        evaluated_indices = set(eval_result.get('entity_index', -1) for eval_result in all_evaluations)
-        missing_indices = set(range(len(entities))) - evaluated_indices
-        
-        if missing_indices:
-            st.warning(f"Creating default evaluations for {len(missing_indices)} missing entities: {sorted(missing_indices)}")
-            
-            for entity_idx in missing_indices:
-                if entity_idx < len(entities):
-                    entity = entities[entity_idx]
-                    default_eval = {
-                        'entity_index': entity_idx,
-                        'current_text': entity.get('text', ''),
-                        'current_label': entity.get('label', ''),
-                        'is_correct': False,
-                        'recommendation': 'manual_review',
-                        'reasoning': 'Missing from LLM evaluation - requires manual review',
-                        'suggested_label': entity.get('label', ''),
-                        'confidence': 0.0
-                    }
-                    all_evaluations.append(default_eval)
-        
-        # Sort evaluations by entity_index to maintain order
-        all_evaluations.sort(key=lambda x: x.get('entity_index', 0))
-    
-    st.success(f"🎉 Evaluation completed! Generated {len(all_evaluations)} evaluations for {len(entities)} entities.")
+
+                matched = _match_batch_evaluations(parse_evaluation_response(response, batch_idx), batch_indices)
+                evaluations.update(matched)
+                batch_stats.append({
+                    'round': round_idx + 1,
+                    'batch': batch_idx + 1,
+                    'size': len(batch_indices),
+                    'verdicts': len(matched),
+                    'latency_s': round(latency, 2),
+                    'est_output_tokens': estimate_tokens(response or "")
+                })
+
+        pending = [index for index in pending if index not in evaluations]
+        if pending:
+            st.warning(f"⚠️ {len(pending)} groups have no verdict after round {round_idx + 1}")
+
+    st.session_state.evaluation_batch_stats = batch_stats
+
+    for entity_idx, evaluation in evaluations.items():
+        verdict_cache[keys[entity_idx]] = evaluation
+
+    all_evaluations = []
+    for entity_idx, entity in enumerate(entities):
+        verdict = verdict_cache.get(keys[entity_idx])
+        if verdict is not None:
+            # The group's verdict, re-pointed at this instance
+            all_evaluations.append({
+                **verdict,
+                'entity_index': entity_idx,
+                'current_text': entity.get('text', ''),
+                'current_label': entity.get('label', ''),
+                'group_size': len(groups[keys[entity_idx]])
+            })
+            continue
+        reason = failures.get(groups[keys[entity_idx]][0])
+        all_evaluations.append({
+            'entity_index': entity_idx,
+            'current_text': entity.get('text', ''),
+            'current_label': entity.get('label', ''),
+            'is_correct': False,  # Conservative default
+            'recommendation': 'manual_review',
+            'reasoning': f'Batch evaluation failed: {reason}' if reason else 'Missing from LLM evaluation - requires manual review',
+            'suggested_label': entity.get('label', ''),
+            'confidence': 0.0
+        })
+
+    st.success(f"🎉 Evaluation completed! {len(evaluations)} groups judged by the LLM and {len(cached_keys)} "
+               f"reused for {len(entities)} entities in {len(batch_stats)} batches.")
     return all_evaluations
 
 
@@ -1231,6 +1422,7 @@ def run_annotation_pipeline(text, tag_df, client, temperature, max_tokens, chunk
     4. Aggregate and return full list of entities
     """
     chunks = chunk_text(text, chunk_size)
+    prompts = compile_prompts(tag_df)
     all_entities = []
     char_pos = 0
     
@@ -1249,9 +1441,11 @@ def run_annotation_pipeline(text, tag_df, client, temperature, max_tokens, chunk
             
             # Process the chunk
             with st.spinner(f"🤖 Calling {st.session_state.model_provider} API..."):
-                prompt = build_annotation_prompt(tag_df, chunk)
+                prompt = prompts.annotation_prompt(chunk)
                 response = client.generate(prompt, temperature=temperature, max_tokens=max_tokens)
                 entities = parse_llm_response(response)
+                record_tuning_sample(client.model, prompts.tag_set_hash, len(chunk), response, max_tokens,
+                                     parsed_ok=bool(entities) or response.strip() in ("[]", '{"annotations": []}'))
                 entities = aggregate_entities(entities, char_pos)
                 all_entities.extend(entities)
                 
@@ -3,6 +3,8 @@
 import pandas as pd
 from typing import List
 import json
+import hashlib
+from functools import lru_cache
 import streamlit as st
 
 
@@ -20,61 +22,79 @@ def format_tag_section(tag_df: pd.DataFrame) -> str:
         tag_texts.append(tag_block)
     return "\n".join(tag_texts)
 
-def build_annotation_prompt(tag_df: pd.DataFrame, chunk_text: str,
-                            few_shot_examples: list = None) -> str:
+SUFFIX_MAP = {
+    "properties": "property", "property": "properties",
+    "methods": "method", "method": "methods",
+    "types": "type", "type": "types",
+    "conditions": "condition", "condition": "conditions",
+    "processes": "process", "process": "processes",
+    "analyses": "analysis", "analysis": "analyses",
+    "results": "result", "result": "results"
+}
+
+
+def generate_exclusion_variants(name: str) -> set:
     """
-    Build prompt with hard exclusion on tag label variants including plural/singular, separators, and casing.
+    Casing, separator and plural/singular variants of a tag name.
+    """
+    base = name.lower().replace('_', ' ').replace('-', ' ')
+    tokens = base.split()
+    variants = set()
+    separators = [' ', '-', '_']
+    casings = [str.lower, str.upper, str.title, str.capitalize]
+
+    for sep in separators:
+        combined = sep.join(tokens)
+        for case_fn in casings:
+            form = case_fn(combined)
+            variants.add(form)
+
+            # Add plural/singular variants
+            for plural, singular in SUFFIX_MAP.items():
+                if form.endswith(plural):
+                    variants.add(case_fn(form[:-len(plural)] + singular))
+                if form.endswith(singular):
+                    variants.add(case_fn(form[:-len(singular)] + plural))
+
+    return variants
+
+
+class CompiledPrompts:
+    """
+    Prompt pieces for one tag set (tag section, exclusion list, few-shot block),
+    rendered once and reused for every chunk and evaluation batch.
     """
-    tag_section = format_tag_section(tag_df)
-
-    def generate_exclusion_variants(name: str) -> set:
-        suffix_map = {
-            "properties": "property", "property": "properties",
-            "methods": "method", "method": "methods",
-            "types": "type", "type": "types",
-            "conditions": "condition", "condition": "conditions",
-            "processes": "process", "process": "processes",
-            "analyses": "analysis", "analysis": "analyses",
-            "results": "result", "result": "results"
-        }
-
-        base = name.lower().replace('_', ' ').replace('-', ' ')
-        tokens = base.split()
-        variants = set()
-        separators = [' ', '-', '_']
-        casings = [str.lower, str.upper, str.title, str.capitalize]
-
-        for sep in separators:
-            combined = sep.join(tokens)
-            for case_fn in casings:
-                form = case_fn(combined)
-                variants.add(form)
-
-                # Add plural/singular variants
-                for plural, singular in suffix_map.items():
-                    if form.endswith(plural):
-                        variants.add(case_fn(form[:-len(plural)] + singular))
-                    if form.endswith(singular):
-                        variants.add(case_fn(form[:-len(singular)] + plural))
-
-        return variants
-
-    exclusion_terms = set()
-    if 'tag_name' in tag_df.columns:
-        for tag_name in tag_df['tag_name']:
-            exclusion_terms.update(generate_exclusion_variants(tag_name))
-        exclusion_list = ", ".join(f'"{term}"' for term in sorted(exclusion_terms))
-    else:
-        exclusion_list = ""
-
-    few_shot_section = ""
-    if few_shot_examples:
-        few_shot_section = "\nFEW-SHOT EXAMPLES:\n"
-        for i, example in enumerate(few_shot_examples[:3], 1):
-            few_shot_section += f"\nExample {i}:\nText: \"{example['text']}\"\nOutput: {example['output']}\n"
-        few_shot_section += "\n"
-
-    prompt = f"""You are a scientific named entity recognition (NER) expert. Extract entities that match the SEMANTIC MEANING of tag definitions, not the literal tag labels themselves.
+
+    def __init__(self, tag_rows: tuple, has_tag_names: bool, few_shot: tuple):
+        self.tag_rows = tag_rows
+        self.tag_set_hash = hashlib.sha256(
+            json.dumps([tag_rows, few_shot], ensure_ascii=False).encode('utf-8')
+        ).hexdigest()
+        self.tag_section = "\n".join(
+            f"TAG: {tag_name}\nDefinition: {definition}\nExamples: {examples}\n"
+            for tag_name, definition, examples in tag_rows
+        )
+
+        if has_tag_names:
+            exclusion_terms = set()
+            for tag_name, _, _ in tag_rows:
+                exclusion_terms.update(generate_exclusion_variants(tag_name))
+            self.exclusion_list = ", ".join(f'"{term}"' for term in sorted(exclusion_terms))
+        else:
+            self.exclusion_list = ""
+
+        few_shot_section = ""
+        if few_shot:
+            few_shot_section = "\nFEW-SHOT EXAMPLES:\n"
+            for i, (text, output) in enumerate(few_shot[:3], 1):
+                few_shot_section += f"\nExample {i}:\nText: \"{text}\"\nOutput: {output}\n"
+            few_shot_section += "\n"
+        self.few_shot_section = few_shot_section
+
+        # Everything before and after the chunk text is fixed for the tag set
+        exclusion_list = self.exclusion_list
+        tag_section = self.tag_section
+        self._annotation_prefix = f"""You are a scientific named entity recognition (NER) expert. Extract entities that match the SEMANTIC MEANING of tag definitions, not the literal tag labels themselves.
 
 STRICT RULES:
 • STRICTLY DO NOT annotate any of the following tag names, even if they appear in a different form: {exclusion_list}
@@ -96,28 +116,26 @@ BAD ANNOTATIONS:
 TAG DEFINITIONS:
 {tag_section}{few_shot_section}
 TARGET TEXT:
-{chunk_text}
+"""
+        self._annotation_suffix = """
 
 Return valid JSON array of entities with start_char, end_char, text, and label fields:"""
 
-    return prompt
+    def annotation_prompt(self, chunk_text: str) -> str:
+        return self._annotation_prefix + chunk_text + self._annotation_suffix
 
+    def evaluation_prompt(self, entities: list) -> str:
+        tag_section = self.tag_section
 
-def build_evaluation_prompt(tag_df: pd.DataFrame, entities: list) -> str:
-    """
-    Build a prompt for evaluating whether annotated entities are correctly labeled according to tag definitions.
-    """
-    tag_section = format_tag_section(tag_df)
+        # Format annotated entities
+        entities_text = ""
+        for i, entity in enumerate(entities):
+            entities_text += f"Entity {i+1}:\n"
+            entities_text += f"- Text: \"{entity['text']}\"\n"
+            entities_text += f"- Assigned Label: {entity['label']}\n"
+            entities_text += f"- Character Range: [{entity['start_char']}:{entity['end_char']}]\n\n"
 
-    # Format annotated entities
-    entities_text = ""
-    for i, entity in enumerate(entities):
-        entities_text += f"Entity {i+1}:\n"
-        entities_text += f"- Text: \"{entity['text']}\"\n"
-        entities_text += f"- Assigned Label: {entity['label']}\n"
-        entities_text += f"- Character Range: [{entity['start_char']}:{entity['end_char']}]\n\n"
-
-    prompt = f"""
+        return f"""
 You are a domain expert in annotation quality control. Your task is to evaluate whether each annotated entity below has been labeled appropriately, based on the provided label definitions.
 
 ====================
@@ -144,7 +162,7 @@ For each entity, assess the following:
 ✅ **Response Format** (as a JSON array):
 [
   {{
-    "entity_index": 0,
+    "entity_index": 1,
     "current_text": "original entity text",
     "current_label": "assigned_label",
     "is_correct": true/false,
@@ -155,8 +173,41 @@ For each entity, assess the following:
   ...
 ]
 
-🔁 Return one JSON object per entity, in the same order they appear above.
+🔁 Return one JSON object per entity, in the same order they appear above, with entity_index set to the entity number shown above.
 🧠 Your reasoning must be helpful and actionable for improving annotation quality.
 """
 
-    return prompt
+
+@lru_cache(maxsize=32)
+def _compile(tag_rows: tuple, has_tag_names: bool, few_shot: tuple) -> CompiledPrompts:
+    return CompiledPrompts(tag_rows, has_tag_names, few_shot)
+
+
+def compile_prompts(tag_df: pd.DataFrame, few_shot_examples: list = None) -> CompiledPrompts:
+    """
+    Compiled prompts for a tag set, cached by tag set content. Call once per run and
+    reuse the result; this is the only place the tag DataFrame is walked.
+    """
+    tag_rows = tuple(
+        (str(row['tag_name']), str(row['definition']), str(row['examples']))
+        for _, row in tag_df.iterrows()
+    )
+    few_shot = tuple(
+        (str(example['text']), str(example['output'])) for example in (few_shot_examples or [])[:3]
+    )
+    return _compile(tag_rows, 'tag_name' in tag_df.columns, few_shot)
+
+
+def build_annotation_prompt(tag_df: pd.DataFrame, chunk_text: str,
+                            few_shot_examples: list = None) -> str:
+    """
+    Build prompt with hard exclusion on tag label variants including plural/singular, separators, and casing.
+    """
+    return compile_prompts(tag_df, few_shot_examples).annotation_prompt(chunk_text)
+
+
+def build_evaluation_prompt(tag_df: pd.DataFrame, entities: list) -> str:
+    """
+    Build a prompt for evaluating whether annotated entities are correctly labeled according to tag definitions.
+    """
+    return compile_prompts(tag_df).evaluation_prompt(entities)